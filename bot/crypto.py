@@ -5,6 +5,7 @@
 """
 import base64
 import secrets
+from functools import lru_cache
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.backends import default_backend
@@ -20,6 +21,12 @@ def _get_key(key_bytes: bytes) -> bytes:
     return key_bytes[:32]
 
 
+@lru_cache(maxsize=8)
+def _cipher(key_bytes: bytes) -> Cipher:
+    """AES-256-ECB для ключа — создаётся один раз (encrypt/decrypt вызываются на каждом апдейте и в циклах экспорта)."""
+    return Cipher(algorithms.AES(_get_key(key_bytes)), modes.ECB(), backend=default_backend())
+
+
 def encrypt(plaintext: str, key: bytes) -> str:
     """
     Шифрует строку. Один и тот же plaintext + key → один и тот же результат.
@@ -27,12 +34,10 @@ def encrypt(plaintext: str, key: bytes) -> str:
     """
     if not plaintext:
         return ""
-    key = _get_key(key)
     data = plaintext.encode("utf-8")
     padder = padding.PKCS7(128).padder()
     padded = padder.update(data) + padder.finalize()
-    cipher = Cipher(algorithms.AES(key), modes.ECB(), backend=default_backend())
-    encryptor = cipher.encryptor()
+    encryptor = _cipher(key).encryptor()
     ct = encryptor.update(padded) + encryptor.finalize()
     return base64.urlsafe_b64encode(ct).decode("ascii").rstrip("=")
 
@@ -41,7 +46,6 @@ def decrypt(ciphertext: str, key: bytes) -> str:
     """Расшифровывает строку, зашифрованную encrypt()."""
     if not ciphertext:
         return ""
-    key = _get_key(key)
     # Restore padding for base64
     pad = 4 - len(ciphertext) % 4
     if pad != 4:
@@ -50,8 +54,7 @@ def decrypt(ciphertext: str, key: bytes) -> str:
         ct = base64.urlsafe_b64decode(ciphertext.encode("ascii"))
     except Exception:
         return ""
-    cipher = Cipher(algorithms.AES(key), modes.ECB(), backend=default_backend())
-    decryptor = cipher.decryptor()
+    decryptor = _cipher(key).decryptor()
     padded = decryptor.update(ct) + decryptor.finalize()
     unpadder = padding.PKCS7(128).unpadder()
     data = unpadder.update(padded) + unpadder.finalize()
@@ -1,12 +1,15 @@
-from .models import Base, User, Referral, Broadcast, Grade, GradeClaim, UtmToken, ContactEntry, BotSetting
+from .models import Base, User, Referral, Broadcast, Grade, GradeClaim, UtmToken, ReferralLink, ContactEntry, BotSetting, FsmRecord, SchemaVersion
 from .crud import (
     get_or_create_user,
     get_user_by_telegram_id,
     get_user_by_email,
     get_user_referrals,
+    get_referred_users_page,
     get_user_referral_count,
+    get_referral_counts,
     create_referral,
     get_all_users,
+    get_all_users_with_referral_counts,
     get_top_referrers,
     create_broadcast,
     update_user_subscription,
@@ -20,6 +23,7 @@ from .crud import (
     update_grade,
     delete_grade,
     get_users_for_grade,
+    get_grade_users_page,
     get_user_achieved_grade_ids,
     create_grade_claim,
     get_user_grade_claims,
@@ -31,7 +35,14 @@ from .crud import (
     get_encrypted_by_token,
     get_referrer_by_utm_tokens,
     get_referral_tokens_for_user,
+    get_user_referral_link,
+    refresh_user_referral_link,
+    ensure_utm_tokens_bulk,
+    prepare_referral_links_batch,
     get_all_utm_tokens_for_key_export,
+    load_bot_settings,
+    get_bot_settings,
+    set_bot_setting,
     get_contacts_section_visible,
     set_contacts_section_visible,
     get_contact_entries,
@@ -40,7 +51,7 @@ from .crud import (
     update_contact_entry,
     delete_contact_entry,
 )
-from .session import get_session, init_db
+from .session import get_session, init_db, get_db_settings_report
 
 __all__ = [
     "Base",
@@ -50,15 +61,21 @@ __all__ = [
     "Grade",
     "GradeClaim",
     "UtmToken",
+    "ReferralLink",
     "ContactEntry",
     "BotSetting",
+    "FsmRecord",
+    "SchemaVersion",
     "get_or_create_user",
     "get_user_by_telegram_id",
     "get_user_by_email",
     "get_user_referrals",
+    "get_referred_users_page",
     "get_user_referral_count",
+    "get_referral_counts",
     "create_referral",
     "get_all_users",
+    "get_all_users_with_referral_counts",
     "get_top_referrers",
     "create_broadcast",
     "update_user_subscription",
@@ -72,6 +89,7 @@ __all__ = [
     "update_grade",
     "delete_grade",
     "get_users_for_grade",
+    "get_grade_users_page",
     "get_user_achieved_grade_ids",
     "create_grade_claim",
     "get_user_grade_claims",
@@ -83,7 +101,14 @@ __all__ = [
     "get_encrypted_by_token",
     "get_referrer_by_utm_tokens",
     "get_referral_tokens_for_user",
+    "get_user_referral_link",
+    "refresh_user_referral_link",
+    "ensure_utm_tokens_bulk",
+    "prepare_referral_links_batch",
     "get_all_utm_tokens_for_key_export",
+    "load_bot_settings",
+    "get_bot_settings",
+    "set_bot_setting",
     "get_contacts_section_visible",
     "set_contacts_section_visible",
     "get_contact_entries",
@@ -93,4 +118,5 @@ __all__ = [
     "delete_contact_entry",
     "get_session",
     "init_db",
+    "get_db_settings_report",
 ]
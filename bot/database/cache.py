@@ -0,0 +1,154 @@
+"""
+In-memory кэши поверх БД для самых частых экранов.
+Изменения в БД идут через crud, который обновляет/сбрасывает соответствующий кэш.
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from bot.config import settings
+
+
+class SettingsCache:
+    """
+    Все строки bot_settings в памяти (ключ → строковое значение) с типизированным чтением.
+    Загружается при старте бота, запись — write-through из crud.
+    """
+
+    def __init__(self):
+        self._values: Dict[str, str] = {}
+        self.loaded = False
+
+    def replace_all(self, values: Dict[str, str]) -> None:
+        self._values = dict(values)
+        self.loaded = True
+
+    def put(self, key: str, value: str) -> None:
+        self._values[key] = value
+
+    def invalidate(self) -> None:
+        """Сбросить кэш: следующее чтение перезагрузит настройки из БД."""
+        self._values = {}
+        self.loaded = False
+
+    def get_str(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        return self._values.get(key, default)
+
+    def get_bool(self, key: str, default: bool = False) -> bool:
+        value = self._values.get(key)
+        if value is None:
+            return default
+        return value.strip().lower() in ("1", "true", "yes")
+
+    def get_int(self, key: str, default: int = 0) -> int:
+        try:
+            return int(self._values[key])
+        except (KeyError, ValueError):
+            return default
+
+
+settings_cache = SettingsCache()
+
+
+class RenderedTextCache:
+    """
+    Готовый текст экрана, собранный из данных БД. Сбрасывается при изменении данных.
+    version защищает от записи устаревшего текста, собранного до сброса.
+    """
+
+    def __init__(self):
+        self._text: Optional[str] = None
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self) -> Optional[str]:
+        if self._text is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return self._text
+
+    def set(self, text: str, version: int) -> None:
+        """Сохранить текст, если с момента чтения данных (version) кэш не сбрасывали."""
+        if version == self.version:
+            self._text = text
+
+    def invalidate(self) -> None:
+        self._text = None
+        self.version += 1
+
+
+# Список контактов для кнопки «Связаться»
+contacts_message_cache = RenderedTextCache()
+
+
+class LRUCache:
+    """Словарь ограниченного размера: при переполнении вытесняется давно не читанный ключ."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# Реферальные ссылки: telegram_id → URL
+referral_link_cache = LRUCache(settings.REFERRAL_LINK_CACHE_SIZE)
+
+
+class InvalidationBus:
+    """
+    Сброс кэшей в других процессах бота (режим нескольких воркеров, WORKERS > 1).
+    Кэши регистрируются по имени; publish отправляет имя через транспорт воркера,
+    deliver сбрасывает кэш при получении. В одном процессе транспорта нет — publish ничего не делает.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, Callable[[], None]] = {}
+        self._transport: Optional[Callable[[str], None]] = None
+
+    def register(self, name: str, handler: Callable[[], None]) -> None:
+        self._handlers[name] = handler
+
+    def set_transport(self, transport: Optional[Callable[[str], None]]) -> None:
+        self._transport = transport
+
+    def publish(self, name: str) -> None:
+        if self._transport is not None:
+            self._transport(name)
+
+    def deliver(self, name: str) -> None:
+        handler = self._handlers.get(name)
+        if handler is not None:
+            handler()
+
+
+invalidation_bus = InvalidationBus()
+invalidation_bus.register("bot_settings", settings_cache.invalidate)
+invalidation_bus.register("contacts_message", contacts_message_cache.invalidate)
@@ -1,24 +1,35 @@
 import json
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional, List, Tuple
-from sqlalchemy import select, func, desc
+from sqlalchemy import select, func, desc, exists, delete
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.config import settings
 from bot.crypto import encrypt as crypto_encrypt, decrypt as crypto_decrypt, generate_token
-from .models import User, Referral, Broadcast, Grade, GradeClaim, UtmToken, ContactEntry, BotSetting
+from .models import User, Referral, Broadcast, Grade, GradeClaim, UtmToken, ContactEntry, BotSetting, ReferralLink
+from .dialect import dialect_insert
+from .cache import settings_cache, contacts_message_cache, referral_link_cache, invalidation_bus
+from .session import on_commit
+from .writer import run_write
+
+
+@lru_cache(maxsize=1)
+def _encryption_key() -> bytes:
+    """Ключ шифрования из настроек (вычисляется один раз); b"" — шифрование выключено."""
+    key = getattr(settings, "encryption_key_bytes", None) or b""
+    return key if len(key) >= 16 and key != b"\x00" * 32 else b""
 
 
 def _encryption_enabled() -> bool:
     """Шифрование включено, если задан ключ (не пустой и не нули)."""
-    key = getattr(settings, "encryption_key_bytes", None) or b""
-    return len(key) >= 16 and key != b"\x00" * 32
+    return bool(_encryption_key())
 
 
 def _encrypt(plain: str) -> str:
     if not plain or not _encryption_enabled():
         return plain
-    return crypto_encrypt(plain, settings.encryption_key_bytes)
+    return crypto_encrypt(plain, _encryption_key())
 
 
 def _decrypt(cipher: str) -> str:
@@ -27,7 +38,7 @@ def _decrypt(cipher: str) -> str:
     if not _encryption_enabled():
         return cipher
     try:
-        return crypto_decrypt(cipher, settings.encryption_key_bytes)
+        return crypto_decrypt(cipher, _encryption_key())
     except Exception:
         return cipher  # legacy plain value
 
@@ -65,33 +76,44 @@ async def get_or_create_user(
     referrer_id: Optional[int] = None,
     is_admin: bool = False,
 ) -> tuple[User, bool]:
-    """Get existing user or create new one. Returns (user, created)."""
+    """
+    Get existing user or create new one. Returns (user, created).
+    Существующий — одним SELECT, запись только если сменились ник или имя. Новый — INSERT ... ON CONFLICT
+    (telegram_id) DO NOTHING RETURNING: строка вернулась — создан этим вызовом (одновременные /start
+    одного пользователя не упираются в уникальный индекс).
+    """
+    # username храним зашифрованным (шифрование детерминированное — сравниваем зашифрованные значения)
+    enc_username = None
+    if username is not None and username.strip():
+        enc_username = _encrypt(username.strip())
     user = await get_user_by_telegram_id(session, telegram_id)
-    
-    if user:
-        # Update user info if changed (username храним зашифрованным)
-        if username is not None:
-            enc_username = _encrypt(username.strip()) if username.strip() else None
-            if user.username != enc_username:
-                user.username = enc_username
-        if first_name and user.first_name != first_name:
-            user.first_name = first_name
+    if user is None:
+        stmt = dialect_insert(session.get_bind().dialect.name, User).values(
+            telegram_id=telegram_id,
+            username=enc_username,
+            first_name=first_name,
+            referrer_id=None,  # Устанавливается через CSV из CRM, не при создании
+            is_admin=is_admin,
+            created_at=datetime.utcnow(),
+        ).on_conflict_do_nothing(index_elements=[User.telegram_id])
+        result = await session.execute(stmt.returning(User), execution_options={"populate_existing": True})
+        user = result.scalar_one_or_none()
+        if user is not None:
+            return user, True
+        # Создан параллельным апдейтом между SELECT и INSERT
+        user = await get_user_by_telegram_id(session, telegram_id)
+
+    username_changed = username is not None and user.username != enc_username
+    if username_changed:
+        user.username = enc_username
+    if first_name and user.first_name != first_name:
+        user.first_name = first_name
+    if session.is_modified(user):
         await session.flush()
-        return user, False
-    
-    # Create new user (referrer_id НЕ устанавливается при создании — будет установлен через CSV из CRM)
-    enc_username = _encrypt(username.strip()) if (username and username.strip()) else None
-    user = User(
-        telegram_id=telegram_id,
-        username=enc_username,
-        first_name=first_name,
-        referrer_id=None,  # Устанавливается через CSV
-        is_admin=is_admin,
-    )
-    session.add(user)
-    await session.flush()
-    
-    return user, True
+        if username_changed:
+            # Ник входит в utm_medium реферальной ссылки
+            await refresh_user_referral_link(session, user)
+    return user, False
 
 
 async def get_user_by_email(session: AsyncSession, email: str) -> Optional[User]:
@@ -100,11 +122,11 @@ async def get_user_by_email(session: AsyncSession, email: str) -> Optional[User]
     enc = _encrypt(email_clean)
     result = await session.execute(select(User).where(User.email == enc))
     row = result.scalar_one_or_none()
-    if row:
+    if row or enc == email_clean:
         return row
-    # Legacy: если в БД ещё хранится открытый email
+    # Legacy: если в БД ещё хранится открытый email (бот всегда писал его в нижнем регистре)
     result = await session.execute(
-        select(User).where(func.lower(User.email) == email_clean)
+        select(User).where(User.email == email_clean)
     )
     return result.scalar_one_or_none()
 
@@ -124,12 +146,12 @@ async def get_user_by_email_and_phone(
         )
     )
     row = result.scalar_one_or_none()
-    if row:
+    if row or (enc_email == email_clean and enc_phone == norm_phone):
         return row
-    # Legacy: plain in DB
+    # Legacy: plain in DB (email — в нижнем регистре, как его всегда писал бот)
     result = await session.execute(
         select(User).where(
-            func.lower(User.email) == email_clean,
+            User.email == email_clean,
             User.phone == norm_phone,
         )
     )
@@ -142,6 +164,7 @@ async def update_user_email(session: AsyncSession, telegram_id: int, email: str)
     if user:
         user.email = _encrypt(email.lower().strip())
         await session.flush()
+        await refresh_user_referral_link(session, user)
     return user
 
 
@@ -157,36 +180,72 @@ async def update_user_phone(session: AsyncSession, telegram_id: int, phone: str)
     if user:
         user.phone = _encrypt(normalize_phone(phone))
         await session.flush()
+        await refresh_user_referral_link(session, user)
     return user
 
 
 # ============ UTM Tokens (короткие токены для ссылок и выгрузки) ============
 
+UTM_TOKEN_LENGTH = 8
+# Попыток вставки при совпадении случайного токена (62^8 вариантов — на практике хватает одной)
+_UTM_TOKEN_ATTEMPTS = 5
+
+
+def _insert_ignore(session: AsyncSession, model):
+    """INSERT ... ON CONFLICT DO NOTHING для диалекта текущей БД (sqlite / postgresql)."""
+    return dialect_insert(session.get_bind().dialect.name, model).on_conflict_do_nothing()
+
+
+def _upsert(session: AsyncSession, model, index_elements: list, values: dict, update: List[str]):
+    """INSERT ... ON CONFLICT (index_elements) DO UPDATE SET колонки update из excluded (sqlite / postgresql)."""
+    stmt = dialect_insert(session.get_bind().dialect.name, model).values(values)
+    return stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={name: stmt.excluded[name] for name in update},
+    )
+
+
+async def _find_utm_token(session: AsyncSession, encrypted_value: str, value_type: str) -> Optional[str]:
+    result = await session.execute(
+        select(UtmToken.token).where(
+            UtmToken.encrypted_value == encrypted_value,
+            UtmToken.value_type == value_type,
+        )
+    )
+    return result.scalar_one_or_none()
+
+
 async def get_or_create_utm_token(
     session: AsyncSession, encrypted_value: str, value_type: str
 ) -> str:
-    """Вернуть короткий токен для зашифрованного значения (email, phone или username). Один значение → один токен."""
+    """
+    Вернуть короткий токен для зашифрованного значения (email, phone или username). Один значение → один токен.
+    Новый токен выделяется одним INSERT ... ON CONFLICT DO NOTHING: уникальность обеспечивают
+    ограничения таблицы, а не предварительные SELECT. Если вставка ничего не вернула — значение
+    уже записал параллельный вызов (перечитываем) либо совпал случайный токен (пробуем другой).
+    """
     if not encrypted_value or value_type not in ("email", "phone", "username"):
         return ""
-    result = await session.execute(
-        select(UtmToken).where(
-            UtmToken.encrypted_value == encrypted_value,
-            UtmToken.value_type == value_type,
+    token = await _find_utm_token(session, encrypted_value, value_type)
+    if token:
+        return token
+    for _ in range(_UTM_TOKEN_ATTEMPTS):
+        result = await session.execute(
+            _insert_ignore(session, UtmToken)
+            .values(
+                token=generate_token(UTM_TOKEN_LENGTH),
+                encrypted_value=encrypted_value,
+                value_type=value_type,
+            )
+            .returning(UtmToken.token)
         )
-    )
-    row = result.scalar_one_or_none()
-    if row:
-        return row.token
-    token = generate_token(8)
-    # Убедиться, что токен уникален
-    while True:
-        r = await session.execute(select(UtmToken).where(UtmToken.token == token))
-        if r.scalar_one_or_none() is None:
-            break
-        token = generate_token(8)
-    session.add(UtmToken(token=token, encrypted_value=encrypted_value, value_type=value_type))
-    await session.flush()
-    return token
+        token = result.scalar_one_or_none()
+        if token:
+            return token
+        token = await _find_utm_token(session, encrypted_value, value_type)
+        if token:
+            return token
+    raise RuntimeError(f"Не удалось выделить уникальный UTM-токен ({value_type})")
 
 
 async def get_encrypted_by_token(session: AsyncSession, token: str) -> Optional[str]:
@@ -242,6 +301,215 @@ async def get_referral_tokens_for_user(
     return token_medium, token_campaign, token_content
 
 
+async def get_user_referral_link(
+    session: AsyncSession, telegram_id: int, user: Optional[User] = None
+) -> Optional[str]:
+    """
+    Реферальная ссылка пользователя: LRU в памяти → таблица referral_links → сборка из токенов
+    (с сохранением в referral_links; без шифрования — сборка на лету). None — если не указаны email и телефон.
+    Сборка с сохранением (новые UTM-токены и строка referral_links) — запись, она идёт через run_write.
+    """
+    link = referral_link_cache.get(telegram_id)
+    if link is not None:
+        return link
+    row = await session.get(ReferralLink, telegram_id)
+    # Сменился REGISTRATION_URL — пересобрать, как при промахе (токены уже выданы)
+    if row is not None and row.link.startswith(settings.REGISTRATION_URL.rstrip("/")):
+        referral_link_cache.put(telegram_id, row.link)
+        return row.link
+    if user is None:
+        user = await get_user_by_telegram_id(session, telegram_id)
+    if not user or not user.email or not user.phone:
+        return None
+    if not _encryption_enabled():
+        return await _build_referral_link(session, user)
+    return await run_write(session, lambda db: _build_referral_link(db, user))
+
+
+def _compose_referral_link(
+    user: User, token_medium: str, token_campaign: str, token_content: str
+) -> Optional[Tuple[str, str, str, str]]:
+    """(medium, campaign, content, link); пустые токены заменяются открытыми значениями. None — если нет почты/телефона."""
+    if not token_medium and user.username:
+        token_medium = decrypt_username(user.username) or user.username or ""
+    if not token_campaign and user.email:
+        token_campaign = decrypt_email(user.email) or user.email
+    if not token_content and user.phone:
+        token_content = decrypt_phone(user.phone) or user.phone
+    if not token_campaign or not token_content:
+        return None
+    token_medium = token_medium or ""
+    link = settings.get_referral_link(
+        token_medium=token_medium,
+        token_campaign=token_campaign,
+        token_content=token_content,
+    )
+    return token_medium, token_campaign, token_content, link
+
+
+async def _build_referral_link(session: AsyncSession, user: Optional[User]) -> Optional[str]:
+    """
+    Собрать ссылку из UTM-токенов и сохранить её в referral_links (в LRU — после commit).
+    Без шифрования в ссылке открытые email и телефон: она собирается на лету и нигде не сохраняется.
+    """
+    if not user or not user.email or not user.phone:
+        return None
+    parts = _compose_referral_link(user, *await get_referral_tokens_for_user(session, user))
+    if parts is None:
+        return None
+    token_medium, token_campaign, token_content, link = parts
+    if not _encryption_enabled():
+        return link
+    telegram_id = user.telegram_id
+    # Upsert: ссылку этого пользователя может одновременно сохранять предгенерация
+    values = {
+        "user_id": telegram_id,
+        "token_medium": token_medium,
+        "token_campaign": token_campaign,
+        "token_content": token_content,
+        "link": link,
+        "updated_at": datetime.utcnow(),
+    }
+    await session.execute(
+        _upsert(session, ReferralLink, [ReferralLink.user_id], values, list(values)[1:]).returning(ReferralLink),
+        execution_options={"populate_existing": True},
+    )
+    on_commit(session, lambda: referral_link_cache.put(telegram_id, link))
+    return link
+
+
+async def refresh_user_referral_link(session: AsyncSession, user: User) -> Optional[str]:
+    """Сбросить сохранённую ссылку (сменились email/телефон/ник) и собрать заново, если данных достаточно."""
+    telegram_id = user.telegram_id
+    referral_link_cache.pop(telegram_id)
+    on_commit(session, lambda: referral_link_cache.pop(telegram_id))
+    if not user.email or not user.phone or not _encryption_enabled():
+        await session.execute(delete(ReferralLink).where(ReferralLink.user_id == telegram_id))
+    if not user.email or not user.phone:
+        return None
+    return await _build_referral_link(session, user)
+
+
+async def _select_utm_tokens(
+    session: AsyncSession, value_type: str, encrypted_values: List[str]
+) -> dict[str, str]:
+    """{зашифрованное значение: токен} для уже выданных токенов одного типа."""
+    if not encrypted_values:
+        return {}
+    result = await session.execute(
+        select(UtmToken.encrypted_value, UtmToken.token).where(
+            UtmToken.value_type == value_type,
+            UtmToken.encrypted_value.in_(encrypted_values),
+        )
+    )
+    return dict(result.all())
+
+
+async def ensure_utm_tokens_bulk(
+    session: AsyncSession, value_type: str, encrypted_values: List[str]
+) -> Tuple[dict[str, str], int]:
+    """
+    Выдать токены сразу для многих значений одного типа: один SELECT по уже выданным,
+    один многострочный INSERT ... ON CONFLICT DO NOTHING для недостающих и повторный SELECT.
+    Возвращает ({зашифрованное значение: токен}, сколько токенов создано).
+    """
+    values = list(dict.fromkeys(v for v in encrypted_values if v))
+    tokens = await _select_utm_tokens(session, value_type, values)
+    missing = [v for v in values if v not in tokens]
+    if not missing:
+        return tokens, 0
+    await session.execute(
+        _insert_ignore(session, UtmToken).values([
+            {"token": generate_token(UTM_TOKEN_LENGTH), "encrypted_value": v, "value_type": value_type}
+            for v in missing
+        ])
+    )
+    tokens.update(await _select_utm_tokens(session, value_type, missing))
+    # Строки, пропущенные из-за совпадения случайного токена, — по одной
+    for v in missing:
+        if v not in tokens:
+            tokens[v] = await get_or_create_utm_token(session, v, value_type)
+    return tokens, len(missing)
+
+
+async def prepare_referral_links_batch(
+    session: AsyncSession, after_telegram_id: int = 0, limit: int = 500
+) -> Tuple[Optional[int], int, int]:
+    """
+    Пачка для предварительной генерации ссылок: пользователи с email и телефоном,
+    telegram_id > after_telegram_id. Создаёт недостающие UTM-токены, записывает
+    referral_links и (после commit) прогревает LRU-кэш ссылок.
+    Возвращает (последний telegram_id пачки или None, если пользователей больше нет,
+    создано токенов, записано ссылок). Без шифрования генерировать нечего: ссылки с открытыми
+    email и телефоном не сохраняются.
+    """
+    if not _encryption_enabled():
+        return None, 0, 0
+    result = await session.execute(
+        select(User)
+        .where(
+            User.telegram_id > after_telegram_id,
+            User.email.is_not(None),
+            User.phone.is_not(None),
+        )
+        .order_by(User.telegram_id)
+        .limit(limit)
+    )
+    users = list(result.scalars().all())
+    if not users:
+        return None, 0, 0
+
+    created = 0
+    by_type: dict[str, dict[str, str]] = {}
+    for value_type, attr in (("username", "username"), ("email", "email"), ("phone", "phone")):
+        by_type[value_type], n = await ensure_utm_tokens_bulk(
+            session, value_type, [getattr(u, attr) for u in users]
+        )
+        created += n
+
+    existing = await session.execute(
+        select(ReferralLink).where(ReferralLink.user_id.in_([u.telegram_id for u in users]))
+    )
+    rows = {row.user_id: row for row in existing.scalars().all()}
+    new_rows = []
+    links: dict[int, str] = {}
+    for user in users:
+        tokens = (
+            by_type["username"].get(user.username, "") if user.username else "",
+            by_type["email"].get(user.email, ""),
+            by_type["phone"].get(user.phone, ""),
+        )
+        parts = _compose_referral_link(user, *tokens)
+        if parts is None:
+            continue
+        token_medium, token_campaign, token_content, link = parts
+        links[user.telegram_id] = link
+        row = rows.get(user.telegram_id)
+        if row is None:
+            new_rows.append({
+                "user_id": user.telegram_id,
+                "token_medium": token_medium,
+                "token_campaign": token_campaign,
+                "token_content": token_content,
+                "link": link,
+            })
+        elif row.link != link:
+            row.token_medium = token_medium
+            row.token_campaign = token_campaign
+            row.token_content = token_content
+            row.link = link
+    if new_rows:
+        await session.execute(_insert_ignore(session, ReferralLink).values(new_rows))
+    await session.flush()
+
+    def _warm() -> None:
+        for telegram_id, link in links.items():
+            referral_link_cache.put(telegram_id, link)
+
+    on_commit(session, _warm)
+    return users[-1].telegram_id, created, len(links)
+
+
 async def get_all_utm_tokens_for_key_export(
     session: AsyncSession,
 ) -> List[Tuple[str, str, str]]:
@@ -310,6 +578,25 @@ async def get_all_users(session: AsyncSession, active_only: bool = True) -> List
     return list(result.scalars().all())
 
 
+async def get_all_users_with_referral_counts(session: AsyncSession) -> List[Tuple[User, int]]:
+    """Все пользователи с числом активных рефералов — одним запросом (для выгрузки в CSV)."""
+    referral_count = (
+        select(
+            Referral.referrer_id,
+            func.count(Referral.id).label("count")
+        )
+        .where(Referral.is_active == True)
+        .group_by(Referral.referrer_id)
+        .subquery()
+    )
+    result = await session.execute(
+        select(User, func.coalesce(referral_count.c.count, 0))
+        .outerjoin(referral_count, User.telegram_id == referral_count.c.referrer_id)
+        .order_by(User.id)
+    )
+    return [(user, count) for user, count in result.all()]
+
+
 async def update_user_subscription(session: AsyncSession, telegram_id: int, is_subscribed: bool) -> None:
     """Update user subscription status."""
     user = await get_user_by_telegram_id(session, telegram_id)
@@ -342,6 +629,31 @@ async def get_user_referrals(session: AsyncSession, telegram_id: int) -> List[Re
     return list(result.scalars().all())
 
 
+async def get_referred_users_page(
+    session: AsyncSession, telegram_id: int, limit: int = 20, offset: int = 0
+) -> Tuple[List[Tuple[Optional[str], Optional[str], datetime]], int]:
+    """
+    Страница подтверждённых рефералов одним запросом (referrals JOIN users).
+    Возвращает ([(first_name, username (зашифрован), дата реферала)], всего рефералов).
+    """
+    total = func.count().over().label("total")
+    result = await session.execute(
+        select(User.first_name, User.username, Referral.created_at, total)
+        .join(User, User.telegram_id == Referral.referred_id)
+        .where(
+            Referral.referrer_id == telegram_id,
+            Referral.is_active == True
+        )
+        .order_by(Referral.id)
+        .limit(limit)
+        .offset(offset)
+    )
+    rows = result.all()
+    if not rows:
+        return [], 0
+    return [(r.first_name, r.username, r.created_at) for r in rows], rows[0].total
+
+
 async def get_user_referral_count(session: AsyncSession, telegram_id: int) -> int:
     """Get count of active referrals for a user."""
     result = await session.execute(
@@ -353,6 +665,23 @@ async def get_user_referral_count(session: AsyncSession, telegram_id: int) -> in
     return result.scalar() or 0
 
 
+async def get_referral_counts(session: AsyncSession, telegram_ids: List[int]) -> dict[int, int]:
+    """{telegram_id: число активных рефералов} для нескольких пользователей одним запросом (нет рефералов — 0)."""
+    if not telegram_ids:
+        return {}
+    result = await session.execute(
+        select(Referral.referrer_id, func.count(Referral.id))
+        .where(
+            Referral.referrer_id.in_(telegram_ids),
+            Referral.is_active == True
+        )
+        .group_by(Referral.referrer_id)
+    )
+    counts = dict.fromkeys(telegram_ids, 0)
+    counts.update(result.all())
+    return counts
+
+
 async def get_top_referrers(session: AsyncSession, limit: int = 10) -> List[tuple[User, int]]:
     """Get top referrers with their referral count."""
     # Subquery to count referrals
@@ -411,34 +740,52 @@ async def create_broadcast(
     return broadcast
 
 
+# ============ Bot settings (ключ-значение, кэшируются в памяти) ============
+
+async def load_bot_settings(session: AsyncSession) -> None:
+    """Загрузить все строки bot_settings в кэш (при старте бота)."""
+    result = await session.execute(select(BotSetting.key, BotSetting.value))
+    settings_cache.replace_all({key: value for key, value in result.all()})
+
+
+async def get_bot_settings(session: AsyncSession):
+    """Кэш настроек; из БД читается только если ещё не загружен."""
+    if not settings_cache.loaded:
+        await load_bot_settings(session)
+    return settings_cache
+
+
+async def set_bot_setting(session: AsyncSession, key: str, value: str) -> None:
+    """Записать настройку в БД; в кэш — после commit (до него другие апдейты видят прежнее значение)."""
+    await session.execute(
+        _upsert(session, BotSetting, [BotSetting.key], {"key": key, "value": value}, ["value"])
+    )
+    on_commit(session, lambda: settings_cache.put(key, value))
+    on_commit(session, lambda: invalidation_bus.publish("bot_settings"))
+
+
 # ============ Contact entries (кнопка «Связаться») ============
 
 CONTACTS_VISIBLE_KEY = "contacts_section_visible"
 
 
 async def get_contacts_section_visible(session: AsyncSession) -> bool:
-    """Видимость кнопки «Связаться» и списка контактов для пользователей."""
-    result = await session.execute(
-        select(BotSetting).where(BotSetting.key == CONTACTS_VISIBLE_KEY)
-    )
-    row = result.scalar_one_or_none()
-    if not row:
-        return False
-    return row.value.strip().lower() in ("1", "true", "yes")
+    """Видимость кнопки «Связаться» и списка контактов для пользователей (из кэша настроек)."""
+    cache = await get_bot_settings(session)
+    return cache.get_bool(CONTACTS_VISIBLE_KEY)
 
 
 async def set_contacts_section_visible(session: AsyncSession, visible: bool) -> None:
     """Включить/выключить видимость раздела контактов."""
-    result = await session.execute(
-        select(BotSetting).where(BotSetting.key == CONTACTS_VISIBLE_KEY)
-    )
-    row = result.scalar_one_or_none()
-    value = "1" if visible else "0"
-    if row:
-        row.value = value
-    else:
-        session.add(BotSetting(key=CONTACTS_VISIBLE_KEY, value=value))
-    await session.flush()
+    await set_bot_setting(session, CONTACTS_VISIBLE_KEY, "1" if visible else "0")
+    _invalidate_contacts_message(session)
+
+
+def _invalidate_contacts_message(session: AsyncSession) -> None:
+    """Сбросить кэш текста «Связаться» сейчас и ещё раз после commit (чтобы не закэшировать старые данные)."""
+    contacts_message_cache.invalidate()
+    on_commit(session, contacts_message_cache.invalidate)
+    on_commit(session, lambda: invalidation_bus.publish("contacts_message"))
 
 
 async def get_contact_entries(
@@ -469,6 +816,7 @@ async def create_contact_entry(
     )
     session.add(entry)
     await session.flush()
+    _invalidate_contacts_message(session)
     return entry
 
 
@@ -501,6 +849,7 @@ async def update_contact_entry(
     if is_active is not None:
         entry.is_active = is_active
     await session.flush()
+    _invalidate_contacts_message(session)
     return entry
 
 
@@ -511,6 +860,7 @@ async def delete_contact_entry(session: AsyncSession, entry_id: int) -> bool:
         return False
     await session.delete(entry)
     await session.flush()
+    _invalidate_contacts_message(session)
     return True
 
 
@@ -622,6 +972,56 @@ async def get_users_for_grade(session: AsyncSession, grade_id: int) -> List[tupl
     return [(row[0], row[1]) for row in result.all()]
 
 
+async def get_grade_users_page(
+    session: AsyncSession,
+    grade_id: int,
+    referral_threshold: int,
+    limit: int = 30,
+    offset: int = 0,
+) -> Tuple[List[Tuple[int, Optional[str], Optional[str], int, bool]], int]:
+    """
+    Страница пользователей, достигших грейда, вместе с отметкой о выдаче — одним запросом.
+    Возвращает ([(telegram_id, first_name, username (зашифрован), referral_count, claimed)], всего).
+    """
+    referral_count = (
+        select(
+            Referral.referrer_id,
+            func.count(Referral.id).label("count")
+        )
+        .where(Referral.is_active == True)
+        .group_by(Referral.referrer_id)
+        .subquery()
+    )
+    claimed = exists().where(
+        GradeClaim.user_id == User.telegram_id,
+        GradeClaim.grade_id == grade_id,
+    )
+    total = func.count().over().label("total")
+    result = await session.execute(
+        select(
+            User.telegram_id,
+            User.first_name,
+            User.username,
+            referral_count.c.count,
+            claimed.label("claimed"),
+            total,
+        )
+        .join(referral_count, User.telegram_id == referral_count.c.referrer_id)
+        .where(referral_count.c.count >= referral_threshold)
+        .where(User.is_active == True)
+        .order_by(User.id)
+        .limit(limit)
+        .offset(offset)
+    )
+    rows = result.all()
+    if not rows:
+        return [], 0
+    return (
+        [(r.telegram_id, r.first_name, r.username, r.count, bool(r.claimed)) for r in rows],
+        rows[0].total,
+    )
+
+
 async def get_user_achieved_grade_ids(session: AsyncSession, telegram_id: int) -> List[int]:
     """Get list of grade IDs that user has achieved (referral_count >= threshold)."""
     ref_count = await get_user_referral_count(session, telegram_id)
@@ -636,16 +1036,19 @@ async def create_grade_claim(
     user_id: int,
     grade_id: int,
     issued_by_admin: bool = True,
-) -> GradeClaim:
-    """Record that reward for grade was issued to user."""
-    claim = GradeClaim(
-        user_id=user_id,
-        grade_id=grade_id,
-        issued_by_admin=issued_by_admin,
-    )
-    session.add(claim)
-    await session.flush()
-    return claim
+) -> Optional[GradeClaim]:
+    """Record that reward for grade was issued to user. None — если награда уже была отмечена."""
+    result = await session.execute(
+        _insert_ignore(session, GradeClaim)
+        .values(
+            user_id=user_id,
+            grade_id=grade_id,
+            issued_by_admin=issued_by_admin,
+            claimed_at=datetime.utcnow(),
+        )
+        .returning(GradeClaim)
+    )
+    return result.scalar_one_or_none()
 
 
 async def get_user_grade_claims(session: AsyncSession, telegram_id: int) -> List[GradeClaim]:
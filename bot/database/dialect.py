@@ -0,0 +1,9 @@
+"""INSERT с ON CONFLICT для диалекта текущей БД (SQLite / PostgreSQL)."""
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+def dialect_insert(dialect_name: str, model):
+    """insert(model) с on_conflict_do_nothing / on_conflict_do_update для указанного диалекта."""
+    if dialect_name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
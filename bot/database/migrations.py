@@ -0,0 +1,263 @@
+"""
+Версионные миграции схемы БД (SQLite / PostgreSQL).
+
+Применённые версии хранятся в таблице schema_version. При старте бота (init_db) или из
+консоли (scripts/migrate.py) выполняются все миграции с версией больше текущей, по порядку.
+
+Новая миграция — функция с декоратором @migration(следующий номер, "описание"), которая
+меняет схему через MigrationOps. Каждая операция MigrationOps — отдельная короткая транзакция
+и повторяема (IF NOT EXISTS, проверка колонки), поэтому прерванную миграцию можно просто
+запустить ещё раз, а бот может работать, пока она идёт:
+  - create_index — в PostgreSQL через CREATE INDEX CONCURRENTLY (таблица не блокируется на запись);
+  - add_column — только nullable-колонка (или с константным DEFAULT), без перезаписи таблицы;
+  - backfill — заполнение пачками по batch_size строк, каждая пачка — своя транзакция.
+Модели в models.py при этом тоже нужно поправить: новая БД создаётся по ним (миграция 1).
+"""
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import inspect, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .models import Base, SchemaVersion
+
+logger = logging.getLogger(__name__)
+
+# Старые таблицы розыгрышей (до перехода на грейды)
+LEGACY_TABLES = ["raffle_winners", "raffles", "raffle_reminder_settings"]
+
+# Ключ pg_advisory_lock: миграции не выполняются одновременно из нескольких процессов
+_PG_LOCK_KEY = 0x52454642  # "REFB"
+
+
+class MigrationOps:
+    """Операции над схемой для миграций; каждая — в своей транзакции."""
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.dialect = engine.dialect.name
+
+    async def execute(self, sql: str, **params) -> int:
+        """Выполнить SQL в отдельной транзакции; возвращает rowcount."""
+        async with self.engine.begin() as conn:
+            result = await conn.execute(text(sql), params)
+        return result.rowcount
+
+    async def has_table(self, table: str) -> bool:
+        async with self.engine.connect() as conn:
+            return await conn.run_sync(lambda c: inspect(c).has_table(table))
+
+    async def has_column(self, table: str, column: str) -> bool:
+        async with self.engine.connect() as conn:
+            columns = await conn.run_sync(lambda c: inspect(c).get_columns(table))
+        return any(c["name"] == column for c in columns)
+
+    async def unique_keys(self, table: str) -> List[Tuple[str, Tuple[str, ...]]]:
+        """[(имя, колонки)] уникальных ограничений и уникальных индексов таблицы."""
+        def collect(c):
+            insp = inspect(c)
+            keys = [(uc["name"] or "", tuple(uc["column_names"])) for uc in insp.get_unique_constraints(table)]
+            keys += [(ix["name"], tuple(ix["column_names"])) for ix in insp.get_indexes(table) if ix["unique"]]
+            return keys
+        async with self.engine.connect() as conn:
+            return await conn.run_sync(collect)
+
+    async def create_tables(self) -> None:
+        """Создать по моделям таблицы, которых ещё нет (существующие не меняются)."""
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    async def drop_tables(self, *tables: str) -> None:
+        async with self.engine.begin() as conn:
+            for table in tables:
+                await conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+
+    async def create_index(
+        self,
+        name: str,
+        table: str,
+        columns: Sequence[str],
+        unique: bool = False,
+        where: Optional[str] = None,
+    ) -> None:
+        """CREATE [UNIQUE] INDEX IF NOT EXISTS; в PostgreSQL — CONCURRENTLY (без блокировки записи)."""
+        unique_sql = "UNIQUE " if unique else ""
+        where_sql = f" WHERE {where}" if where else ""
+        if self.dialect != "postgresql":
+            await self.execute(
+                f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)}){where_sql}"
+            )
+            return
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            # Прерванный CREATE INDEX CONCURRENTLY оставляет невалидный индекс — пересоздать
+            invalid = await conn.scalar(
+                text(
+                    "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE c.relname = :name AND NOT i.indisvalid"
+                ),
+                {"name": name},
+            )
+            if invalid:
+                await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            await conn.execute(
+                text(
+                    f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} "
+                    f"ON {table} ({', '.join(columns)}){where_sql}"
+                )
+            )
+
+    async def drop_index(self, name: str) -> None:
+        if self.dialect != "postgresql":
+            await self.execute(f"DROP INDEX IF EXISTS {name}")
+            return
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+    async def add_column(self, table: str, column: str, ddl: str) -> bool:
+        """
+        ALTER TABLE ADD COLUMN, если колонки ещё нет. ddl — тип и ограничения, например
+        "VARCHAR(64)" или "BOOLEAN NOT NULL DEFAULT FALSE" (NOT NULL — только с DEFAULT).
+        """
+        if await self.has_column(table, column):
+            return False
+        await self.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+        return True
+
+    async def backfill(
+        self, table: str, set_sql: str, where: str, batch_size: int = 1000, key: str = "id", **params
+    ) -> int:
+        """
+        UPDATE пачками: UPDATE table SET set_sql WHERE key IN (первые batch_size строк, где where).
+        После обновления строка должна перестать подходить под where (например, "col IS NULL").
+        """
+        total = 0
+        while True:
+            updated = await self.execute(
+                f"UPDATE {table} SET {set_sql} WHERE {key} IN "
+                f"(SELECT {key} FROM {table} WHERE {where} LIMIT :_batch_size)",
+                _batch_size=batch_size,
+                **params,
+            )
+            total += updated
+            if updated < batch_size:
+                return total
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable[[MigrationOps], Awaitable[None]]
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, name: str):
+    """Зарегистрировать миграцию (номера — по возрастанию, без пропусков)."""
+    def decorator(upgrade: Callable[[MigrationOps], Awaitable[None]]):
+        if MIGRATIONS and version != MIGRATIONS[-1].version + 1:
+            raise ValueError(f"Migration {version} must follow {MIGRATIONS[-1].version}")
+        MIGRATIONS.append(Migration(version, name, upgrade))
+        return upgrade
+    return decorator
+
+
+# ============ Миграции ============
+
+@migration(1, "initial schema")
+async def _initial_schema(ops: MigrationOps) -> None:
+    # Новая БД создаётся сразу по текущим моделям; в существующей (до миграций) — только недостающие таблицы
+    await ops.drop_tables(*LEGACY_TABLES)
+    await ops.create_tables()
+
+
+@migration(2, "composite indexes for hot queries")
+async def _hot_query_indexes(ops: MigrationOps) -> None:
+    await ops.create_index("ix_referrals_referrer_active", "referrals", ["referrer_id", "is_active"])
+    await ops.create_index("ix_users_pending", "users", ["is_subscribed", "referrer_id", "is_active"])
+    await ops.create_index("ix_users_email_phone", "users", ["email", "phone"])
+    # Повторные выдачи одного грейда (двойное нажатие) — оставить первую
+    await ops.execute(
+        "DELETE FROM grade_claims WHERE id NOT IN "
+        "(SELECT MIN(id) FROM grade_claims GROUP BY user_id, grade_id)"
+    )
+    await ops.create_index("uq_grade_claims_user_grade", "grade_claims", ["user_id", "grade_id"], unique=True)
+    # Префиксы новых составных индексов / уникального ограничения uq_utm_tokens_enc_type
+    for name in ("ix_referrals_referrer_id", "ix_users_email", "ix_grade_claims_user_id", "ix_utm_tokens_encrypted_value"):
+        await ops.drop_index(name)
+    # Дубликат UNIQUE(telegram_id). В БД от старых версий (unique + index в модели) этот индекс —
+    # единственная уникальность telegram_id (на ней держатся ON CONFLICT и FK referrer_id), его не трогаем
+    users_unique = await ops.unique_keys("users")
+    if any(name != "ix_users_telegram_id" and columns == ("telegram_id",) for name, columns in users_unique):
+        await ops.drop_index("ix_users_telegram_id")
+
+
+@migration(3, "drop referral links with plaintext email/phone")
+async def _drop_plaintext_referral_links(ops: MigrationOps) -> None:
+    # Без шифрования в referral_links писались открытые email и телефон вместо токенов;
+    # такие ссылки теперь собираются на лету, а токенные пересоберутся при первом запросе
+    await ops.execute(
+        "DELETE FROM referral_links WHERE "
+        "token_campaign NOT IN (SELECT token FROM utm_tokens WHERE value_type = 'email') "
+        "OR token_content NOT IN (SELECT token FROM utm_tokens WHERE value_type = 'phone')"
+    )
+
+
+@migration(4, "drop lower(email) index")
+async def _drop_email_lower_index(ops: MigrationOps) -> None:
+    # Нужен был только legacy-поиску открытого email по lower(email); теперь он идёт по ix_users_email_phone
+    await ops.drop_index("ix_users_email_lower")
+
+
+# ============ Запуск ============
+
+async def get_schema_version(engine: AsyncEngine) -> int:
+    """Текущая версия схемы (0 — миграции ещё не применялись)."""
+    ops = MigrationOps(engine)
+    if not await ops.has_table(SchemaVersion.__tablename__):
+        return 0
+    async with engine.connect() as conn:
+        version = await conn.scalar(select(SchemaVersion.version).order_by(SchemaVersion.version.desc()).limit(1))
+    return version or 0
+
+
+async def get_pending_migrations(engine: AsyncEngine) -> List[Migration]:
+    current = await get_schema_version(engine)
+    return [m for m in MIGRATIONS if m.version > current]
+
+
+async def run_migrations(engine: AsyncEngine, target: Optional[int] = None) -> List[Tuple[int, str]]:
+    """Применить миграции до target (по умолчанию — все). Возвращает [(version, name)] применённых."""
+    ops = MigrationOps(engine)
+    applied: List[Tuple[int, str]] = []
+    lock_conn = None
+    if ops.dialect == "postgresql":
+        lock_conn = await engine.connect()
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        await lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _PG_LOCK_KEY})
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(lambda c: SchemaVersion.__table__.create(c, checkfirst=True))
+        # Версию читаем под блокировкой: другой процесс мог только что всё применить
+        current = await get_schema_version(engine)
+        if current > MIGRATIONS[-1].version:
+            logger.warning(f"Database schema version {current} is newer than this bot ({MIGRATIONS[-1].version})")
+        for m in MIGRATIONS:
+            if m.version <= current:
+                continue
+            if target is not None and m.version > target:
+                break
+            logger.info(f"Applying migration {m.version}: {m.name}")
+            await m.upgrade(ops)
+            async with engine.begin() as conn:
+                await conn.execute(SchemaVersion.__table__.insert().values(version=m.version, name=m.name))
+            applied.append((m.version, m.name))
+    finally:
+        if lock_conn is not None:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _PG_LOCK_KEY})
+            await lock_conn.close()
+    return applied
@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import Optional, List
-from sqlalchemy import BigInteger, Boolean, DateTime, ForeignKey, Integer, String, Text, UniqueConstraint
+from sqlalchemy import BigInteger, Boolean, DateTime, ForeignKey, Index, Integer, String, Text, UniqueConstraint
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -10,13 +10,20 @@ class Base(DeclarativeBase):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # get_referrer_by_utm_tokens / get_user_by_email_and_phone; по префиксу — get_user_by_email
+        Index("ix_users_email_phone", "email", "phone"),
+        # get_pending_users
+        Index("ix_users_pending", "is_subscribed", "referrer_id", "is_active"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    telegram_id: Mapped[int] = mapped_column(BigInteger, unique=True, nullable=False, index=True)
+    # UNIQUE в самой таблице (не отдельным индексом): на него ссылается referrer_id той же таблицы — PostgreSQL
+    telegram_id: Mapped[int] = mapped_column(BigInteger, unique=True, nullable=False)
     username: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     first_name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     # Хранятся только зашифрованные значения (расшифровка только при отображении/экспорте)
-    email: Mapped[Optional[str]] = mapped_column(String(512), nullable=True, index=True)
+    email: Mapped[Optional[str]] = mapped_column(String(512), nullable=True)
     phone: Mapped[Optional[str]] = mapped_column(String(256), nullable=True)
     referrer_id: Mapped[Optional[int]] = mapped_column(BigInteger, ForeignKey("users.telegram_id"), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
@@ -25,17 +32,17 @@ class User(Base):
     is_admin: Mapped[bool] = mapped_column(Boolean, default=False)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
 
-    # Relationships
+    # Relationships (не подгружаются вместе с пользователем: для списков есть отдельные запросы в crud)
     referrals: Mapped[List["Referral"]] = relationship(
         "Referral",
         foreign_keys="Referral.referrer_id",
         back_populates="referrer",
-        lazy="selectin"
+        lazy="select"
     )
     grade_claims: Mapped[List["GradeClaim"]] = relationship(
         "GradeClaim",
         back_populates="user",
-        lazy="selectin"
+        lazy="select"
     )
 
     def __repr__(self) -> str:
@@ -44,9 +51,11 @@ class User(Base):
 
 class Referral(Base):
     __tablename__ = "referrals"
+    # Счётчики рефералов и рейтинг: покрывающий индекс, таблица не читается
+    __table_args__ = (Index("ix_referrals_referrer_active", "referrer_id", "is_active"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    referrer_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.telegram_id"), nullable=False, index=True)
+    referrer_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.telegram_id"), nullable=False)
     referred_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.telegram_id"), nullable=False, unique=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
@@ -83,11 +92,11 @@ class Grade(Base):
     rewards: Mapped[str] = mapped_column(Text, nullable=False)  # JSON array ["мерч", "тд"]
     sort_order: Mapped[int] = mapped_column(Integer, default=0)
 
-    # Relationships
+    # Relationships (выдачи по грейду читаются постранично, см. get_grade_users_page)
     claims: Mapped[List["GradeClaim"]] = relationship(
         "GradeClaim",
         back_populates="grade",
-        lazy="selectin"
+        lazy="select"
     )
 
     def __repr__(self) -> str:
@@ -101,7 +110,7 @@ class UtmToken(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     token: Mapped[str] = mapped_column(String(32), unique=True, nullable=False, index=True)
-    encrypted_value: Mapped[str] = mapped_column(String(512), nullable=False, index=True)
+    encrypted_value: Mapped[str] = mapped_column(String(512), nullable=False)
     value_type: Mapped[str] = mapped_column(String(20), nullable=False)  # 'email' | 'phone'
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
@@ -109,6 +118,21 @@ class UtmToken(Base):
         return f"<UtmToken(token={self.token}, type={self.value_type})>"
 
 
+class ReferralLink(Base):
+    """Готовая реферальная ссылка пользователя: токены UTM и итоговый URL. Пересобирается при смене email/телефона/ника."""
+    __tablename__ = "referral_links"
+
+    user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.telegram_id"), primary_key=True)
+    token_medium: Mapped[str] = mapped_column(String(512), nullable=False, default="")
+    token_campaign: Mapped[str] = mapped_column(String(512), nullable=False)
+    token_content: Mapped[str] = mapped_column(String(512), nullable=False)
+    link: Mapped[str] = mapped_column(Text, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self) -> str:
+        return f"<ReferralLink(user={self.user_id})>"
+
+
 class ContactEntry(Base):
     """Контакт для кнопки «Связаться»: тг_ник — за что отвечает."""
     __tablename__ = "contact_entries"
@@ -139,9 +163,11 @@ class BotSetting(Base):
 class GradeClaim(Base):
     """Фиксация выдачи награды за грейд пользователю."""
     __tablename__ = "grade_claims"
+    # has_grade_claim; заодно не даёт выдать награду за грейд дважды
+    __table_args__ = (Index("uq_grade_claims_user_grade", "user_id", "grade_id", unique=True),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.telegram_id"), nullable=False, index=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.telegram_id"), nullable=False)
     grade_id: Mapped[int] = mapped_column(Integer, ForeignKey("grades.id"), nullable=False, index=True)
     claimed_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     issued_by_admin: Mapped[bool] = mapped_column(Boolean, default=True)
@@ -152,3 +178,28 @@ class GradeClaim(Base):
 
     def __repr__(self) -> str:
         return f"<GradeClaim(user={self.user_id}, grade={self.grade_id})>"
+
+
+class FsmRecord(Base):
+    """Состояние и данные FSM aiogram (SqlStorage вместо MemoryStorage — переживают перезапуск)."""
+    __tablename__ = "fsm_states"
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    state: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    data: Mapped[str] = mapped_column(Text, nullable=False, default="{}")
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self) -> str:
+        return f"<FsmRecord(key={self.key}, state={self.state})>"
+
+
+class SchemaVersion(Base):
+    """Применённые миграции схемы (bot/database/migrations.py)."""
+    __tablename__ = "schema_version"
+
+    version: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    name: Mapped[str] = mapped_column(String(255), nullable=False)
+    applied_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self) -> str:
+        return f"<SchemaVersion({self.version}: {self.name})>"
@@ -0,0 +1,151 @@
+"""
+Статистика SQL-запросов: время каждого запроса (по тексту запроса), число запросов на апдейт
+и журнал медленных запросов.
+
+Слушатели событий движка подключаются в session.py. Значения параметров в журнал не попадают:
+вместо них — тип и длина (почта, телефон, ник хранятся зашифрованными, но и шифротекст — PII).
+Сводку показывает админ-команда /dbstats.
+"""
+import logging
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from bot.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Списки плейсхолдеров IN (...) / VALUES (...), (...) разной длины — один и тот же запрос (asyncpg: $1::VARCHAR)
+_PLACEHOLDER = r"(?:\?|\$\d+(?:::[\w ]+(?:\(\d+\))?(?:\[\])?)?|%\(\w+\)s|:\w+)"
+_PLACEHOLDER_LIST = re.compile(rf"\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})*\s*\)")
+_REPEATED_TUPLES = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_WHITESPACE = re.compile(r"\s+")
+
+# Границы гистограммы «запросов на апдейт»
+UPDATE_STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+@lru_cache(maxsize=1024)
+def normalize_statement(statement: str) -> str:
+    """Текст запроса без переносов и с одинаковым (...) вместо списков плейсхолдеров любой длины."""
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    statement = _PLACEHOLDER_LIST.sub("(...)", statement)
+    return _REPEATED_TUPLES.sub("(...), ...", statement)
+
+
+def redact_parameters(parameters: Any, executemany: bool = False) -> str:
+    """Параметры запроса без значений: <int>, <str:44>, None и т.д. Для executemany — число наборов."""
+    if executemany:
+        count = len(parameters) if hasattr(parameters, "__len__") else "?"
+        return f"<{count} rows>"
+
+    def redact(value: Any) -> str:
+        if value is None:
+            return "None"
+        if isinstance(value, (str, bytes, list, tuple)):
+            return f"<{type(value).__name__}:{len(value)}>"
+        return f"<{type(value).__name__}>"
+
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{k}: {redact(v)}" for k, v in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(redact(v) for v in parameters) + ")"
+    return redact(parameters)
+
+
+@dataclass
+class StatementStats:
+    """Накопленные данные по одному (нормализованному) запросу."""
+    statement: str
+    count: int = 0
+    errors: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+
+    @property
+    def avg_time(self) -> float:
+        return self.total_time / self.count if self.count else 0.0
+
+
+class QueryStats:
+    """
+    Счётчики запросов за время работы процесса. Отдельных запросов не больше max_statements,
+    остальные копятся в строке «<other>» (текст запросов с литералами не раздувает память).
+    """
+
+    OTHER = "<other>"
+
+    def __init__(self, slow_query_seconds: float = 0.2, max_statements: int = 500):
+        self.slow_query_seconds = slow_query_seconds
+        self.max_statements = max_statements
+        self.statements: Dict[str, StatementStats] = {}
+        self.total = 0
+        self.errors = 0
+        self.slow = 0
+        self.total_time = 0.0
+        # Апдейты: сколько обработано и распределение числа запросов
+        self.updates = 0
+        self.update_statements = 0
+        self.update_max_statements = 0
+        self.update_buckets = [0] * (len(UPDATE_STATEMENT_BUCKETS) + 1)
+
+    def _entry(self, key: str) -> StatementStats:
+        entry = self.statements.get(key)
+        if entry is None:
+            if len(self.statements) >= self.max_statements:
+                key = self.OTHER
+                entry = self.statements.get(key)
+            if entry is None:
+                entry = self.statements[key] = StatementStats(key)
+        return entry
+
+    def record(
+        self,
+        statement: str,
+        parameters: Any,
+        elapsed: float,
+        executemany: bool = False,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        """Учесть выполненный (или упавший) запрос; медленный — записать в журнал."""
+        statement = normalize_statement(statement)
+        entry = self._entry(statement)
+        entry.count += 1
+        entry.total_time += elapsed
+        entry.max_time = max(entry.max_time, elapsed)
+        self.total += 1
+        self.total_time += elapsed
+        if error is not None:
+            entry.errors += 1
+            self.errors += 1
+        if self.slow_query_seconds and elapsed >= self.slow_query_seconds:
+            self.slow += 1
+            logger.warning(
+                "Slow query %.1f ms%s: %s params=%s",
+                elapsed * 1000,
+                " (failed)" if error is not None else "",
+                statement[:1000],
+                redact_parameters(parameters, executemany),
+            )
+
+    def record_update(self, statements: int) -> None:
+        """Учесть число запросов одного апдейта."""
+        self.updates += 1
+        self.update_statements += statements
+        self.update_max_statements = max(self.update_max_statements, statements)
+        for i, bound in enumerate(UPDATE_STATEMENT_BUCKETS):
+            if statements <= bound:
+                self.update_buckets[i] += 1
+                return
+        self.update_buckets[-1] += 1
+
+    def top(self, limit: int = 10, key: str = "total_time") -> List[StatementStats]:
+        """Самые «дорогие» запросы: по total_time, count или max_time."""
+        return sorted(self.statements.values(), key=lambda s: getattr(s, key), reverse=True)[:limit]
+
+    def reset(self) -> None:
+        self.__init__(self.slow_query_seconds, self.max_statements)
+
+
+query_stats = QueryStats(slow_query_seconds=settings.DB_SLOW_QUERY_MS / 1000)
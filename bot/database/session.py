@@ -1,16 +1,42 @@
-from sqlalchemy import text
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+import time
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Optional
+from uuid import uuid4
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session
 
 from bot.config import settings
-from .models import Base
+from .migrations import get_pending_migrations, run_migrations
+from .query_stats import query_stats
 
 
-engine = create_async_engine(
-    settings.DATABASE_URL,
-    echo=False,
-    future=True,
-)
+def _engine_options(url: str) -> dict:
+    """Параметры create_async_engine для диалекта: для PostgreSQL — пул и кэш prepared statements."""
+    # hide_parameters: значения (PII) не попадают в текст исключений SQLAlchemy и, значит, в логи
+    options: dict = {"echo": False, "future": True, "hide_parameters": True}
+    if not url.startswith("postgresql"):
+        return options
+    connect_args: dict = {"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+    if not settings.DB_STATEMENT_CACHE_SIZE:
+        # PgBouncer (transaction pooling): без кэша asyncpg и с уникальными именами statements
+        connect_args["statement_cache_size"] = 0
+        connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid4()}__"
+    options.update(
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+    return options
+
+
+engine = create_async_engine(settings.DATABASE_URL, **_engine_options(settings.DATABASE_URL))
 
 async_session_maker = async_sessionmaker(
     engine,
@@ -18,17 +44,165 @@ async_session_maker = async_sessionmaker(
     expire_on_commit=False,
 )
 
-# Old tables removed when switching from raffles to grades (drop if exist)
-_LEGACY_TABLES = ["raffle_winners", "raffles", "raffle_reminder_settings"]
+
+def _sqlite_pragmas() -> list[tuple[str, object]]:
+    """PRAGMA из настроек в порядке применения (пустые/нулевые — пропускаются)."""
+    pragmas = [
+        ("journal_mode", settings.SQLITE_JOURNAL_MODE),
+        ("synchronous", settings.SQLITE_SYNCHRONOUS),
+        ("busy_timeout", settings.SQLITE_BUSY_TIMEOUT_MS),
+        # Отрицательное значение — размер в KiB, а не в страницах
+        ("cache_size", -settings.SQLITE_CACHE_SIZE_KB if settings.SQLITE_CACHE_SIZE_KB else 0),
+        ("mmap_size", settings.SQLITE_MMAP_SIZE),
+        ("temp_store", settings.SQLITE_TEMP_STORE),
+    ]
+    return [(name, value) for name, value in pragmas if value not in ("", 0, None)]
+
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+        """WAL (читатели не ждут писателя), busy timeout вместо мгновенного «database is locked» и т.д."""
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in _sqlite_pragmas():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+@dataclass
+class UpdateDbStats:
+    """Счётчики работы с БД в рамках одного апдейта."""
+    sessions: int = 0  # начатых транзакций (checkout соединения + BEGIN)
+    statements: int = 0  # выполненных SQL-запросов
+    db_time: float = 0.0  # суммарное время SQL-запросов, сек
+
+
+_update_stats: ContextVar[Optional[UpdateDbStats]] = ContextVar("update_db_stats", default=None)
+
+
+def start_update_stats() -> UpdateDbStats:
+    """Начать подсчёт запросов для текущего апдейта (контекст asyncio-задачи)."""
+    stats = UpdateDbStats()
+    _update_stats.set(stats)
+    return stats
+
+
+def current_update_stats() -> Optional[UpdateDbStats]:
+    """Счётчики текущего апдейта (None — вне DatabaseSessionMiddleware)."""
+    return _update_stats.get()
+
+
+def set_update_stats(stats: Optional[UpdateDbStats]) -> None:
+    """Считать дальнейшие запросы текущей задачи в stats (писатель — в счётчики апдейта, чьё задание выполняет)."""
+    _update_stats.set(stats)
+
+
+@event.listens_for(Session, "after_begin")
+def _count_session(session, transaction, connection):
+    stats = _update_stats.get()
+    if stats is not None:
+        stats.sessions += 1
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _finish_statement(conn, statement, parameters, executemany, error=None) -> None:
+    """Время запроса — в статистику процесса (query_stats) и апдейта."""
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    query_stats.record(statement, parameters, elapsed, executemany, error)
+    stats = _update_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_time += elapsed
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    _finish_statement(conn, statement, parameters, executemany)
+
+
+@event.listens_for(engine.sync_engine, "handle_error")
+def _count_failed_statement(exception_context):
+    conn = exception_context.connection
+    if conn is not None and exception_context.statement is not None:
+        _finish_statement(
+            conn,
+            exception_context.statement,
+            exception_context.parameters,
+            bool(exception_context.execution_context and exception_context.execution_context.executemany),
+            exception_context.original_exception,
+        )
+
+
+def on_commit(session: AsyncSession, callback: Callable[[], None]) -> None:
+    """Вызвать callback после успешного commit текущей транзакции сессии."""
+    session.info.setdefault("on_commit", []).append(callback)
+
+
+def on_rollback(session: AsyncSession, callback: Callable[[], None]) -> None:
+    """Вызвать callback, если текущая транзакция сессии завершится без commit."""
+    session.info.setdefault("on_rollback", []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_commit_hooks(session):
+    session.info.pop("on_rollback", None)
+    for callback in session.info.pop("on_commit", []):
+        callback()
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _run_rollback_hooks(session, transaction):
+    if transaction.parent is not None:
+        return
+    session.info.pop("on_commit", None)
+    for callback in session.info.pop("on_rollback", []):
+        callback()
 
 
 async def init_db():
-    """Initialize database: drop legacy raffle tables, create all current tables."""
-    async with engine.begin() as conn:
-        # Drop old raffle/reminder tables if present (migration from raffle to grades)
-        for table in _LEGACY_TABLES:
-            await conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
-        await conn.run_sync(Base.metadata.create_all)
+    """Привести схему БД к текущей версии (bot/database/migrations.py)."""
+    if settings.DB_AUTO_MIGRATE:
+        await run_migrations(engine)
+        return
+    pending = await get_pending_migrations(engine)
+    if pending:
+        raise RuntimeError(
+            f"Database schema is behind by {len(pending)} migration(s): run python scripts/migrate.py upgrade"
+        )
+
+
+_SYNCHRONOUS_NAMES = {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"}
+_TEMP_STORE_NAMES = {0: "DEFAULT", 1: "FILE", 2: "MEMORY"}
+
+
+async def get_db_settings_report() -> dict[str, object]:
+    """Фактические параметры БД (SQLite — действующие PRAGMA, PostgreSQL — версия и пул) для лога при старте."""
+    report: dict[str, object] = {"dialect": engine.dialect.name}
+    if engine.dialect.name == "postgresql":
+        async with engine.connect() as conn:
+            report["server_version"] = (await conn.execute(text("SHOW server_version"))).scalar()
+            report["max_connections"] = (await conn.execute(text("SHOW max_connections"))).scalar()
+        report["pool_size"] = settings.DB_POOL_SIZE
+        report["max_overflow"] = settings.DB_MAX_OVERFLOW
+        report["statement_cache_size"] = settings.DB_STATEMENT_CACHE_SIZE
+        return report
+    if engine.dialect.name != "sqlite":
+        return report
+    async with engine.connect() as conn:
+        for name in ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size", "temp_store"):
+            report[name] = (await conn.execute(text(f"PRAGMA {name}"))).scalar()
+    report["synchronous"] = _SYNCHRONOUS_NAMES.get(report["synchronous"], report["synchronous"])
+    report["temp_store"] = _TEMP_STORE_NAMES.get(report["temp_store"], report["temp_store"])
+    return report
 
 
 @asynccontextmanager
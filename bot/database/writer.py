@@ -0,0 +1,147 @@
+"""
+Единственный писатель в БД (DB_SINGLE_WRITER=true, для SQLite).
+
+SQLite допускает одного писателя: параллельные транзакции с записью ждут друг друга
+(busy_timeout) или падают с «database is locked». В режиме единственного писателя
+хендлеры отдают запись функцией ``run_write``: задача-писатель копит задания
+DB_WRITE_BATCH_MS миллисекунд и выполняет их одной транзакцией. Чтение по-прежнему
+идёт через сессию апдейта (пул соединений, WAL).
+
+Если одно из заданий пачки упало, транзакция откатывается и задания пачки выполняются
+заново по одному — ошибка достаётся только своему заданию. Поэтому задание должно
+только работать с переданной сессией (без сетевых вызовов и побочных эффектов вне БД;
+для кэшей — on_commit / on_rollback).
+
+Запросы задания засчитываются апдейту, который его отдал (UpdateDbStats из session.py), —
+сама задача-писатель запускается в пустом контексте и ничьих счётчиков не наследует.
+
+Писатель живёт в процессе: при WORKERS > 1 их было бы по одному на воркер, поэтому с SQLite
+main() такой запуск не допускает.
+"""
+import asyncio
+import contextvars
+import logging
+from typing import Awaitable, Callable, List, Optional, Tuple, TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.config import settings
+from .session import UpdateDbStats, async_session_maker, current_update_stats, set_update_stats
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+WriteJob = Callable[[AsyncSession], Awaitable[T]]
+QueuedJob = Tuple[WriteJob, asyncio.Future, Optional[UpdateDbStats]]
+
+
+class SingleWriter:
+    """Очередь заданий записи и задача, выполняющая их пачками в одной транзакции."""
+
+    def __init__(self, session_maker=async_session_maker, batch_window: float = 0.005, max_batch: int = 100,
+                 max_queue: int = 10000):
+        self._session_maker = session_maker
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._queue: "asyncio.Queue[QueuedJob]" = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self.jobs = 0
+        self.batches = 0
+        self.retried_batches = 0
+
+    @property
+    def depth(self) -> int:
+        """Сколько заданий ждёт в очереди."""
+        return self._queue.qsize()
+
+    async def submit(self, job: WriteJob) -> T:
+        """Выполнить задание в транзакции писателя; возвращает его результат после commit."""
+        if self._task is None or self._task.done():
+            # Пустой контекст: иначе задача унаследует счётчики апдейта, который её запустил
+            self._task = asyncio.create_task(self._run(), context=contextvars.Context())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((job, future, current_update_stats()))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._execute(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _execute(self, batch: List[QueuedJob]) -> None:
+        try:
+            async with self._session_maker() as session:
+                results = []
+                for job, _, stats in batch:
+                    set_update_stats(stats)
+                    results.append(await job(session))
+                set_update_stats(None)
+                await session.commit()
+        except Exception as e:
+            set_update_stats(None)
+            if len(batch) == 1:
+                future = batch[0][1]
+                if not future.done():
+                    future.set_exception(e)
+                return
+            # Найти виноватое задание: остальные выполнятся успешно
+            self.retried_batches += 1
+            for item in batch:
+                await self._execute([item])
+            return
+        self.jobs += len(batch)
+        self.batches += 1
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def close(self) -> None:
+        """Выполнить оставшиеся задания и остановить задачу-писателя."""
+        if self._task is None:
+            return
+        if not self._queue.empty():
+            logger.info(f"Waiting for {self._queue.qsize()} queued DB writes...")
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+db_writer: Optional[SingleWriter] = (
+    SingleWriter(
+        batch_window=settings.DB_WRITE_BATCH_MS / 1000,
+        max_batch=settings.DB_WRITE_MAX_BATCH,
+        max_queue=settings.DB_WRITE_QUEUE_SIZE,
+    )
+    if settings.DB_SINGLE_WRITER
+    else None
+)
+
+
+async def run_write(session: AsyncSession, job: WriteJob) -> T:
+    """
+    Выполнить запись ``job(session)``.
+    Без DB_SINGLE_WRITER — в сессии апдейта (commit делает хендлер, как и раньше).
+    С DB_SINGLE_WRITER — у писателя, вместе с другими мелкими записями; к возврату уже закоммичено.
+    """
+    if db_writer is None:
+        return await job(session)
+    return await db_writer.submit(job)
@@ -0,0 +1,204 @@
+"""
+FSM storage для aiogram: состояния регистрации, редактирования профиля и админских сценариев.
+
+- sql (по умолчанию) — таблица fsm_states в той же БД, что и у бота. Чтение кэшируется в памяти,
+  запись отложенная: изменения копятся и сбрасываются одной транзакцией раз в FSM_FLUSH_INTERVAL
+  секунд (и при остановке бота). Брошенные состояния удаляются через FSM_STATE_TTL_HOURS.
+- redis — RedisStorage из aiogram (пакет redis из requirements.txt; подойдёт любой Redis-совместимый сервер).
+- memory — MemoryStorage, как раньше (всё теряется при перезапуске).
+
+Кэш SqlStorage локален для процесса: при нескольких процессах апдейты одного пользователя
+должны попадать в один и тот же процесс.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import delete
+
+from bot.config import settings
+from bot.database.dialect import dialect_insert
+from bot.database.models import FsmRecord
+from bot.database.session import async_session_maker, engine
+
+logger = logging.getLogger(__name__)
+
+# Как часто удалять просроченные состояния и выгружать из памяти неактивные записи (сек)
+_SWEEP_INTERVAL = 600.0
+# Через сколько секунд без обращений сохранённая запись выгружается из памяти
+_IDLE_EVICTION = 900.0
+
+
+@dataclass
+class _Record:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    updated_at: datetime = field(default_factory=datetime.utcnow)
+    touched: float = field(default_factory=time.monotonic)
+    dirty: bool = False
+
+
+class SqlStorage(BaseStorage):
+    """FSM storage в таблице fsm_states с кэшем в памяти и отложенной (пакетной) записью."""
+
+    def __init__(
+        self,
+        session_maker=async_session_maker,
+        flush_interval: float = 1.0,
+        state_ttl: timedelta = timedelta(hours=72),
+        key_builder: Optional[KeyBuilder] = None,
+    ) -> None:
+        self._session_maker = session_maker
+        self._dialect = engine.dialect.name
+        self._flush_interval = flush_interval
+        self._state_ttl = state_ttl
+        self._key_builder = key_builder or DefaultKeyBuilder(
+            with_bot_id=True, with_business_connection_id=True, with_destiny=True
+        )
+        self._records: Dict[str, _Record] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_sweep = time.monotonic()
+
+    async def _record(self, key: StorageKey) -> tuple[str, _Record]:
+        k = self._key_builder.build(key)
+        record = self._records.get(k)
+        if record is None:
+            async with self._session_maker() as session:
+                row = await session.get(FsmRecord, k)
+            if row is not None and row.updated_at >= datetime.utcnow() - self._state_ttl:
+                loaded = _Record(state=row.state, data=json.loads(row.data), updated_at=row.updated_at)
+            else:
+                loaded = _Record()
+            # Пока шёл SELECT, запись могла появиться из другого апдейта
+            record = self._records.setdefault(k, loaded)
+        record.touched = time.monotonic()
+        if self._flush_task is None or self._flush_task.done():
+            # Пустой контекст: запросы сброса не должны засчитываться апдейту, который запустил задачу
+            self._flush_task = asyncio.create_task(self._flush_loop(), context=contextvars.Context())
+        return k, record
+
+    @staticmethod
+    def _mark_dirty(record: _Record) -> None:
+        record.dirty = True
+        record.updated_at = datetime.utcnow()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, record = await self._record(key)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        _, record = await self._record(key)
+        record.data = data.copy()
+        self._mark_dirty(record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, record = await self._record(key)
+        return record.data.copy()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+            if time.monotonic() - self._last_sweep >= _SWEEP_INTERVAL:
+                try:
+                    await self.sweep()
+                except Exception:
+                    logger.exception("FSM states sweep failed")
+
+    async def flush(self) -> None:
+        """Записать накопленные изменения одной транзакцией (пустые состояния — удалить)."""
+        async with self._flush_lock:
+            dirty = [(k, r) for k, r in self._records.items() if r.dirty]
+            if not dirty:
+                return
+            upserts = []
+            deletes = []
+            for k, r in dirty:
+                r.dirty = False
+                if r.state is None and not r.data:
+                    deletes.append(k)
+                else:
+                    upserts.append({
+                        "key": k,
+                        "state": r.state,
+                        "data": json.dumps(r.data, ensure_ascii=False),
+                        "updated_at": r.updated_at,
+                    })
+            try:
+                async with self._session_maker() as session:
+                    if deletes:
+                        await session.execute(delete(FsmRecord).where(FsmRecord.key.in_(deletes)))
+                    if upserts:
+                        stmt = dialect_insert(self._dialect, FsmRecord).values(upserts)
+                        stmt = stmt.on_conflict_do_update(
+                            index_elements=[FsmRecord.key],
+                            set_={
+                                "state": stmt.excluded.state,
+                                "data": stmt.excluded.data,
+                                "updated_at": stmt.excluded.updated_at,
+                            },
+                        )
+                        await session.execute(stmt)
+                    await session.commit()
+            except Exception:
+                # Повторить при следующем сбросе
+                for _, r in dirty:
+                    r.dirty = True
+                logger.exception("Failed to flush %d FSM records", len(dirty))
+
+    async def sweep(self) -> int:
+        """Удалить просроченные состояния из БД и выгрузить из памяти неактивные записи."""
+        self._last_sweep = time.monotonic()
+        cutoff = datetime.utcnow() - self._state_ttl
+        idle_before = time.monotonic() - _IDLE_EVICTION
+        for k, r in list(self._records.items()):
+            if not r.dirty and (r.updated_at < cutoff or r.touched < idle_before):
+                del self._records[k]
+        async with self._session_maker() as session:
+            result = await session.execute(delete(FsmRecord).where(FsmRecord.updated_at < cutoff))
+            await session.commit()
+        if result.rowcount:
+            logger.info("Removed %d expired FSM states", result.rowcount)
+        return result.rowcount or 0
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            # Не прерывать сброс на середине: отменяем задачу, пока она спит
+            async with self._flush_lock:
+                self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+
+def create_fsm_storage() -> BaseStorage:
+    """FSM storage по настройке FSM_STORAGE: sql | redis | memory."""
+    backend = settings.FSM_STORAGE.strip().lower()
+    ttl = timedelta(hours=settings.FSM_STATE_TTL_HOURS)
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "redis":
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError as e:
+            raise RuntimeError("FSM_STORAGE=redis требует пакет redis: pip install redis") from e
+        return RedisStorage.from_url(settings.REDIS_URL, state_ttl=ttl, data_ttl=ttl)
+    if backend != "sql":
+        raise ValueError(f"Unknown FSM_STORAGE: {settings.FSM_STORAGE!r} (sql | redis | memory)")
+    return SqlStorage(flush_interval=settings.FSM_FLUSH_INTERVAL, state_ttl=ttl)
@@ -1,31 +1,26 @@
-import csv
-import io
+import asyncio
+import contextvars
+import html
+import logging
 from datetime import datetime
+from typing import Coroutine, Dict
 from aiogram import Router, Bot, F
-from aiogram.types import Message, CallbackQuery, BufferedInputFile
+from aiogram.types import Message, CallbackQuery, BufferedInputFile, InlineKeyboardMarkup
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.config import settings
 from bot.database import (
-    get_session,
-    get_all_users,
-    get_user_referral_count,
-    get_user_by_telegram_id,
     get_all_grades,
     get_grade_by_id,
     create_grade,
     update_grade,
     delete_grade,
-    get_users_for_grade,
+    get_grade_users_page,
     create_grade_claim,
-    has_grade_claim,
-    get_referrer_by_utm_tokens,
-    decrypt_email,
-    decrypt_phone,
     decrypt_username,
-    get_all_utm_tokens_for_key_export,
     get_contacts_section_visible,
     set_contacts_section_visible,
     get_contact_entries,
@@ -33,30 +28,59 @@ from bot.database import (
     get_contact_entry_by_id,
     update_contact_entry,
     delete_contact_entry,
+    get_session,
 )
 from bot.database.crud import (
     get_total_users_count,
     get_total_referrals_count,
-    link_referral_by_email,
     get_pending_users,
-    get_user_by_email_and_phone,
-    get_user_by_email,
 )
+from bot.database.query_stats import query_stats
+from bot.database.writer import run_write
 from bot.keyboards.inline import (
     get_admin_keyboard,
     get_confirm_broadcast_keyboard,
     get_cancel_keyboard,
     get_grades_list_keyboard,
     get_grade_manage_keyboard,
+    get_grade_users_keyboard,
+    get_grade_user_button,
     get_back_to_grades_keyboard,
     get_contacts_manage_keyboard,
     get_contacts_cancel_keyboard,
 )
 from bot.services.broadcast import BroadcastService
-from bot.services.grade import GradeService
+from bot.services import crm as crm_service
+from bot.services import profiler as profiler_service
+from bot.services import referral_links as referral_links_service
 
 
 router = Router(name="admin")
+logger = logging.getLogger(__name__)
+
+# Долгие задачи админа (рассылка, импорт CSV, профиль, генерация ссылок) — вне апдейта: хендлер отвечает сразу и не держит
+# очередь апдейтов админа и слот UPDATE_CONCURRENCY. Ссылки на задачи — чтобы их не собрал GC.
+# Задачи запускаются в пустом контексте: их запросы не засчитываются апдейту, который их запустил.
+_background_tasks: Dict[str, asyncio.Task] = {}
+
+
+def _start_background(name: str, coro: Coroutine) -> bool:
+    """Запустить задачу name в фоне; False — такая задача уже идёт (coro закрывается)."""
+    task = _background_tasks.get(name)
+    if task is not None and not task.done():
+        coro.close()
+        return False
+    task = asyncio.create_task(coro, context=contextvars.Context())
+    _background_tasks[name] = task
+
+    def _done(t: asyncio.Task) -> None:
+        if _background_tasks.get(name) is t:
+            del _background_tasks[name]
+        if not t.cancelled() and t.exception() is not None:
+            logger.error(f"Background task {name} failed", exc_info=t.exception())
+
+    task.add_done_callback(_done)
+    return True
 
 
 class AdminStates(StatesGroup):
@@ -92,15 +116,14 @@ async def cmd_admin(message: Message):
 
 
 @router.callback_query(F.data == "admin_stats")
-async def admin_stats(callback: CallbackQuery):
+async def admin_stats(callback: CallbackQuery, session: AsyncSession):
     """Show admin statistics."""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    async with get_session() as session:
-        total_users = await get_total_users_count(session)
-        total_referrals = await get_total_referrals_count(session)
+    total_users = await get_total_users_count(session)
+    total_referrals = await get_total_referrals_count(session)
     
     stats_text = (
         f"📊 <b>Статистика бота</b>\n\n"
@@ -116,11 +139,101 @@ async def admin_stats(callback: CallbackQuery):
     await callback.answer()
 
 
+@router.callback_query(F.data == "admin_pregen_links")
+async def admin_pregen_links(callback: CallbackQuery):
+    """Pre-generate UTM tokens and referral links for all registered users."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    if referral_links_service.is_running():
+        await callback.answer("⏳ Генерация уже идёт", show_alert=True)
+        return
+    
+    if not _start_background("pregen_links", _pregen_links_and_report(callback.message)):
+        await callback.answer("⏳ Генерация уже идёт", show_alert=True)
+        return
+    await callback.answer("⏳ Генерирую ссылки — пришлю итог, когда закончу")
+
+
+async def _pregen_links_and_report(message: Message) -> None:
+    """Фоновая часть генерации ссылок: сгенерировать и прислать админу итог."""
+    tokens_created, links_written = await referral_links_service.pregenerate_referral_links()
+    await message.answer(
+        "🔗 <b>Реферальные ссылки сгенерированы</b>\n\n"
+        f"🆕 Новых токенов: <b>{tokens_created}</b>\n"
+        f"🔗 Ссылок готово: <b>{links_written}</b>",
+        parse_mode="HTML",
+        reply_markup=get_admin_keyboard()
+    )
+
+
+@router.message(Command("dbstats"))
+async def cmd_dbstats(message: Message):
+    """SQL-статистика процесса: время запросов, запросы на апдейт, самые дорогие запросы. /dbstats reset — обнулить."""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У тебя нет доступа к этой команде.")
+        return
+    if (message.text or "").split()[1:2] == ["reset"]:
+        query_stats.reset()
+        await message.answer("🗑 SQL-статистика обнулена.")
+        return
+
+    avg_ms = query_stats.total_time / query_stats.total * 1000 if query_stats.total else 0.0
+    per_update = query_stats.update_statements / query_stats.updates if query_stats.updates else 0.0
+    lines = [
+        "🗄 <b>SQL-статистика</b>\n",
+        f"Запросов: <b>{query_stats.total}</b> (ошибок {query_stats.errors}, медленных {query_stats.slow})",
+        f"Время: <b>{query_stats.total_time:.2f} с</b>, в среднем {avg_ms:.2f} мс",
+        f"Апдейтов: <b>{query_stats.updates}</b>, запросов на апдейт: "
+        f"в среднем {per_update:.1f}, максимум {query_stats.update_max_statements}",
+        "\n<b>Топ по суммарному времени:</b>",
+    ]
+    for entry in query_stats.top(10):
+        lines.append(
+            f"{entry.total_time * 1000:.0f} мс · {entry.count}× · ср. {entry.avg_time * 1000:.2f} мс · "
+            f"макс. {entry.max_time * 1000:.1f} мс\n<code>{html.escape(entry.statement[:200])}</code>"
+        )
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+
+@router.message(Command("profile"))
+async def cmd_profile(message: Message):
+    """Профиль процесса за N секунд (/profile 60, по умолчанию 30): отчёт и .prof файлами."""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У тебя нет доступа к этой команде.")
+        return
+    if profiler_service.is_running():
+        await message.answer("⏳ Профилирование уже идёт.")
+        return
+    args = (message.text or "").split()[1:2]
+    seconds = int(args[0]) if args and args[0].isdigit() else 30
+    seconds = max(1, min(seconds, profiler_service.MAX_SECONDS))
+
+    if not _start_background("profile", _profile_and_send(message, seconds)):
+        await message.answer("⏳ Профилирование уже идёт.")
+        return
+    await message.answer(f"⏳ Профилирование запущено на {seconds} с — бот в это время работает медленнее.")
+
+
+async def _profile_and_send(message: Message, seconds: int) -> None:
+    """Фоновая часть /profile: снять профиль и прислать отчёт админу."""
+    report = await profiler_service.profile(seconds)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    await message.answer_document(
+        BufferedInputFile(report.text.encode("utf-8"), filename=f"profile_{stamp}.txt"),
+        caption="📈 Хендлеры, Bot API и самые дорогие функции за время профиля",
+    )
+    await message.answer_document(
+        BufferedInputFile(report.raw, filename=f"profile_{stamp}.prof"),
+        caption="Сырой профиль: python -m pstats / snakeviz",
+    )
+
+
 # ============ Grades management ============
 
 @router.callback_query(F.data == "admin_grades")
 @router.callback_query(F.data == "admin_grades_back")
-async def admin_grades_list(callback: CallbackQuery):
+async def admin_grades_list(callback: CallbackQuery, session: AsyncSession):
     """Show list of grades or back to admin panel."""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа", show_alert=True)
@@ -133,8 +246,7 @@ async def admin_grades_list(callback: CallbackQuery):
         )
         await callback.answer()
         return
-    async with get_session() as session:
-        grades = await get_all_grades(session)
+    grades = await get_all_grades(session)
     if not grades:
         text = "📊 <b>Грейды</b>\n\nПока нет ни одного рубежа.\nДобавь грейд — укажи количество рефералов и награды."
     else:
@@ -148,7 +260,7 @@ async def admin_grades_list(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("admin_grade_view_"))
-async def admin_grade_view(callback: CallbackQuery):
+async def admin_grade_view(callback: CallbackQuery, session: AsyncSession):
     """Show single grade detail."""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа", show_alert=True)
@@ -158,8 +270,7 @@ async def admin_grade_view(callback: CallbackQuery):
     except ValueError:
         await callback.answer("Ошибка", show_alert=True)
         return
-    async with get_session() as session:
-        grade = await get_grade_by_id(session, grade_id)
+    grade = await get_grade_by_id(session, grade_id)
     if not grade:
         await callback.answer("Грейд не найден", show_alert=True)
         return
@@ -216,7 +327,7 @@ async def admin_grade_process_threshold(message: Message, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_grade_rewards, F.text)
-async def admin_grade_process_rewards(message: Message, state: FSMContext):
+async def admin_grade_process_rewards(message: Message, state: FSMContext, session: AsyncSession):
     """Create grade and show list."""
     if not is_admin(message.from_user.id):
         return
@@ -226,8 +337,8 @@ async def admin_grade_process_rewards(message: Message, state: FSMContext):
         return
     data = await state.get_data()
     threshold = data.get("grade_threshold", 0)
-    async with get_session() as session:
-        grade = await create_grade(session, threshold, rewards_raw)
+    grade = await create_grade(session, threshold, rewards_raw)
+    await session.commit()
     await state.clear()
     await message.answer(
         f"✅ Грейд добавлен: <b>{threshold} реф</b> → {', '.join(rewards_raw)}",
@@ -237,7 +348,7 @@ async def admin_grade_process_rewards(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("admin_grade_edit_"))
-async def admin_grade_edit_start(callback: CallbackQuery, state: FSMContext):
+async def admin_grade_edit_start(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Start edit grade: ask new rewards."""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа", show_alert=True)
@@ -247,8 +358,7 @@ async def admin_grade_edit_start(callback: CallbackQuery, state: FSMContext):
     except ValueError:
         await callback.answer("Ошибка", show_alert=True)
         return
-    async with get_session() as session:
-        grade = await get_grade_by_id(session, grade_id)
+    grade = await get_grade_by_id(session, grade_id)
     if not grade:
         await callback.answer("Грейд не найден", show_alert=True)
         return
@@ -268,7 +378,7 @@ async def admin_grade_edit_start(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_grade_edit_rewards, F.text)
-async def admin_grade_edit_process(message: Message, state: FSMContext):
+async def admin_grade_edit_process(message: Message, state: FSMContext, session: AsyncSession):
     """Save edited rewards."""
     if not is_admin(message.from_user.id):
         return
@@ -282,8 +392,8 @@ async def admin_grade_edit_process(message: Message, state: FSMContext):
     if not grade_id:
         await message.answer("Ошибка. Начни заново.", reply_markup=get_admin_keyboard())
         return
-    async with get_session() as session:
-        await update_grade(session, grade_id, rewards=rewards_raw)
+    await update_grade(session, grade_id, rewards=rewards_raw)
+    await session.commit()
     await message.answer(
         f"✅ Награды грейда обновлены: {', '.join(rewards_raw)}",
         parse_mode="HTML",
@@ -292,7 +402,7 @@ async def admin_grade_edit_process(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("admin_grade_del_"))
-async def admin_grade_delete(callback: CallbackQuery):
+async def admin_grade_delete(callback: CallbackQuery, session: AsyncSession):
     """Delete grade."""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа", show_alert=True)
@@ -302,13 +412,12 @@ async def admin_grade_delete(callback: CallbackQuery):
     except ValueError:
         await callback.answer("Ошибка", show_alert=True)
         return
-    async with get_session() as session:
-        ok = await delete_grade(session, grade_id)
+    ok = await delete_grade(session, grade_id)
     if not ok:
         await callback.answer("Грейд не найден", show_alert=True)
         return
-    async with get_session() as session:
-        grades = await get_all_grades(session)
+    grades = await get_all_grades(session)
+    await session.commit()
     await callback.message.edit_text(
         "📊 <b>Грейды</b>\n\nГрейд удалён.",
         parse_mode="HTML",
@@ -317,57 +426,53 @@ async def admin_grade_delete(callback: CallbackQuery):
     await callback.answer("Грейд удалён")
 
 
+GRADE_USERS_PAGE_SIZE = 30
+
+
 @router.callback_query(F.data.startswith("admin_grade_users_"))
-async def admin_grade_users(callback: CallbackQuery):
-    """Show users who reached this grade, with Claim buttons."""
+@router.callback_query(F.data.startswith("admin_gu_"))
+async def admin_grade_users(callback: CallbackQuery, session: AsyncSession):
+    """Show users who reached this grade (page), with Claim buttons."""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     try:
-        grade_id = int(callback.data.replace("admin_grade_users_", ""))
+        if callback.data.startswith("admin_gu_"):
+            grade_part, page_part = callback.data.replace("admin_gu_", "").split("_")
+            grade_id, page = int(grade_part), max(int(page_part), 0)
+        else:
+            grade_id, page = int(callback.data.replace("admin_grade_users_", "")), 0
     except ValueError:
         await callback.answer("Ошибка", show_alert=True)
         return
-    async with get_session() as session:
-        grade = await get_grade_by_id(session, grade_id)
-        if not grade:
-            await callback.answer("Грейд не найден", show_alert=True)
-            return
-        users_with_count = await get_users_for_grade(session, grade_id)
-        from aiogram.utils.keyboard import InlineKeyboardBuilder
-        from aiogram.types import InlineKeyboardButton
-        builder = InlineKeyboardBuilder()
-        for user, ref_count in users_with_count:
-            has_claim = await has_grade_claim(session, user.telegram_id, grade_id)
-            name = (user.first_name or decrypt_username(user.username) or f"id{user.telegram_id}")[:25]
-            if has_claim:
-                builder.row(
-                    InlineKeyboardButton(
-                        text=f"{name} — ✅ Выдано",
-                        callback_data="admin_noop"
-                    )
-                )
-            else:
-                builder.row(
-                    InlineKeyboardButton(
-                        text=f"{name} — Выдать",
-                        callback_data=f"admin_gc_{grade_id}_{user.telegram_id}"
-                    )
-                )
-        builder.row(
-            InlineKeyboardButton(text="◀️ Назад", callback_data=f"admin_grade_view_{grade_id}")
-        )
+    grade = await get_grade_by_id(session, grade_id)
+    if not grade:
+        await callback.answer("Грейд не найден", show_alert=True)
+        return
+    offset = page * GRADE_USERS_PAGE_SIZE
+    rows, total = await get_grade_users_page(
+        session, grade_id, grade.referral_threshold, limit=GRADE_USERS_PAGE_SIZE, offset=offset
+    )
+    users = [
+        (telegram_id, (first_name or decrypt_username(username) or f"id{telegram_id}")[:25], claimed)
+        for telegram_id, first_name, username, ref_count, claimed in rows
+    ]
     from bot.services.grade import parse_rewards
     rewards_str = ", ".join(parse_rewards(grade))
     text = (
         f"👥 <b>Кто достиг: {grade.referral_threshold} реф</b>\n"
         f"Награды: {rewards_str}\n\n"
-        f"Всего: {len(users_with_count)} чел."
+        f"Всего: {total} чел."
     )
+    if total > GRADE_USERS_PAGE_SIZE:
+        pages = (total + GRADE_USERS_PAGE_SIZE - 1) // GRADE_USERS_PAGE_SIZE
+        text += f" Страница {page + 1}/{pages}."
     await callback.message.edit_text(
         text,
         parse_mode="HTML",
-        reply_markup=builder.as_markup()
+        reply_markup=get_grade_users_keyboard(
+            grade_id, users, page, has_next=offset + len(rows) < total
+        ),
     )
     await callback.answer()
 
@@ -378,8 +483,8 @@ async def admin_noop(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("admin_gc_"))
-async def admin_grade_claim(callback: CallbackQuery):
-    """Mark reward as issued for user."""
+async def admin_grade_claim(callback: CallbackQuery, session: AsyncSession):
+    """Mark reward as issued for user; only the pressed button is updated."""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
@@ -393,52 +498,28 @@ async def admin_grade_claim(callback: CallbackQuery):
     except ValueError:
         await callback.answer("Ошибка", show_alert=True)
         return
-    async with get_session() as session:
-        if await has_grade_claim(session, user_id, grade_id):
-            await callback.answer("Уже выдано", show_alert=True)
-            return
-        await create_grade_claim(session, user_id, grade_id, issued_by_admin=True)
-    await callback.answer("Отмечено: награда выдана", show_alert=True)
-    # Refresh the "who reached" list
-    async with get_session() as session:
-        grade = await get_grade_by_id(session, grade_id)
-        if not grade:
-            return
-        users_with_count = await get_users_for_grade(session, grade_id)
-        from aiogram.utils.keyboard import InlineKeyboardBuilder
-        from aiogram.types import InlineKeyboardButton
-        builder = InlineKeyboardBuilder()
-        for user, ref_count in users_with_count:
-            has_claim = await has_grade_claim(session, user.telegram_id, grade_id)
-            name = (user.first_name or decrypt_username(user.username) or f"id{user.telegram_id}")[:25]
-            if has_claim:
-                builder.row(
-                    InlineKeyboardButton(
-                        text=f"{name} — ✅ Выдано",
-                        callback_data="admin_noop"
-                    )
-                )
-            else:
-                builder.row(
-                    InlineKeyboardButton(
-                        text=f"{name} — Выдать",
-                        callback_data=f"admin_gc_{grade_id}_{user.telegram_id}"
-                    )
-                )
-        builder.row(
-            InlineKeyboardButton(text="◀️ Назад", callback_data=f"admin_grade_view_{grade_id}")
-        )
-    from bot.services.grade import parse_rewards
-    rewards_str = ", ".join(parse_rewards(grade))
-    text = (
-        f"👥 <b>Кто достиг: {grade.referral_threshold} реф</b>\n"
-        f"Награды: {rewards_str}\n\n"
-        f"Всего: {len(users_with_count)} чел."
-    )
-    await callback.message.edit_text(
-        text,
-        parse_mode="HTML",
-        reply_markup=builder.as_markup()
+    # Уникальный индекс (user_id, grade_id): повторное нажатие ничего не добавит
+    claim = await run_write(session, lambda db: create_grade_claim(db, user_id, grade_id, issued_by_admin=True))
+    await session.commit()
+    if claim is None:
+        await callback.answer("Уже выдано", show_alert=True)
+    else:
+        await callback.answer("Отмечено: награда выдана", show_alert=True)
+    # Обновить только нажатую кнопку в текущей клавиатуре
+    markup = callback.message.reply_markup
+    if not markup:
+        return
+    keyboard = []
+    for row in markup.inline_keyboard:
+        new_row = []
+        for button in row:
+            if button.callback_data == callback.data:
+                name = button.text.rsplit(" — ", 1)[0]
+                button = get_grade_user_button(grade_id, user_id, name, claimed=True)
+            new_row.append(button)
+        keyboard.append(new_row)
+    await callback.message.edit_reply_markup(
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
     )
 
 
@@ -464,15 +545,14 @@ async def start_broadcast(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_broadcast_message, F.photo)
-async def process_broadcast_photo(message: Message, state: FSMContext):
+async def process_broadcast_photo(message: Message, state: FSMContext, session: AsyncSession):
     """Process broadcast with photo."""
     if not is_admin(message.from_user.id):
         return
     photo_id = message.photo[-1].file_id
     caption = message.caption or ""
     await state.update_data(broadcast_text=caption, broadcast_photo_id=photo_id)
-    async with get_session() as session:
-        total_users = await get_total_users_count(session)
+    total_users = await get_total_users_count(session)
     await message.answer(
         f"📨 <b>Подтверждение рассылки</b>\n\n"
         f"Картинка + текст будут отправлены <b>{total_users}</b> пользователям.\n\n"
@@ -484,15 +564,14 @@ async def process_broadcast_photo(message: Message, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_broadcast_message, F.text)
-async def process_broadcast_message(message: Message, state: FSMContext):
+async def process_broadcast_message(message: Message, state: FSMContext, session: AsyncSession):
     """Process broadcast text-only message."""
     if not is_admin(message.from_user.id):
         return
     
     await state.update_data(broadcast_text=message.text, broadcast_photo_id=None)
     
-    async with get_session() as session:
-        total_users = await get_total_users_count(session)
+    total_users = await get_total_users_count(session)
     
     await message.answer(
         f"📨 <b>Подтверждение рассылки</b>\n\n"
@@ -519,22 +598,31 @@ async def confirm_broadcast(callback: CallbackQuery, state: FSMContext, bot: Bot
         await callback.answer("❌ Нужен текст или картинка", show_alert=True)
         return
     
-    await callback.message.edit_text("⏳ Отправляю рассылку...")
-    
+    if not _start_background(
+        "broadcast", _broadcast_and_report(callback.message, bot, broadcast_text, broadcast_photo_id)
+    ):
+        await callback.answer("⏳ Предыдущая рассылка ещё идёт", show_alert=True)
+        return
+    await state.clear()
+    await callback.message.edit_text("⏳ Отправляю рассылку — пришлю итог, когда закончу.")
+    await callback.answer()
+
+
+async def _broadcast_and_report(
+    message: Message, bot: Bot, broadcast_text: str, broadcast_photo_id: str | None
+) -> None:
+    """Фоновая часть рассылки: разослать и прислать админу итог."""
     broadcast_service = BroadcastService(bot)
     successful, failed = await broadcast_service.broadcast_message(
         broadcast_text, photo_file_id=broadcast_photo_id
     )
-    
-    await callback.message.edit_text(
+    await message.edit_text(
         f"✅ <b>Рассылка завершена</b>\n\n"
         f"📨 Отправлено: <b>{successful}</b>\n"
         f"❌ Ошибок: <b>{failed}</b>",
         parse_mode="HTML",
         reply_markup=get_admin_keyboard()
     )
-    
-    await state.clear()
 
 
 @router.callback_query(F.data == "cancel_broadcast")
@@ -570,7 +658,7 @@ async def _render_contacts_admin_message(visible: bool, entries: list) -> str:
 @router.callback_query(F.data == "admin_contacts_back")
 @router.callback_query(F.data == "admin_contacts_toggle")
 @router.callback_query(F.data.startswith("admin_contact_del_"))
-async def admin_contacts_manage(callback: CallbackQuery, state: FSMContext):
+async def admin_contacts_manage(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Экран контактов: список, видимость, добавить/редактировать/удалить."""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа", show_alert=True)
@@ -585,20 +673,24 @@ async def admin_contacts_manage(callback: CallbackQuery, state: FSMContext):
         )
         await callback.answer()
         return
-    async with get_session() as session:
-        if data == "admin_contacts_toggle":
-            visible = await get_contacts_section_visible(session)
-            await set_contacts_section_visible(session, not visible)
-            await callback.answer("Видимость обновлена", show_alert=False)
-        elif data.startswith("admin_contact_del_"):
-            try:
-                entry_id = int(data.split("_")[-1])
-                await delete_contact_entry(session, entry_id)
-                await callback.answer("Контакт удалён", show_alert=False)
-            except (ValueError, TypeError):
-                pass
-        visible = await get_contacts_section_visible(session)
-        entries = await get_contact_entries(session, active_only=False)
+    notice = None
+    visible = await get_contacts_section_visible(session)
+    if data == "admin_contacts_toggle":
+        # Кэш настроек обновится только после commit — новое значение берём отсюда
+        visible = not visible
+        await set_contacts_section_visible(session, visible)
+        notice = "Видимость обновлена"
+    elif data.startswith("admin_contact_del_"):
+        try:
+            entry_id = int(data.split("_")[-1])
+            await delete_contact_entry(session, entry_id)
+            notice = "Контакт удалён"
+        except (ValueError, TypeError):
+            pass
+    entries = await get_contact_entries(session, active_only=False)
+    await session.commit()
+    if notice:
+        await callback.answer(notice, show_alert=False)
     text = await _render_contacts_admin_message(visible, entries)
     await callback.message.edit_text(
         text,
@@ -626,7 +718,7 @@ async def admin_contacts_add_start(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("admin_contact_edit_"))
-async def admin_contacts_edit_start(callback: CallbackQuery, state: FSMContext):
+async def admin_contacts_edit_start(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Начать редактирование контакта."""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа", show_alert=True)
@@ -636,8 +728,7 @@ async def admin_contacts_edit_start(callback: CallbackQuery, state: FSMContext):
     except (ValueError, TypeError):
         await callback.answer("Ошибка", show_alert=True)
         return
-    async with get_session() as session:
-        entry = await get_contact_entry_by_id(session, entry_id)
+    entry = await get_contact_entry_by_id(session, entry_id)
     if not entry:
         await callback.answer("Контакт не найден", show_alert=True)
         return
@@ -667,7 +758,7 @@ async def admin_contacts_username_entered(message: Message, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_contact_description, F.text)
-async def admin_contacts_description_entered(message: Message, state: FSMContext):
+async def admin_contacts_description_entered(message: Message, state: FSMContext, session: AsyncSession):
     """Принято описание — создать или обновить контакт."""
     if not is_admin(message.from_user.id):
         return
@@ -678,15 +769,16 @@ async def admin_contacts_description_entered(message: Message, state: FSMContext
     if not tg_username or not description:
         await message.answer("Тг_ник и описание не должны быть пустыми. Попробуй снова.")
         return
-    async with get_session() as session:
-        if entry_id is not None:
-            await update_contact_entry(session, entry_id, tg_username=tg_username, description=description)
-            await message.answer("✅ Контакт обновлён.")
-        else:
-            await create_contact_entry(session, tg_username=tg_username, description=description)
-            await message.answer("✅ Контакт добавлен.")
-        visible = await get_contacts_section_visible(session)
-        entries = await get_contact_entries(session, active_only=False)
+    if entry_id is not None:
+        await update_contact_entry(session, entry_id, tg_username=tg_username, description=description)
+        notice = "✅ Контакт обновлён."
+    else:
+        await create_contact_entry(session, tg_username=tg_username, description=description)
+        notice = "✅ Контакт добавлен."
+    visible = await get_contacts_section_visible(session)
+    entries = await get_contact_entries(session, active_only=False)
+    await session.commit()
+    await message.answer(notice)
     await state.clear()
     text = await _render_contacts_admin_message(visible, entries)
     await message.answer(
@@ -698,37 +790,6 @@ async def admin_contacts_description_entered(message: Message, state: FSMContext
 
 # ============ CSV Import from CRM ============
 
-# Поддержка разных названий колонок из CRM (алиасы → наша колонка)
-CRM_COLUMN_ALIASES = {
-    "email": ["email", "e-mail", "e_mail", "email_registrant", "mail"],
-    "utm_campaign": ["utm_campaign", "referrer_email", "email_referrer", "referrer mail"],
-    "utm_content": ["utm_content", "referrer_phone", "phone_referrer", "referrer phone"],
-}
-
-
-def _norm_col(s: str) -> str:
-    """Нормализация названия колонки для сравнения."""
-    return (s or "").strip().lower().replace(" ", "_").replace("-", "_")
-
-
-def _normalize_csv_row(fieldnames: list, row: dict) -> dict:
-    """Приводит строку CSV к полям (email, utm_campaign, utm_content) по алиасам колонок."""
-    def find_value(aliases):
-        for f in fieldnames:
-            if not f:
-                continue
-            fn = _norm_col(f)
-            for a in aliases:
-                if fn == _norm_col(a):
-                    return (row.get(f) or "").strip()
-        return ""
-    return {
-        "email": find_value(CRM_COLUMN_ALIASES["email"]),
-        "utm_campaign": find_value(CRM_COLUMN_ALIASES["utm_campaign"]),
-        "utm_content": find_value(CRM_COLUMN_ALIASES["utm_content"]),
-    }
-
-
 @router.callback_query(F.data == "admin_import_csv")
 async def start_csv_import(callback: CallbackQuery, state: FSMContext):
     """Start CSV import process."""
@@ -775,19 +836,13 @@ async def process_csv_import(message: Message, state: FSMContext, bot: Bot):
     file = await bot.get_file(document.file_id)
     file_content = await bot.download_file(file.file_path)
     
-    # Parse CSV
     try:
-        content = file_content.read().decode('utf-8-sig')
-        reader = csv.DictReader(io.StringIO(content))
-        fieldnames = [f.strip() for f in (reader.fieldnames or [])]
-        rows = list(reader)
-        
+        fieldnames, rows = crm_service.parse_csv(file_content.read())
         if not rows:
             await message.answer("❌ В файле нет строк с данными.", reply_markup=get_cancel_keyboard())
             await state.clear()
             return
-        norm0 = _normalize_csv_row(fieldnames, rows[0])
-        if not norm0["email"] or not norm0["utm_campaign"]:
+        if not crm_service.has_required_columns(fieldnames, rows):
             await message.answer(
                 "❌ Не найдены колонки: email (школьника) и utm_campaign/referrer_email (реферера).\n\n"
                 "Поддерживаемые имена колонок см. в описании импорта.",
@@ -797,90 +852,52 @@ async def process_csv_import(message: Message, state: FSMContext, bot: Bot):
             await state.clear()
             return
         
-        linked = 0
-        skipped = 0
-        not_found = 0
-        errors = []
-        
-        async with get_session() as session:
-            for row in rows:
-                norm = _normalize_csv_row(fieldnames, row)
-                email = norm["email"].lower()
-                utm_campaign = norm["utm_campaign"]
-                utm_content = norm["utm_content"]
-                
-                if not email or not utm_campaign:
-                    skipped += 1
-                    continue
-                
-                # Реферер: utm_campaign и utm_content могут быть короткими токенами (из Битрикса) или открытые email/phone
-                referrer = await get_referrer_by_utm_tokens(
-                    session, utm_campaign.strip(), (utm_content or "").strip()
-                )
-                if not referrer and utm_content:
-                    referrer = await get_user_by_email_and_phone(
-                        session, utm_campaign, utm_content
-                    )
-                if not referrer and utm_campaign.isdigit():
-                    referrer = await get_user_by_telegram_id(session, int(utm_campaign))
-                if not referrer:
-                    referrer = await get_user_by_email(session, utm_campaign)
-                if not referrer:
-                    errors.append(f"Реферер не найден: {utm_campaign}, {utm_content}")
-                    continue
-                
-                referrer_id = referrer.telegram_id
-                linked_user = await link_referral_by_email(session, email, referrer_id)
-                
-                if linked_user:
-                    linked += 1
-                    # Notify referrer: if they crossed a grade threshold, send grade message
-                    grade_service = GradeService()
-                    newly_achieved = await grade_service.get_grades_newly_achieved_with_session(
-                        session, referrer_id
-                    )
-                    try:
-                        if newly_achieved:
-                            for grade in newly_achieved:
-                                await grade_service.notify_grade_achieved(bot, referrer_id, grade)
-                        else:
-                            await bot.send_message(
-                                referrer_id,
-                                "🎊 Твой реферал подтверждён!\n\n"
-                                "Школьник прошёл очный этап."
-                            )
-                    except Exception:
-                        pass
-                else:
-                    not_found += 1
-        
         await state.clear()
-        
-        result_text = (
-            f"✅ <b>Импорт завершён</b>\n\n"
-            f"🔗 Связано рефералов: <b>{linked}</b>\n"
-            f"⏭ Пропущено (пустые): <b>{skipped}</b>\n"
-            f"❓ Не найдено в боте: <b>{not_found}</b>\n"
-        )
-        
-        if errors[:5]:  # Show first 5 errors
-            result_text += f"\n⚠️ Ошибки:\n" + "\n".join(f"• {e}" for e in errors[:5])
-            if len(errors) > 5:
-                result_text += f"\n... и ещё {len(errors) - 5} ошибок"
-        
+        if not _start_background("csv_import", _import_csv_and_report(message, bot, fieldnames, rows)):
+            await message.answer("⏳ Предыдущий импорт ещё идёт — отправь файл позже.", reply_markup=get_admin_keyboard())
+            return
+        await message.answer(f"⏳ Импортирую {len(rows)} строк — пришлю итог, когда закончу.")
+
+    except Exception as e:
         await message.answer(
-            result_text,
+            f"❌ Ошибка при обработке файла:\n<code>{html.escape(str(e))}</code>",
             parse_mode="HTML",
             reply_markup=get_admin_keyboard()
         )
-        
+        await state.clear()
+
+
+async def _import_csv_and_report(message: Message, bot: Bot, fieldnames: list, rows: list) -> None:
+    """Фоновая часть импорта CSV: связать рефералов в своей сессии и прислать админу итог."""
+    try:
+        async with get_session() as session:
+            result = await crm_service.import_referrals(session, fieldnames, rows, bot)
     except Exception as e:
         await message.answer(
-            f"❌ Ошибка при обработке файла:\n<code>{str(e)}</code>",
+            f"❌ Ошибка при обработке файла:\n<code>{html.escape(str(e))}</code>",
             parse_mode="HTML",
             reply_markup=get_admin_keyboard()
         )
-        await state.clear()
+        raise
+
+    result_text = (
+        f"✅ <b>Импорт завершён</b>\n\n"
+        f"🔗 Связано рефералов: <b>{result.linked}</b>\n"
+        f"⏭ Пропущено (пустые): <b>{result.skipped}</b>\n"
+        f"❓ Не найдено в боте: <b>{result.not_found}</b>\n"
+    )
+
+    errors = result.errors
+    if errors[:5]:  # Show first 5 errors
+        result_text += f"\n⚠️ Ошибки:\n" + "\n".join(f"• {html.escape(e)}" for e in errors[:5])
+        if len(errors) > 5:
+            result_text += f"\n... и ещё {len(errors) - 5} ошибок"
+
+    await message.answer(
+        result_text,
+        parse_mode="HTML",
+        reply_markup=get_admin_keyboard()
+    )
 
 
 @router.message(AdminStates.waiting_csv_file)
@@ -897,7 +914,7 @@ async def waiting_csv_wrong_type(message: Message):
 
 @router.callback_query(F.data == "admin_export")
 @router.message(Command("export"))
-async def export_users(callback_or_message: CallbackQuery | Message):
+async def export_users(callback_or_message: CallbackQuery | Message, session: AsyncSession):
     """Export users to CSV."""
     is_callback = isinstance(callback_or_message, CallbackQuery)
     user_id = callback_or_message.from_user.id
@@ -909,62 +926,17 @@ async def export_users(callback_or_message: CallbackQuery | Message):
             await callback_or_message.answer("❌ Нет доступа")
         return
     
-    async with get_session() as session:
-        users = await get_all_users(session, active_only=False)
-        
-        # Create CSV in memory
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Header
-        writer.writerow([
-            "telegram_id",
-            "username",
-            "first_name",
-            "email",
-            "phone",
-            "referrer_id",
-            "referral_count",
-            "created_at",
-            "is_subscribed",
-            "is_verified",
-            "is_active"
-        ])
-        
-        # Data (email и phone в выгрузке — расшифрованные для админа)
-        for user in users:
-            ref_count = await get_user_referral_count(session, user.telegram_id)
-            writer.writerow([
-                user.telegram_id,
-                decrypt_username(user.username) or "",
-                user.first_name or "",
-                decrypt_email(user.email) or "",
-                decrypt_phone(user.phone) or "",
-                user.referrer_id or "",
-                ref_count,
-                user.created_at.strftime("%Y-%m-%d %H:%M:%S"),
-                "Да" if user.is_subscribed else "Нет",
-                "Да" if user.is_verified else "Нет",
-                "Да" if user.is_active else "Нет"
-            ])
-    
-    csv_bytes = output.getvalue().encode("utf-8-sig")
+    csv_bytes, count = await crm_service.export_users_csv(session)
     filename = f"users_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     file = BufferedInputFile(csv_bytes, filename=filename)
     message = callback_or_message.message if is_callback else callback_or_message
     await message.answer_document(
         file,
-        caption=f"📥 Экспорт пользователей ({len(users)} записей)"
+        caption=f"📥 Экспорт пользователей ({count} записей)"
     )
     
     # Второй файл — ключ для Битрикса: токен → расшифрованное значение (для VLOOKUP в Excel)
-    key_rows = await get_all_utm_tokens_for_key_export(session)
-    key_io = io.StringIO()
-    key_writer = csv.writer(key_io)
-    key_writer.writerow(["token", "type", "decrypted_value"])
-    for token, value_type, decrypted in key_rows:
-        key_writer.writerow([token, value_type, decrypted])
-    key_bytes = key_io.getvalue().encode("utf-8-sig")
+    key_bytes = await crm_service.export_utm_key_csv(session)
     key_filename = f"utm_key_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     key_file = BufferedInputFile(key_bytes, filename=key_filename)
     await message.answer_document(
@@ -5,28 +5,29 @@ from aiogram.utils.keyboard import ReplyKeyboardBuilder
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.config import settings
 from bot.database import (
-    get_session,
     get_user_by_telegram_id,
     get_user_referral_count,
     get_top_referrers,
-    get_all_grades,
     get_user_grade_claims,
-    get_referral_tokens_for_user,
+    get_user_referral_link,
     get_contacts_section_visible,
     get_contact_entries,
     decrypt_email,
     decrypt_phone,
     decrypt_username,
 )
+from bot.database.cache import contacts_message_cache
 from bot.database.crud import (
     get_user_rank,
     update_user_email,
     update_user_phone,
     normalize_phone,
 )
+from bot.database.writer import run_write
 from bot.services.grade import GradeService, parse_rewards
 from bot.keyboards.inline import (
     get_cabinet_keyboard,
@@ -54,17 +55,28 @@ def _is_valid_phone(s: str) -> bool:
 
 
 @router.message(F.text == CONTACTS_BUTTON_TEXT)
-async def show_contacts_list(message: Message):
+async def show_contacts_list(message: Message, session: AsyncSession):
     """Показать список контактов (тг_ник — за что отвечает). Видимость и список задаёт админ."""
-    async with get_session() as session:
-        visible = await get_contacts_section_visible(session)
-        if not visible:
-            await message.answer("Сейчас раздел контактов недоступен.")
-            return
+    visible = await get_contacts_section_visible(session)
+    if not visible:
+        await message.answer("Сейчас раздел контактов недоступен.")
+        return
+    text = contacts_message_cache.get()
+    if text is None:
+        version = contacts_message_cache.version
         entries = await get_contact_entries(session, active_only=True)
-    if not entries:
+        text = _render_contacts_list(entries)
+        contacts_message_cache.set(text, version)
+    if not text:
         await message.answer("Пока нет контактов для связи. Обратись к организаторам.")
         return
+    await message.answer(text, parse_mode="HTML")
+
+
+def _render_contacts_list(entries) -> str:
+    """HTML-список контактов для пользователя; пустая строка, если контактов нет."""
+    if not entries:
+        return ""
     lines = ["📞 <b>Остались вопросы? Свяжись с нами:</b>\n"]
     for e in entries:
         nick = (e.tg_username or "").strip()
@@ -74,20 +86,19 @@ async def show_contacts_list(message: Message):
             lines.append(f"• <a href=\"https://t.me/{link_username}\">{nick}</a> — {desc}")
         else:
             lines.append(f"• {nick} — {desc}")
-    await message.answer("\n".join(lines), parse_mode="HTML")
+    return "\n".join(lines)
 
 
 @router.message(Command("cabinet"))
 @router.message(F.text == "👤 Личный кабинет")
-async def cmd_cabinet(message: Message):
+async def cmd_cabinet(message: Message, session: AsyncSession):
     """Show personal cabinet. Обновляем reply-клавиатуру (чтобы подтянулась кнопка «Связаться», если админ её включил)."""
     user_id = message.from_user.id
     is_admin = user_id in settings.ADMIN_IDS
     if is_admin:
         reply_kb = get_admin_reply_keyboard()
     else:
-        async with get_session() as session:
-            show_contacts = await get_contacts_section_visible(session)
+        show_contacts = await get_contacts_section_visible(session)
         reply_kb = get_main_menu_keyboard(show_contacts=show_contacts)
     await message.answer(
         "📋 Личный кабинет\n\n"
@@ -110,14 +121,13 @@ async def back_to_cabinet(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data == "my_stats")
-async def show_my_stats(callback: CallbackQuery):
+async def show_my_stats(callback: CallbackQuery, session: AsyncSession):
     """Show user statistics."""
     user_id = callback.from_user.id
     
-    async with get_session() as session:
-        user = await get_user_by_telegram_id(session, user_id)
-        referral_count = await get_user_referral_count(session, user_id)
-        rank = await get_user_rank(session, user_id)
+    user = await get_user_by_telegram_id(session, user_id)
+    referral_count = await get_user_referral_count(session, user_id)
+    rank = await get_user_rank(session, user_id)
     
     if not user:
         await callback.answer("❌ Пользователь не найден", show_alert=True)
@@ -141,14 +151,13 @@ async def show_my_stats(callback: CallbackQuery):
 
 @router.message(Command("stats"))
 @router.message(F.text == "📊 Статистика")
-async def cmd_stats(message: Message):
+async def cmd_stats(message: Message, session: AsyncSession):
     """Show user statistics via command."""
     user_id = message.from_user.id
     
-    async with get_session() as session:
-        user = await get_user_by_telegram_id(session, user_id)
-        referral_count = await get_user_referral_count(session, user_id)
-        rank = await get_user_rank(session, user_id)
+    user = await get_user_by_telegram_id(session, user_id)
+    referral_count = await get_user_referral_count(session, user_id)
+    rank = await get_user_rank(session, user_id)
     
     if not user:
         await message.answer("❌ Ты ещё не зарегистрирован. Напиши /start")
@@ -165,36 +174,15 @@ async def cmd_stats(message: Message):
     await message.answer(stats_text, parse_mode="HTML")
 
 
-async def _get_user_referral_link(session, user) -> str | None:
-    """Строит UTM-ссылку: при включённом шифровании — короткие токены (ник, почта, телефон), иначе — открытые данные."""
-    if not user or not user.email or not user.phone:
-        return None
-    token_medium, token_campaign, token_content = await get_referral_tokens_for_user(session, user)
-    if not token_medium and user.username:
-        token_medium = decrypt_username(user.username) or user.username or ""
-    if not token_campaign and user.email:
-        token_campaign = decrypt_email(user.email) or user.email
-    if not token_content and user.phone:
-        token_content = decrypt_phone(user.phone) or user.phone
-    if not token_campaign or not token_content:
-        return None
-    return settings.get_referral_link(
-        token_medium=token_medium or "",
-        token_campaign=token_campaign,
-        token_content=token_content,
-    )
-
-
 @router.callback_query(F.data == "my_link")
-async def show_my_link(callback: CallbackQuery):
+async def show_my_link(callback: CallbackQuery, session: AsyncSession):
     """Show user's referral link (UTM: short tokens in campaign/content, not raw email/phone)."""
     user_id = callback.from_user.id
     
-    async with get_session() as session:
-        user = await get_user_by_telegram_id(session, user_id)
-        ref_link = await _get_user_referral_link(session, user)
+    ref_link = await get_user_referral_link(session, user_id)
+    await session.commit()
     
-    if not user or not user.email or not user.phone:
+    if not ref_link:
         await callback.message.edit_text(
             "🔗 <b>Реферальная ссылка</b>\n\n"
             "Чтобы получить ссылку, нужно указать <b>email</b> и <b>номер телефона</b>.\n\n"
@@ -226,15 +214,14 @@ async def show_my_link(callback: CallbackQuery):
 
 @router.message(Command("mylink"))
 @router.message(F.text == "🔗 Моя ссылка")
-async def cmd_mylink(message: Message):
+async def cmd_mylink(message: Message, session: AsyncSession):
     """Show referral link via command or reply button «Моя ссылка»."""
     user_id = message.from_user.id
     
-    async with get_session() as session:
-        user = await get_user_by_telegram_id(session, user_id)
-        ref_link = await _get_user_referral_link(session, user)
+    ref_link = await get_user_referral_link(session, user_id)
+    await session.commit()
     
-    if not user or not user.email or not user.phone or not ref_link:
+    if not ref_link:
         await message.answer(
             "🔗 Чтобы получить реферальную ссылку, укажи email и номер телефона. Напиши /start и пройди регистрацию."
         )
@@ -252,10 +239,9 @@ async def cmd_mylink(message: Message):
 
 
 @router.callback_query(F.data == "leaderboard")
-async def show_leaderboard(callback: CallbackQuery):
+async def show_leaderboard(callback: CallbackQuery, session: AsyncSession):
     """Show top referrers."""
-    async with get_session() as session:
-        top_users = await get_top_referrers(session, limit=10)
+    top_users = await get_top_referrers(session, limit=10)
     
     if not top_users:
         await callback.message.edit_text(
@@ -288,19 +274,17 @@ async def show_leaderboard(callback: CallbackQuery):
 @router.callback_query(F.data == "grades_info")
 @router.message(Command("grades"))
 @router.message(F.text == "📊 Грейды")
-async def show_grades_info(callback_or_message: CallbackQuery | Message):
+async def show_grades_info(callback_or_message: CallbackQuery | Message, session: AsyncSession):
     """Show user's grades: table of thresholds, rewards, status (achieved/locked/issued)."""
     is_callback = isinstance(callback_or_message, CallbackQuery)
     user_id = callback_or_message.from_user.id
 
-    async with get_session() as session:
-        referral_count = await get_user_referral_count(session, user_id)
-        grades = await get_all_grades(session)
-        claims = await get_user_grade_claims(session, user_id)
-    claimed_grade_ids = {c.grade_id for c in claims}
-
-    grade_svc = GradeService()
+    grade_svc = GradeService(session)
+    referral_count = await get_user_referral_count(session, user_id)
+    grades = await grade_svc.get_grades()
     next_grade = await grade_svc.get_next_grade(referral_count)
+    claims = await get_user_grade_claims(session, user_id)
+    claimed_grade_ids = {c.grade_id for c in claims}
 
     lines = [
         f"📊 <b>Твои грейды</b>\n",
@@ -340,11 +324,10 @@ async def show_grades_info(callback_or_message: CallbackQuery | Message):
 # ============ Изменить контакты (email / телефон) ============
 
 @router.callback_query(F.data == "edit_profile")
-async def show_edit_profile(callback: CallbackQuery):
+async def show_edit_profile(callback: CallbackQuery, session: AsyncSession):
     """Show profile edit menu (email / phone)."""
     user_id = callback.from_user.id
-    async with get_session() as session:
-        user = await get_user_by_telegram_id(session, user_id)
+    user = await get_user_by_telegram_id(session, user_id)
     if not user:
         await callback.answer("❌ Пользователь не найден", show_alert=True)
         return
@@ -377,14 +360,14 @@ async def start_edit_email(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(ProfileStates.edit_email, F.text)
-async def process_edit_email(message: Message, state: FSMContext):
+async def process_edit_email(message: Message, state: FSMContext, session: AsyncSession):
     """Save new email."""
     email = (message.text or "").strip()
     if not _is_valid_email(email):
         await message.answer("❌ Неверный формат email. Попробуй ещё раз.")
         return
-    async with get_session() as session:
-        await update_user_email(session, message.from_user.id, email)
+    await run_write(session, lambda db: update_user_email(db, message.from_user.id, email))
+    await session.commit()
     await state.clear()
     await message.answer(
         f"✅ Email обновлён: <code>{email}</code>\n\nРеферальная ссылка перегенерирована.",
@@ -413,14 +396,14 @@ async def start_edit_phone(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(ProfileStates.edit_phone, F.contact)
-async def process_edit_phone_contact(message: Message, state: FSMContext):
+async def process_edit_phone_contact(message: Message, state: FSMContext, session: AsyncSession):
     """Save phone from shared contact."""
     if message.contact.user_id != message.from_user.id:
         await message.answer("Поделись своим контактом.")
         return
     phone = message.contact.phone_number or ""
-    async with get_session() as session:
-        await update_user_phone(session, message.from_user.id, phone)
+    await run_write(session, lambda db: update_user_phone(db, message.from_user.id, phone))
+    await session.commit()
     await state.clear()
     await message.answer(
         f"✅ Номер обновлён: <code>{normalize_phone(phone)}</code>\n\nРеферальная ссылка перегенерирована.",
@@ -430,14 +413,14 @@ async def process_edit_phone_contact(message: Message, state: FSMContext):
 
 
 @router.message(ProfileStates.edit_phone, F.text)
-async def process_edit_phone_text(message: Message, state: FSMContext):
+async def process_edit_phone_text(message: Message, state: FSMContext, session: AsyncSession):
     """Save phone typed manually."""
     phone = (message.text or "").strip()
     if not _is_valid_phone(phone):
         await message.answer("❌ Введи корректный номер (например: +79001234567).")
         return
-    async with get_session() as session:
-        await update_user_phone(session, message.from_user.id, phone)
+    await run_write(session, lambda db: update_user_phone(db, message.from_user.id, phone))
+    await session.commit()
     await state.clear()
     await message.answer(
         f"✅ Номер обновлён: <code>{normalize_phone(phone)}</code>\n\nРеферальная ссылка перегенерирована.",
@@ -1,51 +1,33 @@
 from aiogram import Router, F
-from aiogram.types import Message
+from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from bot.config import settings
 from bot.database import (
-    get_session,
-    get_user_referrals,
-    get_user_by_telegram_id,
-    get_referral_tokens_for_user,
-    decrypt_email,
-    decrypt_phone,
+    get_referred_users_page,
+    get_user_referral_link,
     decrypt_username,
 )
+from bot.keyboards.inline import get_referrals_page_keyboard
 
 
 router = Router(name="referral")
 
+REFERRALS_PAGE_SIZE = 20
+
 
 @router.message(Command("myreferrals"))
-async def cmd_my_referrals(message: Message):
+async def cmd_my_referrals(message: Message, session: AsyncSession):
     """Show list of user's referrals (only confirmed ones)."""
     user_id = message.from_user.id
-    async with get_session() as session:
-        user = await get_user_by_telegram_id(session, user_id)
-        if user and user.email and user.phone:
-            token_medium, token_campaign, token_content = await get_referral_tokens_for_user(session, user)
-            if not token_medium and user.username:
-                token_medium = decrypt_username(user.username) or user.username or ""
-            if not token_campaign and user.email:
-                token_campaign = decrypt_email(user.email) or user.email
-            if not token_content and user.phone:
-                token_content = decrypt_phone(user.phone) or user.phone
-            ref_link = (
-                settings.get_referral_link(
-                    token_medium=token_medium or "",
-                    token_campaign=token_campaign or "",
-                    token_content=token_content or "",
-                )
-                if (token_campaign and token_content) else "Укажи email и телефон (/start), чтобы получить ссылку."
-            )
-        else:
-            ref_link = "Укажи email и телефон (/start), чтобы получить ссылку."
-    
-    async with get_session() as session:
-        referrals = await get_user_referrals(session, user_id)
+    page_rows, total = await get_referred_users_page(session, user_id, limit=REFERRALS_PAGE_SIZE)
     
-    if not referrals:
+    if not total:
+        ref_link = (
+            await get_user_referral_link(session, user_id)
+            or "Укажи email и телефон (/start), чтобы получить ссылку."
+        )
+        await session.commit()
         await message.answer(
             "👥 <b>Твои подтверждённые рефералы</b>\n\n"
             "У тебя пока нет подтверждённых рефералов.\n\n"
@@ -59,20 +41,55 @@ async def cmd_my_referrals(message: Message):
         )
         return
     
-    text = f"👥 <b>Твои подтверждённые рефералы ({len(referrals)})</b>\n\n"
+    await message.answer(
+        _render_referrals_page(page_rows, total, page=0),
+        parse_mode="HTML",
+        reply_markup=get_referrals_page_keyboard(0, has_next=total > REFERRALS_PAGE_SIZE),
+    )
+
+
+@router.callback_query(F.data.startswith("myrefs_page_"))
+async def referrals_page(callback: CallbackQuery, session: AsyncSession):
+    """Следующая/предыдущая страница списка рефералов."""
+    try:
+        page = max(int(callback.data.replace("myrefs_page_", "")), 0)
+    except ValueError:
+        await callback.answer("Ошибка", show_alert=True)
+        return
+    user_id = callback.from_user.id
+    offset = page * REFERRALS_PAGE_SIZE
+    page_rows, total = await get_referred_users_page(
+        session, user_id, limit=REFERRALS_PAGE_SIZE, offset=offset
+    )
+    if not page_rows and page > 0:
+        # Список стал короче — показываем первую страницу
+        page, offset = 0, 0
+        page_rows, total = await get_referred_users_page(session, user_id, limit=REFERRALS_PAGE_SIZE)
+    if not page_rows:
+        await callback.answer("У тебя пока нет подтверждённых рефералов.", show_alert=True)
+        return
+    await callback.message.edit_text(
+        _render_referrals_page(page_rows, total, page=page),
+        parse_mode="HTML",
+        reply_markup=get_referrals_page_keyboard(page, has_next=offset + len(page_rows) < total),
+    )
+    await callback.answer()
+
+
+def _render_referrals_page(page_rows, total: int, page: int) -> str:
+    """Текст одной страницы списка рефералов."""
+    text = f"👥 <b>Твои подтверждённые рефералы ({total})</b>\n\n"
     text += "Это школьники, которые прошли очный этап по твоей ссылке:\n\n"
     
-    async with get_session() as session:
-        for i, ref in enumerate(referrals[:20], 1):  # Show max 20
-            referred_user = await get_user_by_telegram_id(session, ref.referred_id)
-            if referred_user:
-                name = referred_user.first_name or decrypt_username(referred_user.username) or "Аноним"
-                date = ref.created_at.strftime("%d.%m.%Y")
-                text += f"{i}. {name} — {date}\n"
-    
-    if len(referrals) > 20:
-        text += f"\n... и ещё {len(referrals) - 20} рефералов"
+    start = page * REFERRALS_PAGE_SIZE + 1
+    for i, (first_name, username, created_at) in enumerate(page_rows, start):
+        name = first_name or decrypt_username(username) or "Аноним"
+        date = created_at.strftime("%d.%m.%Y")
+        text += f"{i}. {name} — {date}\n"
     
-    text += f"\n\n📊 Рефералов: <b>{len(referrals)}</b> — смотри раздел «Грейды» для наград за рубежи."
+    if total > REFERRALS_PAGE_SIZE:
+        last = start + len(page_rows) - 1
+        text += f"\nПоказаны {start}–{last} из {total}"
     
-    await message.answer(text, parse_mode="HTML")
+    text += f"\n\n📊 Рефералов: <b>{total}</b> — смотри раздел «Грейды» для наград за рубежи."
+    return text
@@ -6,10 +6,12 @@ from aiogram.filters import CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 import re
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.config import settings
-from bot.database import get_session, get_or_create_user, get_user_by_telegram_id, update_user_subscription, get_contacts_section_visible
+from bot.database import get_or_create_user, get_user_by_telegram_id, update_user_subscription, get_contacts_section_visible
 from bot.database.crud import update_user_email, update_user_phone, normalize_phone
+from bot.database.writer import run_write
 from bot.keyboards.inline import get_cabinet_keyboard
 from bot.keyboards.reply import get_main_menu_keyboard, get_admin_reply_keyboard
 from bot.services.subscription import check_subscription
@@ -31,7 +33,7 @@ def is_valid_email(email: str) -> bool:
 
 
 @router.message(CommandStart())
-async def cmd_start(message: Message, bot: Bot, state: FSMContext):
+async def cmd_start(message: Message, bot: Bot, state: FSMContext, session: AsyncSession):
     """Handle /start command."""
     user_id = message.from_user.id
     username = message.from_user.username
@@ -45,14 +47,14 @@ async def cmd_start(message: Message, bot: Bot, state: FSMContext):
     
     if not is_subscribed:
         # Пользователь ещё не в закрытом канале — только текст, без кнопок
-        async with get_session() as session:
-            await get_or_create_user(
-                session,
-                telegram_id=user_id,
-                username=username,
-                first_name=first_name,
-                is_admin=is_admin,
-            )
+        await run_write(session, lambda db: get_or_create_user(
+            db,
+            telegram_id=user_id,
+            username=username,
+            first_name=first_name,
+            is_admin=is_admin,
+        ))
+        await session.commit()
         await message.answer(
             f"👋 Привет, {first_name}!\n\n"
             "Ты попал в бот реферальной программы.\n\n"
@@ -63,19 +65,26 @@ async def cmd_start(message: Message, bot: Bot, state: FSMContext):
         return
     
     # User is subscribed = passed the event
-    async with get_session() as session:
-        user, created = await get_or_create_user(
-            session,
+    async def register(db: AsyncSession):
+        result = await get_or_create_user(
+            db,
             telegram_id=user_id,
             username=username,
             first_name=first_name,
             is_admin=is_admin,
         )
-        await update_user_subscription(session, user_id, True)
-        
-        # Check if user has email and phone
-        has_email = bool(user.email)
-        has_phone = bool(user.phone)
+        await update_user_subscription(db, user_id, True)
+        return result
+
+    user, created = await run_write(session, register)
+    
+    # Check if user has email and phone
+    has_email = bool(user.email)
+    has_phone = bool(user.phone)
+    show_contacts = False
+    if not created and has_email and has_phone and not is_admin:
+        show_contacts = await get_contacts_section_visible(session)
+    await session.commit()
     
     if created or not has_email:
         # New user or user without email - request email
@@ -104,8 +113,6 @@ async def cmd_start(message: Message, bot: Bot, state: FSMContext):
         return
     
     # Existing user with email and phone - show cabinet
-    async with get_session() as session:
-        show_contacts = await get_contacts_section_visible(session)
     reply_kb = get_admin_reply_keyboard() if is_admin else get_main_menu_keyboard(show_contacts=show_contacts)
     await message.answer(
         f"👋 С возвращением, {first_name}!\n\n"
@@ -119,7 +126,7 @@ async def cmd_start(message: Message, bot: Bot, state: FSMContext):
 
 
 @router.message(RegistrationStates.waiting_email)
-async def process_email(message: Message, state: FSMContext, bot: Bot):
+async def process_email(message: Message, state: FSMContext, bot: Bot, session: AsyncSession):
     """Process email input, then ask for phone."""
     email = message.text.strip() if message.text else ""
     
@@ -132,8 +139,8 @@ async def process_email(message: Message, state: FSMContext, bot: Bot):
     
     user_id = message.from_user.id
     
-    async with get_session() as session:
-        await update_user_email(session, user_id, email)
+    await run_write(session, lambda db: update_user_email(db, user_id, email))
+    await session.commit()
     
     await state.set_state(RegistrationStates.waiting_phone)
     kb = ReplyKeyboardBuilder()
@@ -155,17 +162,17 @@ def is_valid_phone(phone: str) -> bool:
 
 
 @router.message(RegistrationStates.waiting_phone, F.contact)
-async def process_phone_contact(message: Message, state: FSMContext, bot: Bot):
+async def process_phone_contact(message: Message, state: FSMContext, bot: Bot, session: AsyncSession):
     """Process shared contact (phone from Telegram)."""
     phone = message.contact.phone_number or ""
     if message.contact.user_id != message.from_user.id:
         await message.answer("Пожалуйста, поделись именно своим контактом.")
         return
-    await _save_phone_and_finish(message, state, phone, bot)
+    await _save_phone_and_finish(message, state, phone, bot, session)
 
 
 @router.message(RegistrationStates.waiting_phone, F.text)
-async def process_phone_text(message: Message, state: FSMContext, bot: Bot):
+async def process_phone_text(message: Message, state: FSMContext, bot: Bot, session: AsyncSession):
     """Process phone typed manually."""
     phone = (message.text or "").strip()
     if not is_valid_phone(phone):
@@ -173,20 +180,21 @@ async def process_phone_text(message: Message, state: FSMContext, bot: Bot):
             "❌ Введи корректный номер (например: +79001234567 или 89001234567)."
         )
         return
-    await _save_phone_and_finish(message, state, phone, bot)
+    await _save_phone_and_finish(message, state, phone, bot, session)
 
 
-async def _save_phone_and_finish(message: Message, state: FSMContext, phone: str, bot: Bot):
+async def _save_phone_and_finish(
+    message: Message, state: FSMContext, phone: str, bot: Bot, session: AsyncSession
+):
     """Save phone to DB and show cabinet."""
     user_id = message.from_user.id
     
-    async with get_session() as session:
-        await update_user_phone(session, user_id, phone)
+    is_admin = user_id in settings.ADMIN_IDS
+    await run_write(session, lambda db: update_user_phone(db, user_id, phone))
+    show_contacts = False if is_admin else await get_contacts_section_visible(session)
+    await session.commit()
     
     await state.clear()
-    is_admin = user_id in settings.ADMIN_IDS
-    async with get_session() as session:
-        show_contacts = await get_contacts_section_visible(session)
     reply_kb = get_admin_reply_keyboard() if is_admin else get_main_menu_keyboard(show_contacts=show_contacts)
 
     # 1) Первое сообщение — только текст
@@ -222,7 +230,9 @@ async def _save_phone_and_finish(message: Message, state: FSMContext, phone: str
 
 
 @router.callback_query(F.data == "check_subscription")
-async def check_subscription_callback(callback: CallbackQuery, bot: Bot, state: FSMContext):
+async def check_subscription_callback(
+    callback: CallbackQuery, bot: Bot, state: FSMContext, session: AsyncSession
+):
     """Handle subscription check button."""
     user_id = callback.from_user.id
     first_name = callback.from_user.first_name
@@ -238,11 +248,18 @@ async def check_subscription_callback(callback: CallbackQuery, bot: Bot, state:
         return
     
     # Update subscription status
-    async with get_session() as session:
-        await update_user_subscription(session, user_id, True)
-        user = await get_user_by_telegram_id(session, user_id)
-        has_email = bool(user.email) if user else False
-        has_phone = bool(user.phone) if user else False
+    is_admin = user_id in settings.ADMIN_IDS
+    async def confirm_subscription(db: AsyncSession):
+        await update_user_subscription(db, user_id, True)
+        return await get_user_by_telegram_id(db, user_id)
+
+    user = await run_write(session, confirm_subscription)
+    has_email = bool(user.email) if user else False
+    has_phone = bool(user.phone) if user else False
+    show_contacts = False
+    if has_email and has_phone and not is_admin:
+        show_contacts = await get_contacts_section_visible(session)
+    await session.commit()
     
     await callback.answer("✅ Подписка подтверждена!")
     
@@ -267,9 +284,6 @@ async def check_subscription_callback(callback: CallbackQuery, bot: Bot, state:
             reply_markup=kb.as_markup(resize_keyboard=True)
         )
     else:
-        is_admin = user_id in settings.ADMIN_IDS
-        async with get_session() as session:
-            show_contacts = await get_contacts_section_visible(session)
         reply_kb = get_admin_reply_keyboard() if is_admin else get_main_menu_keyboard(show_contacts=show_contacts)
         await callback.message.answer(
             "🎉 Отлично! Подписка подтверждена.\n\n"
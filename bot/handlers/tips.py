@@ -1,8 +1,8 @@
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from bot.config import settings
 from bot.keyboards.inline import get_tips_keyboard, get_back_to_cabinet_keyboard
 
 
@@ -152,36 +152,13 @@ async def show_tip_forums(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "tip_templates")
-async def show_tip_templates(callback: CallbackQuery):
+async def show_tip_templates(callback: CallbackQuery, session: AsyncSession):
     """Show text templates with real UTM referral link (tokens in UTM, not raw PII)."""
-    from bot.database import (
-        get_session,
-        get_user_by_telegram_id,
-        get_referral_tokens_for_user,
-        decrypt_email,
-        decrypt_phone,
-        decrypt_username,
-    )
+    from bot.database import get_user_referral_link
     
-    user_id = callback.from_user.id
-    ref_link = ""
-    async with get_session() as session:
-        user = await get_user_by_telegram_id(session, user_id)
-        if user and user.email and user.phone:
-            token_medium, token_campaign, token_content = await get_referral_tokens_for_user(session, user)
-            if not token_medium and user.username:
-                token_medium = decrypt_username(user.username) or user.username or ""
-            if not token_campaign and user.email:
-                token_campaign = decrypt_email(user.email) or user.email
-            if not token_content and user.phone:
-                token_content = decrypt_phone(user.phone) or user.phone
-            if token_campaign and token_content:
-                ref_link = settings.get_referral_link(
-                    token_medium=token_medium or "",
-                    token_campaign=token_campaign,
-                    token_content=token_content,
-                )
-    if not ref_link or (user and (not user.email or not user.phone)):
+    ref_link = await get_user_referral_link(session, callback.from_user.id)
+    await session.commit()
+    if not ref_link:
         ref_link = "[укажи email и телефон в /start — тогда здесь появится твоя ссылка]"
     
     # Replace [ссылка] with actual UTM link
@@ -65,6 +65,20 @@ def get_back_to_cabinet_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+def get_referrals_page_keyboard(page: int, has_next: bool) -> InlineKeyboardMarkup | None:
+    """Навигация по страницам списка рефералов (/myreferrals)."""
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"myrefs_page_{page - 1}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton(text="Далее ▶️", callback_data=f"myrefs_page_{page + 1}"))
+    if not buttons:
+        return None
+    builder = InlineKeyboardBuilder()
+    builder.row(*buttons)
+    return builder.as_markup()
+
+
 def get_tips_keyboard() -> InlineKeyboardMarkup:
     """Tips navigation keyboard."""
     builder = InlineKeyboardBuilder()
@@ -99,6 +113,9 @@ def get_admin_keyboard() -> InlineKeyboardMarkup:
     builder.row(
         InlineKeyboardButton(text="📞 Кнопка «Связаться»", callback_data="admin_contacts"),
     )
+    builder.row(
+        InlineKeyboardButton(text="🔗 Сгенерировать ссылки", callback_data="admin_pregen_links"),
+    )
     return builder.as_markup()
 
 
@@ -159,16 +176,33 @@ def get_grade_manage_keyboard(grade_id: int) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def get_grade_users_keyboard(grade_id: int, user_claimed_ids: list) -> InlineKeyboardMarkup:
-    """List of users who reached grade; claim buttons. user_claimed_ids = list of user_id who already have claim."""
+def get_grade_users_keyboard(
+    grade_id: int, users: list, page: int, has_next: bool
+) -> InlineKeyboardMarkup:
+    """Users who reached grade (one page): claim buttons, paging, Back. users = [(telegram_id, name, claimed)]."""
     builder = InlineKeyboardBuilder()
-    # Buttons are added in handler per user
+    for telegram_id, name, claimed in users:
+        builder.row(get_grade_user_button(grade_id, telegram_id, name, claimed))
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=f"admin_gu_{grade_id}_{page - 1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=f"admin_gu_{grade_id}_{page + 1}"))
+    if nav:
+        builder.row(*nav)
     builder.row(
         InlineKeyboardButton(text="◀️ Назад", callback_data=f"admin_grade_view_{grade_id}"),
     )
     return builder.as_markup()
 
 
+def get_grade_user_button(grade_id: int, telegram_id: int, name: str, claimed: bool) -> InlineKeyboardButton:
+    """Button for one user in grade users list: «Выдать» or «✅ Выдано»."""
+    if claimed:
+        return InlineKeyboardButton(text=f"{name} — ✅ Выдано", callback_data="admin_noop")
+    return InlineKeyboardButton(text=f"{name} — Выдать", callback_data=f"admin_gc_{grade_id}_{telegram_id}")
+
+
 def get_back_to_grades_keyboard() -> InlineKeyboardMarkup:
     """Back to grades list."""
     builder = InlineKeyboardBuilder()
@@ -4,14 +4,28 @@ import sys
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from bot.config import settings
-from bot.database import init_db
+from bot.database import get_session, init_db, load_bot_settings, get_db_settings_report
+from bot.database.session import engine
+from bot.database.writer import db_writer
+from bot.fsm_storage import create_fsm_storage
 from bot.handlers import get_all_routers
-from bot.middlewares import SubscriptionMiddleware
+from bot.metrics import registry, start_metrics_server, stop_metrics_server
+from bot.middlewares import (
+    DatabaseSessionMiddleware,
+    HandlerMetricsMiddleware,
+    SubscriptionMiddleware,
+    TelegramApiMetricsMiddleware,
+    UpdateDeduplicationMiddleware,
+    UpdateSchedulerMiddleware,
+)
 from bot.scheduler import start_scheduler, shutdown_scheduler
+from bot.webhook import run_webhook
+from bot.workers import run_ingress
 
 
 # Configure logging
@@ -23,11 +37,30 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def on_startup(bot: Bot):
+async def on_startup(bot: Bot, worker_index: int = 0):
     """Actions to perform on bot startup."""
     logger.info("Initializing database...")
     await init_db()
+    db_report = await get_db_settings_report()
+    logger.info("Database: " + ", ".join(f"{k}={v}" for k, v in db_report.items()))
+    if db_report.get("dialect") == "sqlite" and settings.SQLITE_JOURNAL_MODE and (
+        str(db_report.get("journal_mode")).lower() != settings.SQLITE_JOURNAL_MODE.lower()
+    ):
+        logger.warning(
+            f"SQLite journal_mode is {db_report.get('journal_mode')}, expected {settings.SQLITE_JOURNAL_MODE}"
+        )
+    if db_writer is not None:
+        logger.info(
+            f"Single DB writer: batch window {settings.DB_WRITE_BATCH_MS} ms, max batch {settings.DB_WRITE_MAX_BATCH}"
+        )
+    async with get_session() as session:
+        await load_bot_settings(session)
+    if settings.METRICS_PORT:
+        await start_metrics_server(settings.METRICS_HOST, settings.METRICS_PORT + worker_index)
     
+    if worker_index != 0:
+        # Планировщик и уведомления — только в одном воркере
+        return
     await start_scheduler(bot)
     
     # Get bot info
@@ -45,9 +78,15 @@ async def on_startup(bot: Bot):
             logger.warning(f"Failed to notify admin {admin_id}: {e}")
 
 
-async def on_shutdown(bot: Bot):
+async def on_shutdown(bot: Bot, worker_index: int = 0):
     """Actions to perform on bot shutdown."""
     logger.info("Bot is shutting down...")
+    if db_writer is not None:
+        # Апдейты уже дообработаны (drain_updates) — дописать оставшиеся задания
+        await db_writer.close()
+    await stop_metrics_server()
+    if worker_index != 0:
+        return
     shutdown_scheduler()
     
     # Notify admins
@@ -58,36 +97,102 @@ async def on_shutdown(bot: Bot):
             pass
 
 
-async def main():
-    """Main entry point."""
-    # Create bot instance
+def create_bot() -> Bot:
+    """Bot instance with default HTML parse mode."""
+    session = None
+    if settings.TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(settings.TELEGRAM_API_URL))
     bot = Bot(
         token=settings.BOT_TOKEN,
+        session=session,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
-    
-    # Create dispatcher with memory storage for FSM
-    dp = Dispatcher(storage=MemoryStorage())
+    # Время, ошибки и 429 каждого метода Bot API — в метрики
+    bot.session.middleware(TelegramApiMetricsMiddleware())
+    return bot
+
+
+def create_dispatcher() -> Dispatcher:
+    """Dispatcher with storage, middlewares and routers (общий для polling и webhook)."""
+    # FSM storage переживает перезапуск (FSM_STORAGE: sql | redis | memory)
+    dp = Dispatcher(storage=create_fsm_storage())
     
     # Register startup/shutdown handlers
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
     
+    # Перед встроенными middleware aiogram (FSM читает состояние уже в очереди пользователя):
+    # - повторно доставленные апдейты (тот же update_id) не обрабатываются;
+    # - очереди апдейтов: ограничение параллельности, порядок для каждого пользователя, backpressure
+    scheduler = UpdateSchedulerMiddleware(settings.UPDATE_CONCURRENCY, settings.UPDATE_MAX_PENDING)
+    builtin = list(dp.update.outer_middleware)
+    for middleware in builtin:
+        dp.update.outer_middleware.unregister(middleware)
+    dp.update.outer_middleware(UpdateDeduplicationMiddleware())
+    dp.update.outer_middleware(scheduler)
+    for middleware in builtin:
+        dp.update.outer_middleware(middleware)
+    
+    async def drain_updates():
+        await scheduler.drain(settings.SHUTDOWN_TIMEOUT)
+    
+    # Дождаться очередей до остальных shutdown-хендлеров (aiogram первым регистрирует закрытие FSM storage)
+    dp.shutdown.register(drain_updates)
+    dp.shutdown.handlers.insert(0, dp.shutdown.handlers.pop())
+    
+    # Middleware: одна сессия БД на апдейт (аргумент session в хендлерах)
+    dp.update.outer_middleware(DatabaseSessionMiddleware())
+    registry.callback("bot_update_queue_pending", "Апдейтов принято и ждёт обработки", lambda: scheduler.pending)
+    registry.callback("bot_update_queue_peak", "Максимум ждущих апдейтов", lambda: scheduler.peak_pending)
+    registry.callback(
+        "bot_update_throttled_total", "Сколько раз приём апдейтов ждал места в очереди",
+        lambda: scheduler.throttled, kind="counter",
+    )
+    
     # Middleware: проверка подписки на канал (кроме /start и проверки подписки)
     dp.message.middleware(SubscriptionMiddleware())
     dp.callback_query.middleware(SubscriptionMiddleware())
     
+    # Время и ошибки хендлеров (для всех роутеров; после проверки подписки)
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+    
     # Register all routers
     for router in get_all_routers():
         dp.include_router(router)
         logger.info(f"Registered router: {router.name}")
+    return dp
+
+
+async def main():
+    """Main entry point."""
+    bot = create_bot()
+    dp = create_dispatcher()
     
-    # Start polling
-    logger.info("Starting bot polling...")
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if settings.WORKERS > 1:
+            if settings.BOT_MODE.strip().lower() != "webhook":
+                raise ValueError("WORKERS > 1 requires BOT_MODE=webhook")
+            if settings.DB_SINGLE_WRITER and engine.dialect.name == "sqlite":
+                # Писатель свой в каждом процессе: WORKERS писателей снова спорят за один файл SQLite
+                raise ValueError("DB_SINGLE_WRITER is process-local: with SQLite use WORKERS=1 (or PostgreSQL)")
+            logger.info(f"Starting webhook ingress with {settings.WORKERS} workers...")
+            await run_ingress(bot, dp.resolve_used_update_types())
+        elif settings.BOT_MODE.strip().lower() == "webhook":
+            logger.info("Starting bot in webhook mode...")
+            await run_webhook(bot, dp)
+        else:
+            logger.info("Starting bot polling...")
+            await bot.delete_webhook()
+            # Параллельность и порядок обеспечивает UpdateSchedulerMiddleware
+            await dp.start_polling(
+                bot,
+                handle_as_tasks=False,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
     finally:
         await bot.session.close()
+        await engine.dispose()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,330 @@
+"""
+Метрики бота в текстовом формате Prometheus (GET /metrics на METRICS_HOST:METRICS_PORT).
+
+Без внешних зависимостей: счётчики, гистограммы и «вычисляемые» метрики, значение которых
+берётся в момент запроса (глубина очередей, статистика SQL из query_stats, кэши).
+Значения собираются всегда (это несколько операций со словарём на событие), HTTP-сервер
+поднимается, только если задан METRICS_PORT. При WORKERS > 1 у каждого воркера свой
+порт: METRICS_PORT + номер воркера.
+"""
+import logging
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar, Union
+
+from aiohttp import web
+
+from bot.database.cache import contacts_message_cache, referral_link_cache
+from bot.database.query_stats import UPDATE_STATEMENT_BUCKETS, query_stats
+from bot.database.session import engine
+from bot.database.writer import db_writer
+
+logger = logging.getLogger(__name__)
+
+LabelValues = Tuple[str, ...]
+T = TypeVar("T")
+
+# Секунды: от быстрых SQL-запросов до медленных вызовов Telegram
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels → [счётчики по корзинам (не накопительные) + «больше последней», сумма]
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = entry
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        total[0] += value
+
+    def count(self, *labels: str) -> int:
+        entry = self._values.get(labels)
+        return sum(entry[0]) if entry else 0
+
+    def snapshot(self) -> Dict[LabelValues, Tuple[int, float]]:
+        """{метки: (число наблюдений, сумма)} — для разницы за интервал."""
+        return {labels: (sum(counts), total[0]) for labels, (counts, total) in self._values.items()}
+
+    def render(self) -> List[str]:
+        lines = []
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total[0])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Значение вычисляется при каждом запросе /metrics: число или {значения меток: число}."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Union[float, Dict[LabelValues, float]]],
+        labelnames: Sequence[str] = (),
+        kind: str = "gauge",
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        value = self.callback()
+        if not isinstance(value, dict):
+            return [f"{self.name} {_number(value)}"]
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(v)}" for labels, v in value.items()]
+
+
+class Registry:
+    """Все метрики процесса; render() — текст для /metrics."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        # Повторная регистрация (новый Dispatcher в том же процессе) заменяет прежнюю
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Union[float, Dict[LabelValues, float]]],
+        labelnames: Sequence[str] = (),
+        kind: str = "gauge",
+    ) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, callback, labelnames, kind))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            try:
+                samples = metric.render()
+            except Exception:
+                logger.exception(f"Metric {metric.name} failed")
+                continue
+            lines += metric.header() + samples
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# ============ Метрики ============
+
+handler_duration = registry.histogram(
+    "bot_handler_duration_seconds", "Время обработки события хендлером", ("router", "handler")
+)
+handler_errors = registry.counter(
+    "bot_handler_errors_total", "Исключения в хендлерах", ("router", "handler", "error")
+)
+telegram_request_duration = registry.histogram(
+    "bot_telegram_request_duration_seconds", "Время запроса к Telegram Bot API", ("method",)
+)
+telegram_request_errors = registry.counter(
+    "bot_telegram_request_errors_total", "Ошибки запросов к Telegram Bot API", ("method", "error")
+)
+telegram_rate_limited = registry.counter(
+    "bot_telegram_rate_limited_total", "Ответы 429 (Too Many Requests) от Telegram", ("method",)
+)
+broadcast_pending = registry.gauge("bot_broadcast_pending", "Получателей рассылки в очереди")
+csv_import_pending = registry.gauge("bot_csv_import_pending", "Строк CSV-импорта в очереди")
+broadcast_pending.set(0)
+csv_import_pending.set(0)
+
+
+def track_queue(gauge: Gauge, items: Sequence[T]) -> Iterator[T]:
+    """Перебрать items, держа в gauge число ещё не начатых (остаток снимается и при выходе из цикла)."""
+    remaining = len(items)
+    gauge.inc(amount=remaining)
+    try:
+        for item in items:
+            remaining -= 1
+            gauge.dec()
+            yield item
+    finally:
+        gauge.dec(amount=remaining)
+
+
+registry.callback("bot_db_statements_total", "Выполненные SQL-запросы", lambda: query_stats.total, kind="counter")
+registry.callback("bot_db_statement_errors_total", "SQL-запросы с ошибкой", lambda: query_stats.errors, kind="counter")
+registry.callback(
+    "bot_db_slow_statements_total", "SQL-запросы дольше DB_SLOW_QUERY_MS", lambda: query_stats.slow, kind="counter"
+)
+registry.callback(
+    "bot_db_statement_seconds_total", "Суммарное время SQL-запросов", lambda: query_stats.total_time, kind="counter"
+)
+
+
+class _StatementsPerUpdate(_Metric):
+    """Гистограмма из query_stats (корзины UPDATE_STATEMENT_BUCKETS)."""
+    kind = "histogram"
+
+    def render(self) -> List[str]:
+        lines, cumulative = [], 0
+        for bound, count in zip(UPDATE_STATEMENT_BUCKETS + (float("inf"),), query_stats.update_buckets):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{_number(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {query_stats.update_statements}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+registry.register(_StatementsPerUpdate("bot_db_statements_per_update", "SQL-запросов на апдейт"))
+if hasattr(engine.sync_engine.pool, "checkedout"):  # у NullPool (SQLite) счётчика нет
+    registry.callback("bot_db_pool_checked_out", "Соединений БД выдано из пула", engine.sync_engine.pool.checkedout)
+registry.callback(
+    "bot_db_write_queue_depth",
+    "Заданий в очереди единственного писателя (DB_SINGLE_WRITER)",
+    lambda: db_writer.depth if db_writer is not None else 0,
+)
+
+_CACHES = {"referral_link": referral_link_cache, "contacts_message": contacts_message_cache}
+registry.callback(
+    "bot_cache_hits_total", "Попадания в кэш", lambda: {(name,): c.hits for name, c in _CACHES.items()}, ("cache",),
+    kind="counter",
+)
+registry.callback(
+    "bot_cache_misses_total", "Промахи кэша", lambda: {(name,): c.misses for name, c in _CACHES.items()}, ("cache",),
+    kind="counter",
+)
+registry.callback("bot_referral_link_cache_size", "Ссылок в кэше", lambda: len(referral_link_cache))
+
+
+# ============ HTTP ============
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def metrics_view(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+async def start_metrics_server(host: str, port: int) -> None:
+    """Поднять GET /metrics (отдельный порт: на публичный вебхук метрики не попадают)."""
+    global _runner
+    if _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_view)
+    runner = web.AppRunner(app, handle_signals=False, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    _runner = runner
+    logger.info(f"Metrics: http://{host}:{port}/metrics")
+
+
+async def stop_metrics_server() -> None:
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -1,3 +1,14 @@
+from .database import DatabaseSessionMiddleware
+from .dedup import UpdateDeduplicationMiddleware
+from .metrics import HandlerMetricsMiddleware, TelegramApiMetricsMiddleware
+from .scheduler import UpdateSchedulerMiddleware
 from .subscription import SubscriptionMiddleware
 
-__all__ = ["SubscriptionMiddleware"]
+__all__ = [
+    "DatabaseSessionMiddleware",
+    "UpdateDeduplicationMiddleware",
+    "HandlerMetricsMiddleware",
+    "TelegramApiMetricsMiddleware",
+    "UpdateSchedulerMiddleware",
+    "SubscriptionMiddleware",
+]
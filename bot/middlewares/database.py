@@ -0,0 +1,69 @@
+import logging
+from typing import Callable, Dict, Any, Awaitable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from bot.config import settings
+from bot.database.query_stats import query_stats
+from bot.database.session import async_session_maker, start_update_stats
+
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseSessionMiddleware(BaseMiddleware):
+    """
+    Одна сессия БД на апдейт: хендлер получает её аргументом ``session``.
+
+    Соединение берётся из пула только при первом запросе (AsyncSession ленивая),
+    в конце апдейта — один commit (или rollback при ошибке). Хендлер может
+    закоммитить раньше, перед сетевыми вызовами, — тогда финальный commit пустой.
+    Считает транзакции и SQL-запросы на апдейт (больше DB_UPDATE_STATEMENTS_WARN — предупреждение в лог).
+    """
+
+    def __init__(self):
+        self.updates = 0
+        self.sessions = 0
+        self.statements = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        """Process the event."""
+        stats = start_update_stats()
+        try:
+            async with async_session_maker() as session:
+                data["session"] = session
+                try:
+                    result = await handler(event, data)
+                    if session.in_transaction():
+                        await session.commit()
+                    return result
+                except Exception:
+                    await session.rollback()
+                    raise
+        finally:
+            self.updates += 1
+            self.sessions += stats.sessions
+            self.statements += stats.statements
+            query_stats.record_update(stats.statements)
+            update_id = event.update_id if isinstance(event, Update) else "-"
+            if settings.DB_UPDATE_STATEMENTS_WARN and stats.statements > settings.DB_UPDATE_STATEMENTS_WARN:
+                logger.warning(
+                    "Update %s (%s): %d SQL statements in %.1f ms",
+                    update_id,
+                    event.event_type if isinstance(event, Update) else type(event).__name__,
+                    stats.statements,
+                    stats.db_time * 1000,
+                )
+            logger.debug(
+                "Update %s: sessions=%d statements=%d db_time=%.1fms",
+                update_id,
+                stats.sessions,
+                stats.statements,
+                stats.db_time * 1000,
+            )
@@ -0,0 +1,40 @@
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Awaitable
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import TelegramObject, Update
+
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicationMiddleware(BaseMiddleware):
+    """
+    Пропускает апдейты с уже виденным update_id (повторная доставка вебхука после таймаута,
+    перезапуск ingress). Помнит последние ``maxsize`` идентификаторов. В режиме нескольких
+    воркеров апдейт всегда попадает в один и тот же воркер, поэтому памяти процесса достаточно.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self.duplicates = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        """Process the event."""
+        if isinstance(event, Update):
+            if event.update_id in self._seen:
+                self.duplicates += 1
+                logger.info(f"Duplicate update {event.update_id} skipped")
+                return UNHANDLED
+            self._seen[event.update_id] = None
+            if len(self._seen) > self.maxsize:
+                self._seen.popitem(last=False)
+        return await handler(event, data)
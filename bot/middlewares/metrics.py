@@ -0,0 +1,70 @@
+import time
+from typing import Callable, Dict, Any, Awaitable
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+
+from bot.metrics import (
+    handler_duration,
+    handler_errors,
+    telegram_rate_limited,
+    telegram_request_duration,
+    telegram_request_errors,
+)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Внутренний middleware (после фильтров): время и исключения каждого хендлера
+    с метками router и handler (имя функции).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        """Process the event."""
+        handler_object = data.get("handler")
+        router = data.get("event_router")
+        labels = (
+            getattr(router, "name", None) or "-",
+            getattr(getattr(handler_object, "callback", None), "__name__", "-"),
+        )
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            handler_errors.inc(*labels, type(e).__name__)
+            raise
+        finally:
+            handler_duration.observe(time.perf_counter() - start, *labels)
+
+
+class TelegramApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии Bot: время каждого метода Bot API, ошибки и ответы 429."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            telegram_rate_limited.inc(name)
+            telegram_request_errors.inc(name, "TelegramRetryAfter")
+            raise
+        except Exception as e:
+            telegram_request_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            telegram_request_duration.observe(time.perf_counter() - start, name)
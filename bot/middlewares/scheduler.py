@@ -0,0 +1,99 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, Dict, Any, Awaitable, Deque, Hashable, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.types import TelegramObject, Update
+
+
+logger = logging.getLogger(__name__)
+
+_Job = Tuple[Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]], TelegramObject, Dict[str, Any]]
+
+
+class UpdateSchedulerMiddleware(BaseMiddleware):
+    """
+    Самый внешний middleware апдейтов: ставит апдейт в очередь пользователя и сразу возвращает
+    управление (polling запускается с handle_as_tasks=False, вебхук отвечает после постановки).
+
+    - одновременно обрабатывается не больше ``concurrency`` апдейтов (SQLite, get_chat_member);
+    - апдейты одного пользователя (чата) — строго по очереди, в порядке поступления; очередь
+      стоит до FSM-middleware, поэтому каждый апдейт видит состояние после предыдущего;
+    - если ждущих апдейтов ``max_pending``, приём следующего ждёт освобождения места —
+      polling не запрашивает новые апдейты, вебхук отвечает Telegram позже.
+    """
+
+    def __init__(self, concurrency: int = 16, max_pending: int = 1000):
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._queues: Dict[Hashable, Deque[_Job]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._space = asyncio.Event()
+        self.pending = 0
+        self.peak_pending = 0
+        self.throttled = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        """Process the event."""
+        if self.pending >= self.max_pending:
+            self.throttled += 1
+            while self.pending >= self.max_pending:
+                self._space.clear()
+                await self._space.wait()
+
+        key = self._queue_key(event)
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append((handler, event, data))
+            return None
+        self._queues[key] = deque([(handler, event, data)])
+        task = asyncio.create_task(self._run_queue(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return None
+
+    @staticmethod
+    def _queue_key(event: TelegramObject) -> Hashable:
+        if isinstance(event, Update):
+            context = UserContextMiddleware.resolve_event_context(event)
+            if context.user_id is not None:
+                return "user", context.user_id
+            if context.chat is not None:
+                return "chat", context.chat.id
+            return "update", event.update_id
+        return "event", id(event)
+
+    async def _run_queue(self, key: Hashable) -> None:
+        queue = self._queues[key]
+        while queue:
+            # Апдейт остаётся в очереди до конца обработки: новые апдейты пользователя встают за ним
+            handler, event, data = queue[0]
+            try:
+                async with self._semaphore:
+                    await handler(event, data)
+            except Exception:
+                logger.exception(f"Update {getattr(event, 'update_id', '?')} failed")
+            finally:
+                queue.popleft()
+                self.pending -= 1
+                self._space.set()
+        del self._queues[key]
+
+    async def drain(self, timeout: float = 30.0) -> None:
+        """Дождаться обработки уже принятых апдейтов (при остановке бота)."""
+        if not self._tasks:
+            return
+        logger.info(f"Waiting for {self.pending} queued updates...")
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            logger.warning(f"{self.pending} updates still queued after shutdown timeout")
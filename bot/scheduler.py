@@ -1,22 +1,54 @@
-"""Scheduler stub (raffle reminders removed; kept for compatibility)."""
+"""Scheduler: periodic background jobs (referral links pre-generation)."""
 import logging
+from datetime import datetime
 
 from aiogram import Bot
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from bot.config import settings
+from bot.services.referral_links import is_running, pregenerate_referral_links
 
 logger = logging.getLogger(__name__)
 
 _bot: Bot | None = None
+_scheduler: AsyncIOScheduler | None = None
+
+
+async def _pregenerate_referral_links_job():
+    """Создать недостающие UTM-токены и ссылки (пропуск, если уже идёт запуск из админки)."""
+    if is_running():
+        return
+    try:
+        await pregenerate_referral_links()
+    except Exception:
+        logger.exception("Referral links pre-generation failed")
 
 
 async def start_scheduler(bot: Bot):
-    """No-op: scheduler not used after removing raffles."""
-    global _bot
+    """Start background jobs."""
+    global _bot, _scheduler
     _bot = bot
-    logger.info("Scheduler started (no jobs)")
+    _scheduler = AsyncIOScheduler()
+    interval = settings.REFERRAL_LINKS_PREGENERATE_INTERVAL_MINUTES
+    if interval > 0:
+        _scheduler.add_job(
+            _pregenerate_referral_links_job,
+            "interval",
+            minutes=interval,
+            next_run_time=datetime.now(),
+            id="pregenerate_referral_links",
+            max_instances=1,
+            coalesce=True,
+        )
+    _scheduler.start()
+    logger.info("Scheduler started (%d jobs)", len(_scheduler.get_jobs()))
 
 
 def shutdown_scheduler():
-    """No-op."""
-    global _bot
+    """Stop background jobs."""
+    global _bot, _scheduler
+    if _scheduler is not None:
+        _scheduler.shutdown(wait=False)
+        _scheduler = None
     _bot = None
     logger.info("Scheduler stopped")
@@ -1,9 +1,11 @@
 from .subscription import check_subscription
 from .broadcast import BroadcastService
 from .grade import GradeService
+from .referral_links import pregenerate_referral_links
 
 __all__ = [
     "check_subscription",
     "BroadcastService",
     "GradeService",
+    "pregenerate_referral_links",
 ]
@@ -4,6 +4,7 @@ from aiogram import Bot
 from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 
 from bot.database import get_session, get_all_users, create_broadcast
+from bot.metrics import broadcast_pending, track_queue
 
 
 class BroadcastService:
@@ -35,7 +36,7 @@ class BroadcastService:
         successful = 0
         failed = 0
         
-        for user in users:
+        for user in track_queue(broadcast_pending, users):
             try:
                 if photo_file_id:
                     await self.bot.send_photo(
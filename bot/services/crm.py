@@ -0,0 +1,230 @@
+"""
+Обмен данными с CRM: импорт подтверждённых рефералов из CSV и выгрузка пользователей в CSV.
+
+Хендлеры админки только скачивают файл и отправляют результат; сама обработка здесь,
+чтобы её можно было вызвать без Telegram (scripts/bench_micro.py).
+"""
+import csv
+import io
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from aiogram import Bot
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.database import (
+    decrypt_email,
+    decrypt_phone,
+    decrypt_username,
+    get_all_users_with_referral_counts,
+    get_all_utm_tokens_for_key_export,
+    get_referrer_by_utm_tokens,
+    get_user_by_telegram_id,
+    get_referral_counts,
+)
+from bot.database.crud import get_user_by_email, get_user_by_email_and_phone, link_referral_by_email
+from bot.database.writer import run_write
+from bot.metrics import csv_import_pending, track_queue
+from bot.services.grade import GradeService
+
+# Поддержка разных названий колонок из CRM (алиасы → наша колонка)
+CRM_COLUMN_ALIASES = {
+    "email": ["email", "e-mail", "e_mail", "email_registrant", "mail"],
+    "utm_campaign": ["utm_campaign", "referrer_email", "email_referrer", "referrer mail"],
+    "utm_content": ["utm_content", "referrer_phone", "phone_referrer", "referrer phone"],
+}
+
+# Сколько строк импорта связывать одним заданием записи (одна транзакция, один commit)
+IMPORT_CHUNK_ROWS = 200
+
+USERS_EXPORT_HEADER = [
+    "telegram_id",
+    "username",
+    "first_name",
+    "email",
+    "phone",
+    "referrer_id",
+    "referral_count",
+    "created_at",
+    "is_subscribed",
+    "is_verified",
+    "is_active",
+]
+
+
+@dataclass
+class CsvImportResult:
+    linked: int = 0
+    skipped: int = 0  # пустой email или реферер
+    not_found: int = 0  # школьника нет в боте (или он не в канале)
+    errors: List[str] = field(default_factory=list)
+
+
+def _norm_col(s: str) -> str:
+    """Нормализация названия колонки для сравнения."""
+    return (s or "").strip().lower().replace(" ", "_").replace("-", "_")
+
+
+def _normalize_csv_row(fieldnames: list, row: dict) -> dict:
+    """Приводит строку CSV к полям (email, utm_campaign, utm_content) по алиасам колонок."""
+    def find_value(aliases):
+        for f in fieldnames:
+            if not f:
+                continue
+            fn = _norm_col(f)
+            for a in aliases:
+                if fn == _norm_col(a):
+                    return (row.get(f) or "").strip()
+        return ""
+    return {
+        "email": find_value(CRM_COLUMN_ALIASES["email"]),
+        "utm_campaign": find_value(CRM_COLUMN_ALIASES["utm_campaign"]),
+        "utm_content": find_value(CRM_COLUMN_ALIASES["utm_content"]),
+    }
+
+
+def parse_csv(content: bytes) -> Tuple[List[str], List[dict]]:
+    """(имена колонок, строки) из CSV в UTF-8 (с BOM или без)."""
+    reader = csv.DictReader(io.StringIO(content.decode("utf-8-sig")))
+    fieldnames = [f.strip() for f in (reader.fieldnames or [])]
+    return fieldnames, list(reader)
+
+
+def has_required_columns(fieldnames: List[str], rows: List[dict]) -> bool:
+    """Есть ли колонки email школьника и utm_campaign/referrer_email (по первой строке)."""
+    norm0 = _normalize_csv_row(fieldnames, rows[0])
+    return bool(norm0["email"] and norm0["utm_campaign"])
+
+
+async def _find_referrer(session: AsyncSession, utm_campaign: str, utm_content: str):
+    # utm_campaign и utm_content могут быть короткими токенами (из Битрикса) или открытые email/phone
+    referrer = await get_referrer_by_utm_tokens(session, utm_campaign.strip(), (utm_content or "").strip())
+    if not referrer and utm_content:
+        referrer = await get_user_by_email_and_phone(session, utm_campaign, utm_content)
+    if not referrer and utm_campaign.isdigit():
+        referrer = await get_user_by_telegram_id(session, int(utm_campaign))
+    if not referrer:
+        referrer = await get_user_by_email(session, utm_campaign)
+    return referrer
+
+
+async def _notify_referrer(bot: Bot, grade_service: GradeService, referrer_id: int, old_count: int, new_count: int) -> None:
+    # Если реферер перешёл рубеж грейда — сообщение о грейде, иначе о подтверждённых рефералах
+    newly_achieved = await grade_service.get_grades_achieved_between(old_count, new_count)
+    try:
+        if newly_achieved:
+            for grade in newly_achieved:
+                await grade_service.notify_grade_achieved(bot, referrer_id, grade)
+        elif new_count - old_count == 1:
+            await bot.send_message(
+                referrer_id,
+                "🎊 Твой реферал подтверждён!\n\n"
+                "Школьник прошёл очный этап."
+            )
+        else:
+            await bot.send_message(
+                referrer_id,
+                f"🎊 Подтверждено твоих рефералов: {new_count - old_count}!\n\n"
+                "Школьники прошли очный этап."
+            )
+    except Exception:
+        pass
+
+
+async def import_referrals(
+    session: AsyncSession,
+    fieldnames: List[str],
+    rows: List[dict],
+    bot: Optional[Bot] = None,
+) -> CsvImportResult:
+    """
+    Связать школьников из выгрузки CRM с реферерами. Строки идут пачками по IMPORT_CHUNK_ROWS:
+    реферер ищется чтением, связки пачки — одним заданием записи (run_write) и одним commit,
+    уведомления рефереров — уже после commit (не держать блокировку записи SQLite): по одному
+    на реферера за пачку, с грейдами, рубеж которых пройден за пачку.
+    bot — для уведомлений рефереров; None — без уведомлений.
+    """
+    result = CsvImportResult()
+    grade_service = GradeService(session)
+    pending: List[Tuple[str, int]] = []  # (email школьника, telegram_id реферера)
+
+    async def link_pending() -> None:
+        if not pending:
+            return
+        chunk = list(pending)
+        pending.clear()
+
+        async def link_chunk(db: AsyncSession) -> List[bool]:
+            return [bool(await link_referral_by_email(db, email, referrer_id)) for email, referrer_id in chunk]
+
+        referrer_ids = list(dict.fromkeys(referrer_id for _, referrer_id in chunk))
+        old_counts = await get_referral_counts(session, referrer_ids) if bot is not None else {}
+        linked = await run_write(session, link_chunk)
+        await session.commit()
+        for ok in linked:
+            if ok:
+                result.linked += 1
+            else:
+                result.not_found += 1
+        if bot is not None:
+            new_counts = await get_referral_counts(session, referrer_ids)
+            for referrer_id in referrer_ids:
+                if new_counts[referrer_id] > old_counts[referrer_id]:
+                    await _notify_referrer(bot, grade_service, referrer_id,
+                                           old_counts[referrer_id], new_counts[referrer_id])
+
+    for row in track_queue(csv_import_pending, rows):
+        norm = _normalize_csv_row(fieldnames, row)
+        email = norm["email"].lower()
+        utm_campaign = norm["utm_campaign"]
+        utm_content = norm["utm_content"]
+
+        if not email or not utm_campaign:
+            result.skipped += 1
+            continue
+
+        referrer = await _find_referrer(session, utm_campaign, utm_content)
+        if not referrer:
+            result.errors.append(f"Реферер не найден: {utm_campaign}, {utm_content}")
+            continue
+
+        pending.append((email, referrer.telegram_id))
+        if len(pending) >= IMPORT_CHUNK_ROWS:
+            await link_pending()
+
+    await link_pending()
+    await session.commit()
+    return result
+
+
+async def export_users_csv(session: AsyncSession) -> Tuple[bytes, int]:
+    """CSV всех пользователей (email и phone расшифрованы для админа) и число записей."""
+    users = await get_all_users_with_referral_counts(session)
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(USERS_EXPORT_HEADER)
+    for user, ref_count in users:
+        writer.writerow([
+            user.telegram_id,
+            decrypt_username(user.username) or "",
+            user.first_name or "",
+            decrypt_email(user.email) or "",
+            decrypt_phone(user.phone) or "",
+            user.referrer_id or "",
+            ref_count,
+            user.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "Да" if user.is_subscribed else "Нет",
+            "Да" if user.is_verified else "Нет",
+            "Да" if user.is_active else "Нет"
+        ])
+    return output.getvalue().encode("utf-8-sig"), len(users)
+
+
+async def export_utm_key_csv(session: AsyncSession) -> bytes:
+    """Ключ для Битрикса: токен → расшифрованное значение (для VLOOKUP в Excel)."""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["token", "type", "decrypted_value"])
+    for token, value_type, decrypted in await get_all_utm_tokens_for_key_export(session):
+        writer.writerow([token, value_type, decrypted])
+    return output.getvalue().encode("utf-8-sig")
@@ -5,7 +5,6 @@ from typing import List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.database import (
-    get_session,
     get_all_grades,
     get_user_referral_count,
 )
@@ -24,35 +23,42 @@ def parse_rewards(grade: Grade) -> List[str]:
 
 
 class GradeService:
-    """Service for grade thresholds and notifications."""
+    """
+    Service for grade thresholds and notifications.
+
+    Работает в рамках одной сессии (unit of work) вызывающего хендлера:
+    все запросы идут в одной транзакции, список грейдов читается один раз.
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self._grades: Optional[List[Grade]] = None
+
+    async def get_grades(self) -> List[Grade]:
+        """All grades (sort_order, threshold); loaded once per service instance."""
+        if self._grades is None:
+            self._grades = await get_all_grades(self.session)
+        return self._grades
 
     async def get_next_grade(self, referral_count: int) -> Optional[Grade]:
         """Get the next grade the user has not yet achieved."""
-        async with get_session() as session:
-            grades = await get_all_grades(session)
-        for g in grades:
+        for g in await self.get_grades():
             if g.referral_threshold > referral_count:
                 return g
         return None
 
     async def get_achieved_grades(self, referral_count: int) -> List[Grade]:
         """Get all grades achieved at this referral count."""
-        async with get_session() as session:
-            grades = await get_all_grades(session)
-        return [g for g in grades if g.referral_threshold <= referral_count]
+        return [g for g in await self.get_grades() if g.referral_threshold <= referral_count]
 
     async def get_grades_newly_achieved(self, referrer_id: int) -> List[Grade]:
         """Get grades whose threshold equals current referral count (just achieved)."""
-        async with get_session() as session:
-            return await self.get_grades_newly_achieved_with_session(session, referrer_id)
+        new_count = await get_user_referral_count(self.session, referrer_id)
+        return [g for g in await self.get_grades() if g.referral_threshold == new_count]
 
-    async def get_grades_newly_achieved_with_session(
-        self, session: AsyncSession, referrer_id: int
-    ) -> List[Grade]:
-        """Same as get_grades_newly_achieved but uses provided session (e.g. inside CSV import)."""
-        new_count = await get_user_referral_count(session, referrer_id)
-        grades = await get_all_grades(session)
-        return [g for g in grades if g.referral_threshold == new_count]
+    async def get_grades_achieved_between(self, old_count: int, new_count: int) -> List[Grade]:
+        """Грейды, рубеж которых пройден при росте числа рефералов с old_count до new_count."""
+        return [g for g in await self.get_grades() if old_count < g.referral_threshold <= new_count]
 
     async def notify_grade_achieved(self, bot, user_id: int, grade: Grade) -> None:
         """Send congratulations to user for achieving a grade."""
@@ -0,0 +1,92 @@
+"""
+Профилирование работающего бота по команде админа (/profile), без перезапуска.
+
+На заданное время включается cProfile: весь event loop процесса работает в одном потоке,
+поэтому в профиль попадают все апдейты, фоновые задачи и планировщик. Отчёт — текстовый
+файл: хендлеры и методы Bot API за это время (из метрик) и самые дорогие функции; рядом —
+сырой .prof для snakeviz / pstats. cProfile замедляет код в разы, поэтому время ограничено.
+При WORKERS > 1 профилируется воркер, который обработал команду.
+"""
+import asyncio
+import cProfile
+import io
+import logging
+import marshal
+import os
+import pstats
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Tuple
+
+from bot.metrics import LabelValues, handler_duration, telegram_request_duration
+
+logger = logging.getLogger(__name__)
+
+MAX_SECONDS = 300
+TOP_FUNCTIONS = 40
+
+_lock = asyncio.Lock()
+
+
+@dataclass
+class ProfileReport:
+    text: str
+    raw: bytes  # pstats в формате marshal (файл .prof)
+
+
+def _diff(before: Dict[LabelValues, Tuple[int, float]], after: Dict[LabelValues, Tuple[int, float]]):
+    """[(метки, вызовов, суммарное время)] за интервал, по убыванию времени."""
+    rows = []
+    for labels, (count, total) in after.items():
+        prev_count, prev_total = before.get(labels, (0, 0.0))
+        if count > prev_count:
+            rows.append((labels, count - prev_count, total - prev_total))
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+
+def _table(title: str, rows) -> str:
+    lines = [title, f"{'':48} {'calls':>8} {'total, s':>10} {'avg, ms':>10}"]
+    for labels, calls, total in rows:
+        lines.append(f"{'/'.join(labels)[:48]:48} {calls:>8} {total:>10.3f} {total / calls * 1000:>10.2f}")
+    if not rows:
+        lines.append("(нет вызовов)")
+    return "\n".join(lines)
+
+
+def _top_functions(stats: pstats.Stats, sort: str) -> str:
+    out = io.StringIO()
+    stats.stream = out
+    stats.sort_stats(sort).print_stats(TOP_FUNCTIONS)
+    return out.getvalue()
+
+
+async def profile(seconds: float) -> ProfileReport:
+    """Снять профиль процесса за seconds секунд (одновременно — только один)."""
+    seconds = max(1.0, min(float(seconds), MAX_SECONDS))
+    async with _lock:
+        handlers_before = handler_duration.snapshot()
+        api_before = telegram_request_duration.snapshot()
+        started = datetime.utcnow()
+        profiler = cProfile.Profile()
+        logger.info(f"Profiling for {seconds:.0f} s")
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        logger.info("Profiling finished")
+
+    stats = pstats.Stats(profiler)
+    text = "\n\n".join([
+        f"Профиль: {seconds:.0f} с с {started:%Y-%m-%d %H:%M:%S} UTC, pid {os.getpid()}",
+        _table("Хендлеры (router/handler):", _diff(handlers_before, handler_duration.snapshot())),
+        _table("Bot API:", _diff(api_before, telegram_request_duration.snapshot())),
+        f"Функции по cumulative (топ {TOP_FUNCTIONS}):\n" + _top_functions(stats, "cumulative"),
+        f"Функции по tottime (топ {TOP_FUNCTIONS}):\n" + _top_functions(stats, "tottime"),
+    ])
+    return ProfileReport(text=text, raw=marshal.dumps(stats.stats))
+
+
+def is_running() -> bool:
+    """Идёт ли сейчас профилирование."""
+    return _lock.locked()
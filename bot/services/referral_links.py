@@ -0,0 +1,47 @@
+"""Предварительная генерация UTM-токенов и реферальных ссылок для всех зарегистрированных пользователей."""
+import asyncio
+import logging
+
+from bot.config import settings
+from bot.database import get_session, prepare_referral_links_batch
+
+logger = logging.getLogger(__name__)
+
+_lock = asyncio.Lock()
+
+
+async def pregenerate_referral_links(batch_size: int | None = None) -> tuple[int, int]:
+    """
+    Создать недостающие токены и ссылки пачками (каждая пачка — отдельная транзакция),
+    чтобы первое нажатие «Моя ссылка» после запуска кампании было только чтением.
+    Повторный запуск безопасен: уже выданные токены и ссылки не меняются.
+
+    Returns:
+        Tuple of (tokens_created, links_written)
+    """
+    batch_size = batch_size or settings.REFERRAL_LINKS_BATCH_SIZE
+    async with _lock:
+        after_id = 0
+        tokens_created = 0
+        links_written = 0
+        while True:
+            async with get_session() as session:
+                last_id, created, written = await prepare_referral_links_batch(
+                    session, after_id, batch_size
+                )
+            if last_id is None:
+                break
+            after_id = last_id
+            tokens_created += created
+            links_written += written
+            # Отдать управление обработке апдейтов между пачками
+            await asyncio.sleep(0)
+    logger.info(
+        "Referral links pregenerated: %d tokens created, %d links", tokens_created, links_written
+    )
+    return tokens_created, links_written
+
+
+def is_running() -> bool:
+    """Идёт ли сейчас генерация (запущена админом или планировщиком)."""
+    return _lock.locked()
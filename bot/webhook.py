@@ -0,0 +1,90 @@
+"""Webhook-режим: aiohttp-сервер принимает апдейты от Telegram (вместо long polling)."""
+import asyncio
+import logging
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from sqlalchemy import text
+
+from bot.config import settings
+from bot.database.session import engine
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик вебхука: отвечает Telegram, когда апдейт поставлен в очередь UpdateSchedulerMiddleware
+    (при переполненных очередях — позже, это и есть backpressure для Telegram).
+    """
+
+    async def close(self) -> None:
+        # Сессию бота закрывает main после остановки диспетчера (она нужна shutdown-хендлерам)
+        pass
+
+
+async def healthz(request: web.Request) -> web.Response:
+    """Проверка живости для балансировщика: процесс отвечает и БД доступна."""
+    try:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    except Exception as e:
+        logger.warning(f"Health check failed: {e}")
+        return web.json_response({"status": "error", "database": "unavailable"}, status=503)
+    return web.json_response({"status": "ok"})
+
+
+async def _set_webhook(bot: Bot, dispatcher: Dispatcher):
+    """Зарегистрировать вебхук в Telegram (после остальных startup-хендлеров)."""
+    url = settings.webhook_url
+    await bot.set_webhook(
+        url,
+        secret_token=settings.WEBHOOK_SECRET,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+    )
+    logger.info(f"Webhook set: {url}")
+
+
+def create_webhook_app(bot: Bot, dp: Dispatcher) -> web.Application:
+    """aiohttp-приложение: POST WEBHOOK_PATH (проверка X-Telegram-Bot-Api-Secret-Token) и GET /healthz."""
+    if not settings.WEBHOOK_SECRET:
+        raise ValueError("BOT_MODE=webhook requires WEBHOOK_SECRET")
+    if settings.WEBHOOK_SET_ON_STARTUP:
+        dp.startup.register(_set_webhook)
+
+    app = web.Application()
+    app.router.add_get("/healthz", healthz)
+    # При остановке dp.shutdown дожидается очередей апдейтов, затем сбрасывает FSM и т.д.
+    WebhookRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=False,
+        secret_token=settings.WEBHOOK_SECRET,
+    ).register(app, path=settings.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Запустить aiohttp-сервер и работать до SIGINT/SIGTERM."""
+    app = create_webhook_app(bot, dp)
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    site = web.TCPSite(runner, host=settings.WEBAPP_HOST, port=settings.WEBAPP_PORT)
+    await site.start()
+    logger.info(f"Webhook server listening on {settings.WEBAPP_HOST}:{settings.WEBAPP_PORT}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows: остановка по Ctrl+C (KeyboardInterrupt)
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Stopping webhook server...")
+        await runner.cleanup()
@@ -0,0 +1,204 @@
+"""
+Несколько процессов-воркеров за одним webhook-ingress (WORKERS > 1).
+
+Главный процесс принимает вебхук (проверка секрета, /healthz) и раскладывает апдейты по
+очередям воркеров: номер воркера = id пользователя % WORKERS, поэтому апдейты одного
+пользователя всегда обрабатывает один процесс (порядок, кэш FSM и ссылок — локальные).
+Воркер — обычный Dispatcher со своим Bot. Когда один воркер меняет общие данные
+(настройки, контакты), он сообщает имя кэша ingress, а тот пересылает его остальным.
+Планировщик и уведомления админам — только в воркере 0.
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot
+from aiohttp import web
+
+from bot.config import settings
+from bot.database import init_db
+from bot.database.cache import invalidation_bus
+from bot.database.session import engine
+from bot.webhook import healthz
+
+logger = logging.getLogger(__name__)
+
+# Сообщения в очереди воркера: ("update", raw_update) | ("invalidate", cache_name) | None — остановка
+_STOP = None
+
+
+def route_update(raw: Dict[str, Any], workers: int) -> int:
+    """Номер воркера для апдейта: по id пользователя (или чата), иначе по update_id."""
+    for key, value in raw.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        for field in ("from", "user", "chat"):
+            owner = value.get(field)
+            if isinstance(owner, dict) and "id" in owner:
+                return owner["id"] % workers
+    return raw.get("update_id", 0) % workers
+
+
+def worker_main(index: int, updates: multiprocessing.Queue, control: multiprocessing.Queue) -> None:
+    """Точка входа процесса-воркера."""
+    # Ctrl+C приходит всей группе процессов — воркер останавливает ingress через очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s - worker{index} - %(name)s - %(levelname)s - %(message)s",
+    )
+    asyncio.run(_run_worker(index, updates, control))
+
+
+async def _run_worker(index: int, updates: multiprocessing.Queue, control: multiprocessing.Queue) -> None:
+    from bot.main import create_bot, create_dispatcher  # bot.main импортирует этот модуль
+
+    invalidation_bus.set_transport(lambda name: control.put(("invalidate", name, index)))
+    bot = create_bot()
+    dp = create_dispatcher()
+    loop = asyncio.get_running_loop()
+
+    async def feed(raw: Dict[str, Any]) -> None:
+        try:
+            await dp.feed_raw_update(bot, raw)
+        except Exception:
+            pass  # aiogram уже записал исключение в лог
+
+    try:
+        await dp.emit_startup(bot=bot, dispatcher=dp, worker_index=index, **dp.workflow_data)
+        logger.info(f"Worker {index} started")
+        while True:
+            message = await loop.run_in_executor(None, updates.get)
+            if message is _STOP:
+                break
+            kind, payload = message
+            if kind == "invalidate":
+                invalidation_bus.deliver(payload)
+                continue
+            # Возвращается, как только апдейт встал в очередь UpdateSchedulerMiddleware;
+            # при переполнении ждёт — очередь процесса заполняется, ingress отвечает 503
+            await feed(payload)
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, worker_index=index, **dp.workflow_data)
+    finally:
+        await bot.session.close()
+        await engine.dispose()
+        logger.info(f"Worker {index} stopped")
+
+
+class WorkerPool:
+    """Процессы-воркеры, их очереди и пересылка инвалидаций кэшей между ними."""
+
+    def __init__(self, workers: int, queue_size: int):
+        ctx = multiprocessing.get_context("spawn")
+        self.control = ctx.Queue()
+        self.queues: List[multiprocessing.Queue] = [ctx.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.processes = [
+            ctx.Process(target=worker_main, args=(i, q, self.control), name=f"bot-worker-{i}", daemon=False)
+            for i, q in enumerate(self.queues)
+        ]
+        self._relay_task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        for process in self.processes:
+            process.start()
+        self._relay_task = asyncio.create_task(self._relay_invalidations())
+
+    def alive(self) -> bool:
+        return all(p.is_alive() for p in self.processes)
+
+    def submit(self, raw: Dict[str, Any]) -> bool:
+        """Положить апдейт в очередь воркера; False — очередь переполнена."""
+        try:
+            self.queues[route_update(raw, len(self.queues))].put_nowait(("update", raw))
+        except queue.Full:
+            return False
+        return True
+
+    async def _relay_invalidations(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await loop.run_in_executor(None, self.control.get)
+            if message is _STOP:
+                return
+            _, name, origin = message
+            for i, q in enumerate(self.queues):
+                if i != origin:
+                    await loop.run_in_executor(None, q.put, ("invalidate", name))
+
+    async def stop(self) -> None:
+        """Остановить воркеры: каждый доделывает принятые апдейты и выполняет shutdown."""
+        loop = asyncio.get_running_loop()
+        for q in self.queues:
+            await loop.run_in_executor(None, q.put, _STOP)
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, settings.SHUTDOWN_TIMEOUT + 10)
+            if process.is_alive():
+                logger.warning(f"{process.name} did not stop in time, terminating")
+                process.terminate()
+        self.control.put(_STOP)
+        if self._relay_task is not None:
+            await self._relay_task
+
+
+def create_ingress_app(pool: WorkerPool) -> web.Application:
+    """aiohttp-приложение ingress: POST WEBHOOK_PATH → очередь воркера, GET /healthz."""
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != settings.WEBHOOK_SECRET:
+            return web.Response(status=401)
+        raw = await request.json()
+        if not pool.submit(raw):
+            # Telegram повторит доставку позже
+            logger.warning(f"Worker queue full, update {raw.get('update_id')} deferred")
+            return web.Response(status=503)
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        if not pool.alive():
+            return web.json_response({"status": "error", "workers": "down"}, status=503)
+        return await healthz(request)
+
+    app = web.Application()
+    app.router.add_post(settings.WEBHOOK_PATH, handle_update)
+    app.router.add_get("/healthz", health)
+    return app
+
+
+async def run_ingress(bot: Bot, allowed_updates: List[str]) -> None:
+    """Запустить воркеры и webhook-ingress; работать до SIGINT/SIGTERM."""
+    if not settings.WEBHOOK_SECRET:
+        raise ValueError("WORKERS > 1 requires BOT_MODE=webhook and WEBHOOK_SECRET")
+    # Схему создаём до старта воркеров, чтобы они не делали это одновременно
+    await init_db()
+    pool = WorkerPool(settings.WORKERS, settings.WORKER_QUEUE_SIZE)
+    pool.start()
+    logger.info(f"Started {settings.WORKERS} workers")
+
+    runner = web.AppRunner(create_ingress_app(pool), handle_signals=False)
+    await runner.setup()
+    site = web.TCPSite(runner, host=settings.WEBAPP_HOST, port=settings.WEBAPP_PORT)
+    await site.start()
+    if settings.WEBHOOK_SET_ON_STARTUP:
+        await bot.set_webhook(
+            settings.webhook_url,
+            secret_token=settings.WEBHOOK_SECRET,
+            allowed_updates=allowed_updates,
+        )
+    logger.info(f"Ingress listening on {settings.WEBAPP_HOST}:{settings.WEBAPP_PORT}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows: остановка по Ctrl+C (KeyboardInterrupt)
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Stopping ingress...")
+        await runner.cleanup()
+        await pool.stop()
@@ -0,0 +1,121 @@
+"""
+Синтетические данные для бенчмарков (scripts/bench_e2e.py, scripts/bench_micro.py).
+
+Импортировать после того, как скрипт задал DATABASE_URL и остальное окружение бота.
+Пользователи получают telegram_id FIRST_USER_ID + номер, email и телефон выводятся из номера,
+поэтому базу можно наращивать порциями (seed_users(0, 1000), затем seed_users(1000, 10000)).
+"""
+import csv
+import io
+import json
+import random
+from datetime import datetime, timedelta
+from typing import Tuple
+
+from sqlalchemy import func, insert, select
+
+from bot.database import crud
+from bot.database.models import Grade, GradeClaim, Referral, ReferralLink, User
+from bot.database.session import async_session_maker
+
+FIRST_USER_ID = 1_000_000
+GRADE_THRESHOLDS = (1, 3, 5, 10, 25)
+SEED_BATCH = 1000
+
+
+def user_email(telegram_id: int) -> str:
+    return f"user{telegram_id}@example.com"
+
+
+def user_phone(telegram_id: int) -> str:
+    return f"+7900{telegram_id:07d}"
+
+
+async def seed_users(start: int, stop: int, rng: random.Random, referral_share: float = 0.6) -> int:
+    """
+    Пользователи с номерами [start, stop): ник, email и телефон (зашифрованные, как пишет бот),
+    ~70% в канале. Доля referral_share пришла по ссылке одного из ранее созданных: ранние
+    пользователи приглашают намного чаще («длинный хвост», как в реальной кампании).
+    Возвращает число созданных рефералов.
+    """
+    now = datetime.utcnow()
+    users, referrals = [], []
+    for i in range(start, stop):
+        telegram_id = FIRST_USER_ID + i
+        referrer = None
+        if i > 0 and rng.random() < referral_share:
+            referrer = FIRST_USER_ID + int(i * rng.random() ** 3)
+            referrals.append({"referrer_id": referrer, "referred_id": telegram_id,
+                              "created_at": now, "is_active": True})
+        users.append({
+            "telegram_id": telegram_id,
+            "username": f"user{telegram_id}",
+            "first_name": f"User{telegram_id}",
+            "email": crud._encrypt(user_email(telegram_id)),
+            "phone": crud._encrypt(crud.normalize_phone(user_phone(telegram_id))),
+            "referrer_id": referrer,
+            "created_at": now - timedelta(minutes=stop - i),
+            "is_subscribed": rng.random() < 0.7,
+            "is_verified": referrer is not None and rng.random() < 0.5,
+            "is_admin": False,
+            "is_active": True,
+        })
+    async with async_session_maker() as session:
+        for offset in range(0, len(users), SEED_BATCH):
+            await session.execute(insert(User), users[offset:offset + SEED_BATCH])
+        for offset in range(0, len(referrals), SEED_BATCH):
+            await session.execute(insert(Referral), referrals[offset:offset + SEED_BATCH])
+        await session.commit()
+    return len(referrals)
+
+
+async def seed_grades(rng: random.Random, claim_share: float = 0.5) -> Tuple[int, int]:
+    """Грейды GRADE_THRESHOLDS и выдачи наград части достигших; возвращает (грейдов, выдач)."""
+    now = datetime.utcnow()
+    async with async_session_maker() as session:
+        grades = [Grade(referral_threshold=t, rewards=json.dumps([f"Награда {t}"]), sort_order=n)
+                  for n, t in enumerate(GRADE_THRESHOLDS)]
+        session.add_all(grades)
+        await session.flush()
+        counts = (await session.execute(
+            select(Referral.referrer_id, func.count()).group_by(Referral.referrer_id)
+        )).all()
+        claims = [
+            {"user_id": referrer_id, "grade_id": grade.id, "claimed_at": now, "issued_by_admin": True}
+            for referrer_id, count in counts
+            for grade in grades
+            if count >= grade.referral_threshold and rng.random() < claim_share
+        ]
+        for offset in range(0, len(claims), SEED_BATCH):
+            await session.execute(insert(GradeClaim), claims[offset:offset + SEED_BATCH])
+        await session.commit()
+    return len(grades), len(claims)
+
+
+async def crm_csv(rows: int, users: int, rng: random.Random) -> bytes:
+    """
+    Выгрузка CRM на rows строк: email школьника (из первых users пользователей бота)
+    и токены реферера из referral_links (ссылки должны быть сгенерированы). Как в жизни,
+    попадаются школьники, которых нет в боте (~5%), чужие токены (~3%) и пустые строки (~2%).
+    """
+    async with async_session_maker() as session:
+        tokens = (await session.execute(
+            select(ReferralLink.token_campaign, ReferralLink.token_content)
+            .where(ReferralLink.user_id < FIRST_USER_ID + users)
+        )).all()
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["email", "utm_source", "utm_campaign", "utm_content"])
+    for n in range(rows):
+        roll = rng.random()
+        if roll < 0.02:
+            writer.writerow(["", "bot", "", ""])
+            continue
+        email = user_email(FIRST_USER_ID + rng.randrange(users))
+        campaign, content = rng.choice(tokens)
+        if roll < 0.07:
+            email = f"unknown{n}@example.com"
+        elif roll < 0.10:
+            campaign, content = "zzzzzzzz", "zzzzzzzz"
+        writer.writerow([email, "bot", campaign, content])
+    return output.getvalue().encode("utf-8-sig")
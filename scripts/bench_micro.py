@@ -0,0 +1,306 @@
+"""
+Микробенчмарки горячих функций: запросы crud, шифрование, разбор CSV, импорт из CRM и экспорт.
+
+База — файл SQLite, который наращивается до каждого размера из --sizes (по умолчанию 1k, 10k,
+100k пользователей; рефералы, грейды, токены и ссылки — как у бота). На каждом размере:
+  - запросы (мс на вызов): get_user_rank, get_top_referrers, get_users_for_grade,
+    get_referral_tokens_for_user;
+  - пакетные (секунды на N элементов): encrypt / decrypt N значений, _normalize_csv_row
+    на N строк, полный импорт CSV из CRM на N строк (разбор + import_referrals), экспорт N
+    пользователей (export_users_csv).
+
+Для каждой функции печатается кривая по размерам и показатель роста между соседними размерами:
+время ~ N^k. Для запросов k≈0 — поиск по индексу, k≈1 — проход по таблице; для пакетных k≈1 —
+линейно. k > 1.3 помечается как сверхлинейный рост (например, O(n²) в цикле).
+Импорт меняет базу (связывает рефералов) и экспорт с импортом долгие — они выполняются
+по одному разу, после остальных замеров размера. Результат — JSON (bench_results/micro_<время>.json),
+сравнение с прошлым прогоном — --compare.
+
+Запуск из корня проекта:
+  python scripts/bench_micro.py
+  python scripts/bench_micro.py --sizes 1000,5000,20000 --only get_user_rank --only csv_import
+  python scripts/bench_micro.py --compare bench_results/micro_20260101_120000.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+# Добавить корень проекта в path (и scripts/ — для bench_data)
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "scripts"))
+
+QUERY_BENCHMARKS = ("get_user_rank", "get_top_referrers", "get_users_for_grade", "get_referral_tokens_for_user")
+BATCH_BENCHMARKS = ("encrypt", "decrypt", "normalize_csv_row", "csv_import", "export_users")
+# Показатель роста, выше которого функция считается сверхлинейной
+SUPERLINEAR = 1.3
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Микробенчмарки crud, шифрования, импорта и экспорта CSV")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="размеры через запятую (по возрастанию)")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов замера (берётся медиана)")
+    parser.add_argument("--loops", type=int, default=20, help="вызовов запроса в одном замере")
+    parser.add_argument("--only", action="append", choices=QUERY_BENCHMARKS + BATCH_BENCHMARKS,
+                        help="только эти замеры (можно несколько)")
+    parser.add_argument("--db", help="файл SQLite (по умолчанию временный; должен быть пустым или отсутствовать)")
+    parser.add_argument("--output", help="файл результатов (по умолчанию bench_results/micro_<время>.json)")
+    parser.add_argument("--compare", help="прошлый JSON: показать изменения по каждому размеру")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="логи бота (медленные запросы и т.п.) в консоль")
+    return parser.parse_args()
+
+
+ARGS = parse_args()
+SIZES = sorted(int(s) for s in ARGS.sizes.split(",") if s.strip())
+
+_TMP_DIR = None
+if ARGS.db:
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{Path(ARGS.db).resolve()}"
+else:
+    _TMP_DIR = tempfile.TemporaryDirectory()
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_TMP_DIR.name}/micro.db"
+os.environ.setdefault("BOT_TOKEN", "123456:FAKE-TOKEN")
+os.environ.setdefault("CHANNEL_ID", "-1001")
+os.environ.setdefault("ENCRYPTION_KEY", "bench-encryption-key")
+os.environ["DB_SINGLE_WRITER"] = "false"
+
+from sqlalchemy import select  # noqa: E402
+
+from bot.config import settings  # noqa: E402
+from bot.crypto import decrypt, encrypt  # noqa: E402
+from bot.database import crud  # noqa: E402
+from bot.database.migrations import run_migrations  # noqa: E402
+from bot.database.models import Grade, User  # noqa: E402
+from bot.database.session import async_session_maker, engine  # noqa: E402
+from bot.services import crm as crm_service  # noqa: E402
+from bot.services.referral_links import pregenerate_referral_links  # noqa: E402
+from bench_data import FIRST_USER_ID, crm_csv, seed_grades, seed_users, user_email  # noqa: E402
+
+if not ARGS.verbose:
+    logging.getLogger().setLevel(logging.ERROR)
+
+
+def _selected(name: str) -> bool:
+    return not ARGS.only or name in ARGS.only
+
+
+def _median(values: List[float]) -> float:
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+
+# ============ Замеры ============
+
+async def measure_query(
+    call: Callable[[Any, Any], Awaitable[Any]],
+    user_ids: List[int],
+    prepare: Optional[Callable[[Any, List[int]], Awaitable[List[Any]]]] = None,
+) -> float:
+    """
+    Медиана по --repeat замерам, мс на вызов; каждый замер — --loops вызовов в своей сессии
+    (откат в конце). prepare(session, ids) — аргументы вызовов, готовятся вне замера.
+    """
+    samples = []
+    for r in range(ARGS.repeat):
+        async with async_session_maker() as session:
+            args = user_ids[r * ARGS.loops:(r + 1) * ARGS.loops]
+            if prepare is not None:
+                args = await prepare(session, args)
+            start = time.perf_counter()
+            for arg in args:
+                await call(session, arg)
+            samples.append((time.perf_counter() - start) * 1000 / len(args))
+            await session.rollback()
+    return _median(samples)
+
+
+def measure_batch(run: Callable[[], Any], repeat: int) -> float:
+    """Лучший из repeat запусков, секунды (чистый CPU: минимум меньше всего зависит от шума)."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - start)
+    return min(samples)
+
+
+async def bench_size(size: int, rng: random.Random, grade_id: int) -> Dict[str, float]:
+    """Все замеры на базе из size пользователей: {имя: значение}."""
+    results: Dict[str, float] = {}
+    user_ids = [FIRST_USER_ID + rng.randrange(size) for _ in range(ARGS.repeat * ARGS.loops)]
+
+    if _selected("get_user_rank"):
+        results["get_user_rank"] = await measure_query(crud.get_user_rank, user_ids)
+    if _selected("get_top_referrers"):
+        results["get_top_referrers"] = await measure_query(lambda s, _: crud.get_top_referrers(s), user_ids)
+    if _selected("get_users_for_grade"):
+        # Грейд с самым низким порогом — самый большой список
+        results["get_users_for_grade"] = await measure_query(
+            lambda s, _: crud.get_users_for_grade(s, grade_id), user_ids
+        )
+    if _selected("get_referral_tokens_for_user"):
+        async def load_users(session, ids):
+            users = {u.telegram_id: u for u in (await session.execute(
+                select(User).where(User.telegram_id.in_(ids))
+            )).scalars()}
+            return [users[user_id] for user_id in ids]
+        results["get_referral_tokens_for_user"] = await measure_query(
+            crud.get_referral_tokens_for_user, user_ids, prepare=load_users
+        )
+
+    key = settings.encryption_key_bytes
+    plain = [user_email(FIRST_USER_ID + i) for i in range(size)]
+    if _selected("encrypt"):
+        results["encrypt"] = measure_batch(lambda: [encrypt(value, key) for value in plain], ARGS.repeat)
+    if _selected("decrypt"):
+        encrypted = [encrypt(value, key) for value in plain]
+        results["decrypt"] = measure_batch(lambda: [decrypt(value, key) for value in encrypted], ARGS.repeat)
+
+    content = await crm_csv(size, size, rng) if _selected("normalize_csv_row") or _selected("csv_import") else b""
+    if _selected("normalize_csv_row"):
+        fieldnames, rows = crm_service.parse_csv(content)
+        results["normalize_csv_row"] = measure_batch(
+            lambda: [crm_service._normalize_csv_row(fieldnames, row) for row in rows], ARGS.repeat
+        )
+
+    if _selected("export_users"):
+        async with async_session_maker() as session:
+            start = time.perf_counter()
+            await crm_service.export_users_csv(session)
+            results["export_users"] = time.perf_counter() - start
+    if _selected("csv_import"):
+        # Последним: связывает школьников с реферерами (база меняется)
+        async with async_session_maker() as session:
+            start = time.perf_counter()
+            fieldnames, rows = crm_service.parse_csv(content)
+            imported = await crm_service.import_referrals(session, fieldnames, rows)
+            results["csv_import"] = time.perf_counter() - start
+        print(f"    импорт: связано {imported.linked}, пропущено {imported.skipped}, "
+              f"не найдено {imported.not_found}, без реферера {len(imported.errors)}")
+    return results
+
+
+# ============ Отчёт ============
+
+def _unit(name: str) -> str:
+    return "ms/call" if name in QUERY_BENCHMARKS else "s"
+
+
+def growth(points: List[Dict[str, float]]) -> List[Optional[float]]:
+    """Показатель k (время ~ N^k) между соседними размерами."""
+    exponents = []
+    for prev, cur in zip(points, points[1:]):
+        if prev["value"] > 0 and cur["value"] > 0 and cur["n"] != prev["n"]:
+            exponents.append(round(math.log(cur["value"] / prev["value"]) / math.log(cur["n"] / prev["n"]), 2))
+        else:
+            exponents.append(None)
+    return exponents
+
+
+def print_table(report: Dict[str, Any]) -> None:
+    print(f"\n{'benchmark':30} {'unit':>8} " + " ".join(f"{n:>10}" for n in SIZES) + "   growth k")
+    for name, entry in report.items():
+        values = {p["n"]: p["value"] for p in entry["points"]}
+        cells = " ".join(f"{values[n]:>10.4g}" if n in values else f"{'-':>10}" for n in SIZES)
+        exponents = ", ".join("-" if k is None else f"{k:.2f}" for k in entry["growth"])
+        flag = "  ⚠ сверхлинейно" if entry["superlinear"] else ""
+        print(f"{name:30} {entry['unit']:>8} {cells}   {exponents}{flag}")
+
+
+def print_comparison(report: Dict[str, Any], path: str) -> None:
+    previous = json.loads(Path(path).read_text(encoding="utf-8"))["benchmarks"]
+    print(f"\nСравнение с {path}:")
+    for name, entry in report.items():
+        old = {p["n"]: p["value"] for p in previous.get(name, {}).get("points", [])}
+        changes = [
+            f"{p['n']}: {(p['value'] - old[p['n']]) / old[p['n']] * 100:+.1f}%"
+            for p in entry["points"] if old.get(p["n"])
+        ]
+        if changes:
+            print(f"  {name:30} " + ", ".join(changes))
+        else:
+            print(f"  {name:30} нет общих размеров")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run() -> None:
+    rng = random.Random(ARGS.seed)
+    points: Dict[str, List[Dict[str, float]]] = {}
+    try:
+        await run_migrations(engine)
+        seeded = 0
+        grade_id = None
+        for size in SIZES:
+            start = time.perf_counter()
+            await seed_users(seeded, size, rng)
+            seeded = size
+            if grade_id is None:
+                await seed_grades(rng, claim_share=0.0)
+                async with async_session_maker() as session:
+                    grade_id = (await session.execute(
+                        select(Grade.id).order_by(Grade.referral_threshold).limit(1)
+                    )).scalar_one()
+            await pregenerate_referral_links()
+            print(f"{size} пользователей (данные за {time.perf_counter() - start:.1f} с)")
+            for name, value in (await bench_size(size, rng, grade_id)).items():
+                points.setdefault(name, []).append({"n": size, "value": round(value, 6)})
+                print(f"    {name}: {value:.4g} {_unit(name)}")
+    finally:
+        await engine.dispose()
+
+    report = {}
+    for name, entry_points in points.items():
+        exponents = growth(entry_points)
+        report[name] = {
+            "unit": _unit(name),
+            "points": entry_points,
+            "growth": exponents,
+            "superlinear": any(k is not None and k > SUPERLINEAR for k in exponents),
+        }
+    print_table(report)
+    output = Path(ARGS.output) if ARGS.output else ROOT / "bench_results" / f"micro_{datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "sizes": SIZES,
+            "repeat": ARGS.repeat,
+            "loops": ARGS.loops,
+            "seed": ARGS.seed,
+        },
+        "benchmarks": report,
+    }, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\nРезультаты: {output}")
+    if ARGS.compare:
+        print_comparison(report, ARGS.compare)
+
+
+def main():
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
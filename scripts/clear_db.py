@@ -2,8 +2,10 @@
 Очистка базы данных бота.
 
 Варианты:
-  --full     Удалить файл referral_bot.db (полный сброс). Бот создаст БД заново при запуске.
-  --data     Очистить только данные (пользователи, рефералы, UTM-токены, выдачи грейдов, рассылки).
+  --full     Полный сброс: для SQLite удалить файл referral_bot.db, для PostgreSQL — удалить все
+             таблицы бота. Бот создаст схему заново при запуске.
+  --data     Очистить только данные (пользователи, рефералы, UTM-токены и ссылки, выдачи грейдов,
+             рассылки, состояния FSM).
              Грейды, контакты и настройки bot_settings сохраняются.
 
 Запуск из корня проекта:
@@ -18,6 +20,8 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 from sqlalchemy import text
+from bot.database.models import Base
+from bot.database.migrations import LEGACY_TABLES
 from bot.database.session import engine, init_db
 from bot.config import settings
 
@@ -28,20 +32,36 @@ async def clear_data_only():
         "grade_claims",  # FK на users и grades
         "referrals",     # FK на users
         "broadcasts",
+        "referral_links",  # FK на users
         "utm_tokens",
+        "fsm_states",
         "users",
     ]
     async with engine.begin() as conn:
         for table in tables_order:
             await conn.execute(text(f"DELETE FROM {table}"))
-    print("Данные очищены (users, referrals, utm_tokens, grade_claims, broadcasts). Грейды, контакты и настройки сохранены.")
+    await engine.dispose()
+    print("Данные очищены (users, referrals, utm_tokens, referral_links, grade_claims, broadcasts, fsm_states). Грейды, контакты и настройки сохранены.")
+
+
+async def drop_all_tables():
+    """PostgreSQL: удалить все таблицы бота (включая старые таблицы розыгрышей)."""
+    async with engine.begin() as conn:
+        for table in LEGACY_TABLES:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        await conn.run_sync(Base.metadata.drop_all)
+    await engine.dispose()
+    print(f"Таблицы бота удалены из {engine.url.render_as_string(hide_password=True)}. При следующем запуске бот создаст их заново.")
 
 
 async def full_reset():
-    """Удалить файл БД. Путь берётся из DATABASE_URL (sqlite:///./referral_bot.db)."""
+    """Удалить файл БД (путь из DATABASE_URL: sqlite:///./referral_bot.db) или таблицы в PostgreSQL."""
     url = settings.DATABASE_URL
+    if engine.dialect.name == "postgresql":
+        await drop_all_tables()
+        return
     if "sqlite" not in url:
-        print("Полный сброс поддерживается только для SQLite. Укажите DATABASE_URL с sqlite.")
+        print("Полный сброс поддерживается для SQLite и PostgreSQL.")
         return
     # sqlite+aiosqlite:///./referral_bot.db -> referral_bot.db в текущей рабочей папке
     db_path = url.split("/")[-1].split("?")[0]
@@ -50,6 +70,9 @@ async def full_reset():
     path = Path(db_path)
     if path.is_file():
         path.unlink()
+        # Файлы журнала WAL (если бот остановлен некорректно)
+        for suffix in ("-wal", "-shm"):
+            Path(str(path) + suffix).unlink(missing_ok=True)
         print(f"Файл {path.absolute()} удалён. При следующем запуске бот создаст пустую БД.")
     else:
         print(f"Файл {path.absolute()} не найден.")
@@ -0,0 +1,294 @@
+"""
+Локальная замена Telegram Bot API для нагрузочных тестов (бот не ходит в настоящий Telegram).
+
+Реализованы методы, которые использует бот: getMe, getUpdates, deleteWebhook, setWebhook,
+sendMessage, sendPhoto, sendSticker, sendDocument, editMessageText, editMessageReplyMarkup,
+answerCallbackQuery, getChatMember, getFile и скачивание файлов; остальные отвечают true.
+Задержка ответа, доля ответов 429 и лимит отправок в секунду настраиваются.
+
+Апдейты для бота и файлы (например, CSV для импорта) кладутся через служебные адреса:
+  POST /_fake/updates        JSON-апдейт или список апдейтов (update_id можно не указывать)
+  POST /_fake/files?name=x   тело — содержимое файла; ответ {"file_id": ...}
+  GET  /_fake/stats          вызовы по методам, ответы 429, апдейты в очереди
+  POST /_fake/reset          обнулить счётчики и очередь
+
+Запуск из корня проекта:
+  python scripts/fake_bot_api.py --port 8081 --latency-ms 30 --jitter-ms 20 --rate-429 0.01
+и в .env бота:
+  TELEGRAM_API_URL=http://127.0.0.1:8081
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import random
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger("fake_bot_api")
+
+# Методы, на которые распространяется --max-rps (как ограничение Telegram на отправку)
+SEND_METHODS = {"sendmessage", "sendphoto", "sendsticker", "senddocument"}
+
+
+class FakeBotApi:
+    """Состояние фейкового сервера: очередь апдейтов, загруженные файлы, счётчики."""
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        rate_429: float = 0.0,
+        retry_after: int = 1,
+        max_rps: float = 0.0,
+        member_status: str = "member",
+        seed: Optional[int] = None,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.max_rps = max_rps
+        self.member_status = member_status
+        self._random = random.Random(seed)
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self.updates: Deque[Dict[str, Any]] = deque()
+        self._updates_event = asyncio.Event()
+        self.files: Dict[str, Dict[str, Any]] = {}  # file_id → {"path", "data"}
+        self.calls: Counter = Counter()
+        self.rate_limited: Counter = Counter()
+        self.sent_messages = 0
+        # Окно отправок за последнюю секунду (для --max-rps)
+        self._sends: Deque[float] = deque()
+
+    def reset(self) -> None:
+        self.updates.clear()
+        self.calls.clear()
+        self.rate_limited.clear()
+        self.sent_messages = 0
+        self._sends.clear()
+
+    # ============ Апдейты и файлы ============
+
+    def push_update(self, update: Dict[str, Any]) -> int:
+        """Поставить апдейт в очередь getUpdates; возвращает update_id."""
+        if "update_id" not in update:
+            update = {"update_id": next(self._update_ids), **update}
+        self.updates.append(update)
+        self._updates_event.set()
+        return update["update_id"]
+
+    def add_file(self, data: bytes, name: str = "file") -> str:
+        file_id = f"file{next(self._file_ids)}"
+        self.files[file_id] = {"path": f"documents/{file_id}_{name}", "data": data}
+        return file_id
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        # offset подтверждает все апдейты с меньшим id
+        while self.updates and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+        if not self.updates and timeout > 0:
+            self._updates_event.clear()
+            try:
+                await asyncio.wait_for(self._updates_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self.updates, limit))
+
+    # ============ Ответы методов ============
+
+    def _message(self, params: Dict[str, Any], **fields: Any) -> Dict[str, Any]:
+        chat_id = params.get("chat_id") or 0
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        message = {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self._me(),
+        }
+        message.update(fields)
+        return message
+
+    @staticmethod
+    def _me() -> Dict[str, Any]:
+        return {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+    def _document(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        upload = params.get("document")
+        if isinstance(upload, str) and upload.startswith("attach://"):
+            # aiogram передаёт файл отдельной частью формы, а в поле — ссылку на неё
+            upload = params.get(upload[len("attach://"):], upload)
+        if isinstance(upload, web.FileField):
+            name = upload.filename or "document"
+            file_id = self.add_file(upload.file.read(), name)
+        else:
+            file_id, name = str(upload), "document"
+        return {"file_id": file_id, "file_unique_id": file_id, "file_name": name,
+                "file_size": len(self.files.get(file_id, {}).get("data", b""))}
+
+    async def call(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getme":
+            return self._me()
+        if method == "getupdates":
+            return await self._get_updates(params)
+        if method in ("sendmessage", "editmessagetext"):
+            return self._message(params, text=params.get("text", ""))
+        if method == "editmessagereplymarkup":
+            return self._message(params, text="")
+        if method == "sendphoto":
+            return self._message(params, photo=[{"file_id": "photo", "file_unique_id": "photo", "width": 1, "height": 1}])
+        if method == "sendsticker":
+            return self._message(params, sticker={
+                "file_id": "sticker", "file_unique_id": "sticker", "type": "regular",
+                "width": 512, "height": 512, "is_animated": False, "is_video": False,
+            })
+        if method == "senddocument":
+            return self._message(params, document=self._document(params))
+        if method == "getchatmember":
+            user_id = int(params.get("user_id") or 0)
+            return {"status": self.member_status, "user": {"id": user_id, "is_bot": False, "first_name": "User"}}
+        if method == "getfile":
+            file_id = str(params.get("file_id"))
+            stored = self.files.get(file_id)
+            if stored is None:
+                raise web.HTTPBadRequest(text=json.dumps(
+                    {"ok": False, "error_code": 400, "description": "Bad Request: invalid file_id"}
+                ), content_type="application/json")
+            return {"file_id": file_id, "file_unique_id": file_id, "file_size": len(stored["data"]),
+                    "file_path": stored["path"]}
+        return True
+
+    # ============ HTTP ============
+
+    def _throttled(self, method: str) -> Optional[int]:
+        """retry_after, если запрос надо отклонить с 429."""
+        if self.rate_429 and method != "getupdates" and self._random.random() < self.rate_429:
+            return self.retry_after
+        if self.max_rps and method in SEND_METHODS:
+            now = time.monotonic()
+            while self._sends and now - self._sends[0] >= 1.0:
+                self._sends.popleft()
+            if len(self._sends) >= self.max_rps:
+                return max(1, math.ceil(1.0 - (now - self._sends[0])))
+            self._sends.append(now)
+        return None
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        self.calls[method] += 1
+        params: Dict[str, Any] = {}
+        if request.content_type == "application/json":
+            params = await request.json()
+        elif request.can_read_body:
+            params = dict(await request.post())
+        if request.query:
+            params.update(request.query)
+
+        if self.latency_ms and method != "getupdates":
+            delay = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+            await asyncio.sleep(max(0.0, delay) / 1000)
+        retry_after = self._throttled(method)
+        if retry_after is not None:
+            self.rate_limited[method] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            }, status=429)
+        result = await self.call(method, params)
+        if method in SEND_METHODS:
+            self.sent_messages += 1
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle_file(self, request: web.Request) -> web.Response:
+        path = request.match_info["path"]
+        for stored in self.files.values():
+            if stored["path"] == path:
+                return web.Response(body=stored["data"])
+        raise web.HTTPNotFound()
+
+    async def handle_push_updates(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        updates = payload if isinstance(payload, list) else [payload]
+        return web.json_response({"update_ids": [self.push_update(u) for u in updates]})
+
+    async def handle_push_file(self, request: web.Request) -> web.Response:
+        file_id = self.add_file(await request.read(), request.query.get("name", "file"))
+        return web.json_response({"file_id": file_id})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    async def handle_reset(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({"ok": True})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": dict(self.calls),
+            "rate_limited": dict(self.rate_limited),
+            "sent_messages": self.sent_messages,
+            "pending_updates": len(self.updates),
+        }
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post("/_fake/updates", self.handle_push_updates)
+        app.router.add_post("/_fake/files", self.handle_push_file)
+        app.router.add_get("/_fake/stats", self.handle_stats)
+        app.router.add_post("/_fake/reset", self.handle_reset)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.handle_file)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> web.AppRunner:
+        """Запустить сервер в текущем event loop (для бенчмарков); остановка — runner.cleanup()."""
+        runner = web.AppRunner(self.create_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host=host, port=port).start()
+        return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый Telegram Bot API для нагрузочных тестов")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="задержка каждого ответа")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="± случайный разброс задержки")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429 (0..1)")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, сек")
+    parser.add_argument("--max-rps", type=float, default=0.0, help="лимит отправок в секунду (0 — без лимита)")
+    parser.add_argument("--member-status", default="member", help="статус getChatMember (member / left / ...)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    api = FakeBotApi(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after,
+        max_rps=args.max_rps,
+        member_status=args.member_status,
+        seed=args.seed,
+    )
+    logger.info(f"Fake Bot API: http://{args.host}:{args.port} (TELEGRAM_API_URL)")
+    web.run_app(api.create_app(), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
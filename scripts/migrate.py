@@ -0,0 +1,75 @@
+"""
+Миграции схемы БД (DATABASE_URL из .env).
+
+Варианты:
+  status           Текущая версия схемы и список неприменённых миграций.
+  upgrade          Применить все неприменённые миграции.
+  upgrade --to N   Применить миграции до версии N включительно.
+
+Бот применяет миграции сам при старте (DB_AUTO_MIGRATE=true). С DB_AUTO_MIGRATE=false
+запускай upgrade перед обновлением бота. Повторный запуск безопасен.
+
+Запуск из корня проекта:
+  python scripts/migrate.py status
+  python scripts/migrate.py upgrade
+"""
+import asyncio
+import logging
+import sys
+from pathlib import Path
+
+# Добавить корень проекта в path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bot.database.migrations import MIGRATIONS, get_pending_migrations, get_schema_version, run_migrations
+from bot.database.session import engine
+
+
+async def status():
+    current = await get_schema_version(engine)
+    pending = await get_pending_migrations(engine)
+    print(f"БД: {engine.url.render_as_string(hide_password=True)}")
+    print(f"Версия схемы: {current} (последняя: {MIGRATIONS[-1].version})")
+    if pending:
+        print("Не применены:")
+        for m in pending:
+            print(f"  {m.version}: {m.name}")
+    else:
+        print("Все миграции применены.")
+    await engine.dispose()
+
+
+async def upgrade(target=None):
+    applied = await run_migrations(engine, target)
+    if applied:
+        for version, name in applied:
+            print(f"Применена миграция {version}: {name}")
+    else:
+        print("Нечего применять.")
+    print(f"Версия схемы: {await get_schema_version(engine)}")
+    await engine.dispose()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return
+    command = sys.argv[1].lower()
+    if command == "status":
+        asyncio.run(status())
+    elif command == "upgrade":
+        target = None
+        if len(sys.argv) == 4 and sys.argv[2] == "--to" and sys.argv[3].isdigit():
+            target = int(sys.argv[3])
+        elif len(sys.argv) != 2:
+            print("Использование: upgrade [--to N]")
+            return
+        asyncio.run(upgrade(target))
+    else:
+        print("Использование: status | upgrade [--to N]")
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Общие фикстуры тестов БД: каждый тест гоняется на обоих бэкендах.
+
+SQLite — временный файл; PostgreSQL — база из TEST_POSTGRES_URL (без неё тесты на PostgreSQL пропускаются).
+Внимание: таблицы бота в этой базе удаляются перед каждым тестом — не указывай рабочую базу.
+
+    TEST_POSTGRES_URL=postgresql://postgres@localhost/referral_bot_test python -m pytest -q
+"""
+import asyncio
+import os
+import sys
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+# bot.config читает окружение при импорте
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("CHANNEL_ID", "-1001")
+os.environ.setdefault("ENCRYPTION_KEY", "0123456789abcdef" * 4)
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine  # noqa: E402
+
+from bot.config import Settings  # noqa: E402
+from bot.database.migrations import run_migrations  # noqa: E402
+from bot.database.models import Base  # noqa: E402
+from bot.database.session import _engine_options  # noqa: E402
+
+POSTGRES_URL = os.environ.get("TEST_POSTGRES_URL", "")
+
+
+@pytest.fixture(params=[
+    "sqlite",
+    pytest.param("postgresql", marks=pytest.mark.skipif(not POSTGRES_URL, reason="TEST_POSTGRES_URL не задан")),
+])
+def database_url(request, tmp_path) -> str:
+    """DATABASE_URL пустой базы выбранного бэкенда."""
+    if request.param == "sqlite":
+        return f"sqlite+aiosqlite:///{tmp_path / 'test.db'}"
+    url = Settings.use_async_driver(POSTGRES_URL)
+    asyncio.run(_drop_tables(url))
+    return url
+
+
+async def _drop_tables(url: str) -> None:
+    engine = create_async_engine(url, **_engine_options(url))
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await engine.dispose()
+
+
+@asynccontextmanager
+async def open_db(url: str, migrate: bool = True):
+    """(engine, фабрика сессий) на url; migrate — сразу применить все миграции."""
+    engine = create_async_engine(url, **_engine_options(url))
+    try:
+        if migrate:
+            await run_migrations(engine)
+        yield engine, async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    finally:
+        await engine.dispose()
@@ -0,0 +1,199 @@
+"""Upsert'ы (dialect_insert), миграции и пагинация с оконным count() — на SQLite и PostgreSQL."""
+import asyncio
+
+from sqlalchemy import inspect, select
+
+from bot.database import crud
+from bot.database.cache import referral_link_cache, settings_cache
+from bot.database.migrations import (
+    MIGRATIONS,
+    MigrationOps,
+    get_pending_migrations,
+    get_schema_version,
+    run_migrations,
+)
+from bot.database.models import BotSetting, ReferralLink, UtmToken
+from tests.conftest import open_db
+
+
+def test_migrations_apply_once(database_url):
+    async def scenario():
+        async with open_db(database_url, migrate=False) as (engine, _):
+            applied = await run_migrations(engine)
+            assert [version for version, _ in applied] == [m.version for m in MIGRATIONS]
+            assert await get_schema_version(engine) == MIGRATIONS[-1].version
+            assert await get_pending_migrations(engine) == []
+            # Повторный запуск (рестарт бота, второй воркер) ничего не делает
+            assert await run_migrations(engine) == []
+            async with engine.connect() as conn:
+                indexes = await conn.run_sync(
+                    lambda c: {ix["name"] for table in ("users", "referrals", "grade_claims")
+                               for ix in inspect(c).get_indexes(table)}
+                )
+            assert {"ix_referrals_referrer_active", "ix_users_pending", "uq_grade_claims_user_grade"} <= indexes
+
+    asyncio.run(scenario())
+
+
+def test_get_or_create_user_upsert(database_url):
+    async def scenario():
+        async with open_db(database_url) as (_, session_maker):
+            async with session_maker() as session:
+                user, created = await crud.get_or_create_user(session, 1, username="alice", first_name="Alice")
+                assert created
+                await session.commit()
+            async with session_maker() as session:
+                same, created = await crud.get_or_create_user(session, 1, username="alice", first_name="Alice")
+                assert not created and same.id == user.id
+                renamed, created = await crud.get_or_create_user(session, 1, username="alice2", first_name="Alice")
+                assert not created and renamed.id == user.id
+                await session.commit()
+            async with session_maker() as session:
+                stored = await crud.get_user_by_telegram_id(session, 1)
+                assert crud._decrypt(stored.username) == "alice2"
+
+    asyncio.run(scenario())
+
+
+def test_get_or_create_user_created_flag(database_url):
+    async def scenario():
+        async with open_db(database_url) as (_, session_maker):
+            async with session_maker() as session:
+                # Новый пользователь — created, в той же и в следующих сессиях — уже нет
+                flags = [(await crud.get_or_create_user(session, 1))[1]]
+                flags.append((await crud.get_or_create_user(session, 1))[1])
+                flags.append((await crud.get_or_create_user(session, 2, username="bob", first_name="Bob"))[1])
+                await session.commit()
+            async with session_maker() as session:
+                flags.append((await crud.get_or_create_user(session, 2, username="bob", first_name="Bob"))[1])
+                flags.append((await crud.get_or_create_user(session, 2, username="bob2"))[1])
+                flags.append((await crud.get_or_create_user(session, 1, first_name="Alice"))[1])
+                await session.commit()
+            async with session_maker() as session:
+                first = await crud.get_user_by_telegram_id(session, 1)
+            return flags, first.first_name
+
+    flags, first_name = asyncio.run(scenario())
+    assert flags == [True, False, True, False, False, False]
+    assert first_name == "Alice"
+
+
+def test_set_bot_setting_upsert(database_url):
+    async def scenario():
+        settings_cache.invalidate()
+        async with open_db(database_url) as (_, session_maker):
+            async with session_maker() as session:
+                await crud.set_bot_setting(session, "welcome", "first")
+                await session.commit()
+            async with session_maker() as session:
+                await crud.set_bot_setting(session, "welcome", "second")
+                # До commit другие апдейты видят прежнее значение
+                assert settings_cache.get_str("welcome") == "first"
+                await session.commit()
+            assert settings_cache.get_str("welcome") == "second"
+            async with session_maker() as session:
+                await crud.set_bot_setting(session, "welcome", "rolled back")
+                await session.rollback()
+            assert settings_cache.get_str("welcome") != "rolled back"
+            async with session_maker() as session:
+                rows = (await session.execute(select(BotSetting.value).where(BotSetting.key == "welcome"))).all()
+                assert [value for value, in rows] == ["second"]
+
+    asyncio.run(scenario())
+
+
+def test_utm_tokens_upsert(database_url):
+    async def scenario():
+        async with open_db(database_url) as (_, session_maker):
+            email = crud._encrypt("user@example.com")
+            async with session_maker() as session:
+                token = await crud.get_or_create_utm_token(session, email, "email")
+                assert token
+                assert await crud.get_or_create_utm_token(session, email, "email") == token
+                await session.commit()
+            phones = [crud._encrypt(f"+7900000000{n}") for n in range(5)]
+            async with session_maker() as session:
+                tokens, created = await crud.ensure_utm_tokens_bulk(session, "phone", phones[:3])
+                assert created == 3
+                tokens, created = await crud.ensure_utm_tokens_bulk(session, "phone", phones)
+                assert created == 2 and set(tokens) == set(phones)
+                await session.commit()
+            async with session_maker() as session:
+                count = len((await session.execute(select(UtmToken.token))).all())
+                assert count == 1 + len(phones)
+
+    asyncio.run(scenario())
+
+
+def test_grade_users_page_total(database_url):
+    async def scenario():
+        async with open_db(database_url) as (_, session_maker):
+            async with session_maker() as session:
+                for telegram_id in range(1, 9):
+                    await crud.get_or_create_user(session, telegram_id, first_name=f"User{telegram_id}")
+                # Пользователь n (1..8) пригласил n человек
+                referred_id = 100
+                for referrer_id in range(1, 9):
+                    for _ in range(referrer_id):
+                        referred_id += 1
+                        await crud.get_or_create_user(session, referred_id)
+                        await crud.create_referral(session, referrer_id, referred_id)
+                grade = await crud.create_grade(session, referral_threshold=3, rewards=["Награда"])
+                await crud.create_grade_claim(session, 5, grade.id)
+                await session.commit()
+
+            async with session_maker() as session:
+                first, total = await crud.get_grade_users_page(session, grade.id, 3, limit=4, offset=0)
+                second, total_again = await crud.get_grade_users_page(session, grade.id, 3, limit=4, offset=4)
+                empty, empty_total = await crud.get_grade_users_page(session, grade.id, 3, limit=4, offset=8)
+            assert total == total_again == 6
+            assert [row[0] for row in first + second] == [3, 4, 5, 6, 7, 8]
+            assert [row[3] for row in first + second] == [3, 4, 5, 6, 7, 8]
+            assert [row[0] for row in first + second if row[4]] == [5]
+            assert (empty, empty_total) == ([], 0)
+
+    asyncio.run(scenario())
+
+
+def test_referral_links_store_tokens_only(database_url, monkeypatch):
+    async def scenario():
+        async with open_db(database_url) as (_, session_maker):
+            async with session_maker() as session:
+                await crud.get_or_create_user(session, 1, username="alice")
+                await crud.update_user_email(session, 1, "alice@example.com")
+                await crud.update_user_phone(session, 1, "+79001234567")
+                await session.commit()
+            referral_link_cache.pop(1)
+            async with session_maker() as session:
+                link = await crud.get_user_referral_link(session, 1)
+                assert link
+                await session.commit()
+                _, _, written = await crud.prepare_referral_links_batch(session)
+                await session.commit()
+                rows = (await session.execute(select(ReferralLink))).scalars().all()
+            referral_link_cache.pop(1)
+            return link, written, rows
+
+    link, written, rows = asyncio.run(scenario())
+    assert written == 1 and [row.link for row in rows] == [link]
+    assert "alice@example.com" not in link and "79001234567" not in link
+
+    # Без шифрования ссылка с открытыми email и телефоном собирается на лету и не сохраняется
+    monkeypatch.setattr(crud, "_encryption_key", lambda: b"")
+    link, written, rows = asyncio.run(scenario())
+    assert "79001234567" in link
+    assert written == 0 and rows == []
+
+
+def test_duplicate_telegram_id_index_dropped(database_url):
+    async def scenario():
+        async with open_db(database_url, migrate=False) as (engine, _):
+            await run_migrations(engine, target=1)
+            ops = MigrationOps(engine)
+            await ops.create_index("ix_users_telegram_id", "users", ["telegram_id"], unique=True)
+            await run_migrations(engine)
+            return await ops.unique_keys("users")
+
+    unique_keys = asyncio.run(scenario())
+    assert "ix_users_telegram_id" not in {name for name, _ in unique_keys}
+    assert ("telegram_id",) in {columns for _, columns in unique_keys}
@@ -0,0 +1,18 @@
+"""Горячие запросы не читают основные таблицы целиком (EXPLAIN, как scripts/check_query_plans.py)."""
+import asyncio
+
+from scripts.check_query_plans import collect_plans
+from tests.conftest import open_db
+
+
+def test_hot_queries_use_indexes(database_url):
+    async def scenario():
+        async with open_db(database_url) as (_, session_maker):
+            async with session_maker() as session:
+                plans = await collect_plans(session)
+                await session.rollback()
+        return plans
+
+    plans = asyncio.run(scenario())
+    assert plans and all(statements for _, statements, _ in plans)
+    assert {name: problems for name, _, problems in plans if problems} == {}